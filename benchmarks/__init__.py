@@ -0,0 +1,3 @@
+from .scores import synthetic_score, GENRE_PRESETS
+from .suite import micro_benchmarks, macro_benchmarks, differential_check
+from .report import compare_results, load_results, save_results
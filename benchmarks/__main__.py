@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Run the benchmark suite:
+
+    python -m benchmarks -o results.json
+    python -m benchmarks --quick --baseline baseline.json
+
+Exits with status 1 when a metric regressed against the baseline or an
+engine failed the differential audio check.
+"""
+import argparse
+import sys
+
+from .report import (
+    run_metadata, save_results, load_results, compare_results,
+    print_results, print_comparison
+)
+from .suite import micro_benchmarks, macro_benchmarks, differential_check
+
+SUITES = ('micro', 'macro', 'diff')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the synthesizer')
+    parser.add_argument('--suite', nargs='+', choices=SUITES, default=list(SUITES),
+                       help='Suites to run (default: all)')
+    parser.add_argument('--quick', action='store_true',
+                       help='Fewer repeats and smaller scores, for a fast check')
+    parser.add_argument('--output', '-o',
+                       help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', '-b',
+                       help='Results JSON to compare against and flag regressions')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                       help='Allowed slowdown or memory growth before flagging (default: 0.15)')
+    args = parser.parse_args()
+
+    results = {'meta': run_metadata(args.quick), 'benchmarks': {}}
+    if 'micro' in args.suite:
+        print("Running micro-benchmarks...")
+        results['benchmarks'].update(micro_benchmarks(args.quick))
+    if 'macro' in args.suite:
+        print("Running macro-benchmarks...")
+        results['benchmarks'].update(macro_benchmarks(args.quick))
+    if 'diff' in args.suite:
+        print("Running differential audio check...")
+        results['differential'] = differential_check(args.quick)
+
+    print()
+    print_results(results)
+    if args.output:
+        save_results(results, args.output)
+        print(f"\nResults written to {args.output}")
+
+    failed = any(not check['passed'] for check in results.get('differential', {}).values())
+    if args.baseline:
+        print(f"\nComparing against {args.baseline}...")
+        regressions = print_comparison(compare_results(load_results(args.baseline), results, args.threshold))
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Benchmark result files and regression comparison.
+"""
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from core.constants import ENGINE_VERSION
+
+# Metrics where a larger value in the new run is a regression
+LOWER_IS_BETTER = ('seconds', 'peak_rss_mb')
+
+
+def run_metadata(quick):
+    return {
+        'engine_version': ENGINE_VERSION,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'quick': quick,
+    }
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, threshold=0.15):
+    """
+    Compare every benchmark present in both runs. Returns a list of
+    (name, metric, baseline value, current value, ratio, regressed) rows;
+    a metric regresses when it grows by more than threshold.
+    """
+    rows = []
+    for name, metrics in current.get('benchmarks', {}).items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        for metric in LOWER_IS_BETTER:
+            before, after = previous.get(metric), metrics.get(metric)
+            if not before or after is None:
+                continue
+            ratio = after / before
+            rows.append((name, metric, before, after, ratio, ratio > 1 + threshold))
+    return rows
+
+
+def print_results(results, out=sys.stdout):
+    """Summary table of a results dict"""
+    print(f"{'benchmark':<32} {'seconds':>10} {'notes/s':>10} {'x realtime':>11} {'peak MB':>9}", file=out)
+    for name, metrics in results.get('benchmarks', {}).items():
+        def column(key, width, digits):
+            value = metrics.get(key)
+            return f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+        print(f"{name:<32} {column('seconds', 10, 4)} {column('notes_per_sec', 10, 1)} "
+              f"{column('realtime_factor', 11, 2)} {column('peak_rss_mb', 9, 1)}", file=out)
+
+    for engine, check in results.get('differential', {}).items():
+        status = 'ok' if check['passed'] else 'MISMATCH'
+        detail = (f"max {check['max_abs_diff']:.1f} LSB, rms {check['rms_diff']:.3f}"
+                  if 'max_abs_diff' in check else f"length {check['length_mismatch']}")
+        print(f"differential/{engine:<19} {status} ({detail})", file=out)
+
+
+def print_comparison(rows, out=sys.stdout):
+    regressions = [row for row in rows if row[5]]
+    for name, metric, before, after, ratio, regressed in rows:
+        flag = 'REGRESSION' if regressed else ''
+        print(f"{name:<32} {metric:<12} {before:>10.4f} -> {after:>10.4f} ({ratio:>5.2f}x) {flag}", file=out)
+    print(f"\n{len(regressions)} regression(s) in {len(rows)} compared metrics", file=out)
+    return regressions
@@ -0,0 +1,156 @@
+"""
+Synthetic sheet music for the macro benchmarks.
+
+Scores are built the way the random song generator in tools/script.js
+builds them (genre presets, bass patterns, chord progressions, arpeggios
+and random melodies), with knobs to scale the number of notes, tracks,
+chord density, note length and loops independently.
+"""
+import random
+
+NOTES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+GENRE_PRESETS = {
+    'pop': {
+        'tempos': [116, 120, 128],
+        'instruments': ['piano', 'synth', 'bass', 'guitar'],
+        'progressions': [['C', 'G', 'Am', 'F'], ['F', 'G', 'C', 'Am']],
+        'melody_notes': 8,
+        'bass_pattern': 'steady',
+    },
+    'rock': {
+        'tempos': [128, 132, 138],
+        'instruments': ['guitar', 'bass', 'synth'],
+        'progressions': [['Em', 'C', 'G', 'D'], ['Am', 'F', 'C', 'G']],
+        'melody_notes': 6,
+        'bass_pattern': 'driving',
+    },
+    'jazz': {
+        'tempos': [92, 108, 116],
+        'instruments': ['piano', 'bass', 'synth'],
+        'progressions': [['Cmaj7', 'Dm7', 'G7', 'Cmaj7'], ['Dm7', 'G7', 'Cmaj7', 'A7']],
+        'melody_notes': 12,
+        'bass_pattern': 'walking',
+    },
+    'electronic': {
+        'tempos': [128, 130, 140],
+        'instruments': ['synth', 'bass', 'synth'],
+        'progressions': [['Cm', 'Ab', 'Eb', 'Bb'], ['Gm', 'Bb', 'Dm', 'F']],
+        'melody_notes': 16,
+        'bass_pattern': 'arpeggio',
+    },
+    'ambient': {
+        'tempos': [70, 80, 85],
+        'instruments': ['synth', 'synth', 'synth'],
+        'progressions': [['Cmaj7', 'Am7', 'Fmaj7', 'G7'], ['Em7', 'Cmaj7', 'G', 'D']],
+        'melody_notes': 6,
+        'bass_pattern': 'drone',
+    },
+    'funk': {
+        'tempos': [96, 104, 108],
+        'instruments': ['guitar', 'bass', 'synth'],
+        'progressions': [['E9', 'G9', 'A9', 'B9'], ['Dm7', 'G7', 'Em7', 'A7']],
+        'melody_notes': 8,
+        'bass_pattern': 'slap',
+    },
+}
+
+
+def shift_pitch(note, semitones):
+    name, octave = note[:-1], int(note[-1])
+    index = NOTES.index(name) + semitones
+    return f"{NOTES[index % 12]}{octave + index // 12}"
+
+
+def chord_notes(root, kind='major'):
+    intervals = {'major': [0, 4, 7], 'minor': [0, 3, 7], '7th': [0, 4, 7, 10], 'maj7': [0, 4, 7, 11]}
+    return [shift_pitch(root, interval) for interval in intervals.get(kind, [0, 4, 7])]
+
+
+def chord_root(chord):
+    """'F#m7' -> 'F#'; Ab and Bb style flats map to their sharp names"""
+    name = chord[:2] if len(chord) > 1 and chord[1] in '#b' else chord[:1]
+    if name.endswith('b'):
+        name = NOTES[(NOTES.index(name[0]) - 1) % 12]
+    return name
+
+
+def bass_pattern(pattern, root, duration):
+    if pattern == 'driving':
+        return [(root, duration, volume) for volume in (0.9, 0.7, 0.8, 0.7)]
+    if pattern == 'walking':
+        return [(note, duration, 0.8) for note in [shift_pitch(root, step) for step in (0, 2, 4, 5)]]
+    if pattern == 'trap':
+        return [(root, duration * 2, 0.9), (shift_pitch(root, -12), duration * 2, 0.8)]
+    if pattern == 'drone':
+        return [(root, duration * 8, 0.6)]
+    if pattern == 'slap':
+        return [
+            (root, duration // 2, 0.9), (shift_pitch(root, 12), duration // 2, 0.7),
+            (root, duration // 2, 0.8), (shift_pitch(root, 7), duration // 2, 0.7)
+        ]
+    if pattern == 'arpeggio':
+        return [(note, duration, 0.8) for note in chord_notes(root)]
+    return [(root, duration * 4, 0.8)]
+
+
+def _note(pitch, duration, volume):
+    return {'pitch': pitch, 'duration': int(duration), 'volume': round(volume, 3)}
+
+
+def synthetic_score(genre='pop', notes=8, tracks=4, chord_density=0.25,
+                    note_ms=None, loops=1, seed=0):
+    """
+    Build a sheet music dict in the JSON format the loader reads.
+
+    notes         melody and accompaniment notes per track and section
+    tracks        number of tracks; the first is the bass line, the rest
+                  cycle through the genre's instruments
+    chord_density fraction of accompaniment steps played as full chords
+    note_ms       base note length (default: one beat of a preset tempo)
+    loops         plays for every section, all of which repeat
+    """
+    rng = random.Random(seed)
+    preset = GENRE_PRESETS[genre]
+    tempo = rng.choice(preset['tempos'])
+    base_duration = note_ms or 60000 // tempo
+    progression = rng.choice(preset['progressions'])
+    scale = chord_notes(f"{chord_root(progression[0])}4")
+
+    sections = []
+    for section_name in ('Verse', 'Chorus'):
+        section_tracks = []
+
+        bass = []
+        while len(bass) < notes:
+            for chord in progression:
+                bass.extend(bass_pattern(preset['bass_pattern'], f"{chord_root(chord)}3", base_duration))
+        section_tracks.append({'instrument': 'bass', 'notes': [_note(*note) for note in bass[:notes]]})
+
+        for track_idx in range(1, tracks):
+            instrument = preset['instruments'][(track_idx - 1) % len(preset['instruments'])]
+            track_notes = []
+            previous = None
+            while len(track_notes) < notes:
+                chord = progression[len(track_notes) % len(progression)]
+                harmony = chord_notes(f"{chord_root(chord)}4", 'minor' if 'm' in chord.replace('maj', '') else 'major')
+                if rng.random() < chord_density:
+                    track_notes.append({
+                        'type': 'chord',
+                        'notes': [_note(pitch, base_duration * 2, 0.6) for pitch in harmony]
+                    })
+                elif section_name == 'Chorus':
+                    # Random melody, avoiding repeated notes
+                    pitch = rng.choice([note for note in scale if note != previous])
+                    duration = base_duration * (2 if rng.random() < 0.3 else 1)
+                    track_notes.append(_note(pitch, duration, 0.6 + rng.random() * 0.3))
+                    previous = pitch
+                else:
+                    # Arpeggiated accompaniment
+                    step = len(track_notes) % len(harmony)
+                    track_notes.append(_note(harmony[step], base_duration, (0.8, 0.6, 0.7, 0.6)[step % 4]))
+            section_tracks.append({'instrument': instrument, 'notes': track_notes})
+
+        sections.append({'name': section_name, 'repeat': True, 'tracks': section_tracks})
+
+    return {'metadata': {'tempo': tempo, 'loops': loops}, 'sections': sections}
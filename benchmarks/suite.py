@@ -0,0 +1,189 @@
+"""
+Micro and macro benchmarks plus a differential audio check.
+
+Every benchmark returns a dict of metrics; lower 'seconds' is better.
+Macro cases run in a fresh spawned process each, so their peak RSS and
+cold note caches are not polluted by the cases before them.
+"""
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from core.audio_utils import (
+    generate_instrument_tone, mix_audio, apply_body_resonance,
+    apply_string_resonance, apply_bright_attack
+)
+from core.cache import NOTE_CACHE
+from core.instruments import AVAILABLE_INSTRUMENTS
+from core.master import MasterBus
+from core.mixer import StereoBus, pan_matrix
+from core.timeline import ms_to_frames
+from core.tracing import peak_rss_mb
+from effects.envelope import apply_enhanced_envelope
+from parsers.sheet_music import load_sheet_music_from_json, parse_sheet_music, stream_sheet_music
+
+from .scores import synthetic_score
+
+# Each macro axis is scaled on its own from the default score
+MACRO_DEFAULTS = {'notes': 16, 'tracks': 4, 'chord_density': 0.25, 'note_ms': 500, 'loops': 2}
+MACRO_AXES = {
+    'notes': [8, 32, 128],
+    'tracks': [1, 4, 8],
+    'chord_density': [0.0, 0.5, 1.0],
+    'note_ms': [125, 500, 2000],
+    'loops': [1, 4, 16],
+}
+QUICK_AXES = {axis: values[:2] for axis, values in MACRO_AXES.items()}
+
+# Engines whose output must match the thread backend
+DIFF_TOLERANCE_LSB = 1.0
+
+
+def time_call(function, repeats):
+    """Best and mean wall time of repeated calls"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {'seconds': min(timings), 'mean_seconds': sum(timings) / len(timings), 'repeats': repeats}
+
+
+def _with_rate(result, audio_seconds, notes=1):
+    result['notes_per_sec'] = notes / result['seconds'] if result['seconds'] else None
+    result['realtime_factor'] = audio_seconds / result['seconds'] if result['seconds'] else None
+    return result
+
+
+def micro_benchmarks(quick=False):
+    """Per instrument tone generation, per effect, the mixer and the master bus"""
+    repeats = 3 if quick else 10
+    duration_ms = 1000
+    results = {}
+
+    for name, instrument in AVAILABLE_INSTRUMENTS.items():
+        results[f"micro/tone/{name}"] = _with_rate(time_call(
+            lambda: generate_instrument_tone(261.63, instrument, duration_ms, 0.8), repeats
+        ), duration_ms / 1000)
+
+    tone = generate_instrument_tone(261.63, AVAILABLE_INSTRUMENTS['synth'], duration_ms, 0.8)
+    effects = {
+        'envelope': lambda: apply_enhanced_envelope(tone, AVAILABLE_INSTRUMENTS['piano']),
+        'body_resonance': lambda: apply_body_resonance(tone),
+        'string_resonance': lambda: apply_string_resonance(tone, 261.63),
+        'bright_attack': lambda: apply_bright_attack(tone),
+    }
+    for name, effect in effects.items():
+        results[f"micro/effect/{name}"] = _with_rate(time_call(effect, repeats), duration_ms / 1000)
+
+    chord = [
+        generate_instrument_tone(frequency, AVAILABLE_INSTRUMENTS['piano'], duration_ms, 0.7)
+        for frequency in (261.63, 329.63, 392.00)
+    ]
+    results["micro/mixer/mix_audio"] = _with_rate(
+        time_call(lambda: mix_audio(*chord), repeats), duration_ms / 1000, len(chord)
+    )
+
+    # Inserting 100 panned notes into a 10 second bus
+    note = np.array(tone.get_array_of_samples(), dtype=np.float32)
+    gains = pan_matrix(0.2)
+    def bus_mix():
+        bus = StereoBus(10000)
+        for position in range(0, 10000, 100):
+            bus.insert(note, ms_to_frames(position), gains)
+        bus.compress()
+    results["micro/mixer/bus"] = _with_rate(time_call(bus_mix, repeats), 10.0, 100)
+
+    # Limiting and metering 10 seconds of loud noise, then normalizing it
+    noise = np.random.default_rng(0).normal(0, 12000, (2, ms_to_frames(10000))).astype(np.float32)
+    for name, master in (('limit', MasterBus()), ('normalize', MasterBus(target_lufs=-14))):
+        results[f"micro/master/{name}"] = _with_rate(
+            time_call(lambda: master.process(noise.copy()), repeats), 10.0
+        )
+
+    return results
+
+
+def _write_score(score, directory):
+    path = os.path.join(directory, 'score.json')
+    with open(path, 'w') as f:
+        json.dump(score, f)
+    return path
+
+
+def run_macro_case(params):
+    """Render one synthetic score and measure it; runs inside its own process"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = _write_score(synthetic_score(**params), directory)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            score = load_sheet_music_from_json(path, AVAILABLE_INSTRUMENTS, use_cache=False)
+            audio = parse_sheet_music(score)
+        seconds = time.perf_counter() - start
+
+    notes = int(score.note_counts().sum())
+    result = _with_rate({'seconds': seconds, 'notes': notes}, audio.duration_seconds, notes)
+    result['audio_seconds'] = audio.duration_seconds
+    result['peak_rss_mb'] = peak_rss_mb(include_children=False)
+    return result
+
+
+def macro_benchmarks(quick=False):
+    """Render synthetic scores scaled along one axis at a time"""
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for axis, values in (QUICK_AXES if quick else MACRO_AXES).items():
+        for value in values:
+            params = dict(MACRO_DEFAULTS, **{axis: value})
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[f"macro/{axis}/{value}"] = executor.submit(run_macro_case, params).result()
+    return results
+
+
+def differential_check(quick=False):
+    """
+    Render one score with every engine and compare against the thread backend.
+    Notes are seeded by their content, so even a render from a cold note
+    cache ('cold') draws the same noise, and any difference comes from
+    scheduling and mixing.
+    """
+    params = dict(MACRO_DEFAULTS, notes=8 if quick else 16)
+    with tempfile.TemporaryDirectory() as directory:
+        path = _write_score(synthetic_score(**params), directory)
+        with contextlib.redirect_stdout(io.StringIO()):
+            score = load_sheet_music_from_json(path, AVAILABLE_INSTRUMENTS, use_cache=False)
+            NOTE_CACHE.clear()
+            reference = parse_sheet_music(score, workers=1).samples
+            renders = {
+                'process': parse_sheet_music(score, backend='process', workers=2).samples,
+                'stream': np.concatenate(list(stream_sheet_music(score)), axis=1),
+            }
+            NOTE_CACHE.clear()
+            renders['cold'] = parse_sheet_music(score, workers=4).samples
+
+    def to_pcm(samples):
+        return np.clip(np.rint(samples.T.ravel()), -32768, 32767).astype(np.float64)
+
+    reference = to_pcm(reference)
+    results = {}
+    for engine, audio in renders.items():
+        samples = to_pcm(audio)
+        if len(samples) != len(reference):
+            results[engine] = {'length_mismatch': [len(reference), len(samples)], 'passed': False}
+            continue
+        difference = samples - reference
+        max_abs = float(np.abs(difference).max(initial=0))
+        rms = float(np.sqrt(np.mean(difference ** 2))) if len(difference) else 0.0
+        results[engine] = {
+            'max_abs_diff': max_abs,
+            'rms_diff': rms,
+            'passed': max_abs <= DIFF_TOLERANCE_LSB
+        }
+    return results
@@ -1,5 +1,14 @@
 from .constants import *
 from .instruments import *
 from .notes import *
+from .wavetables import *
+from .oscillators import *
+from .resonance_bank import *
+from .score import *
 from .audio_utils import *
+from .timeline import *
+from .mixer import *
+from .master import *
+from .cache import *
+from .tracing import *
 from .notes import Note, Chord
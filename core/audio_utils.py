@@ -1,96 +1,263 @@
 import numpy as np
-from pydub.generators import Sine, Square, Triangle, Sawtooth
 from pydub import AudioSegment
+from pydub.utils import db_to_float
 import simpleaudio as sa
 import time
+import wave
 
-def generate_instrument_tone(frequency, instrument, duration_ms, volume):
+from .oscillators import oscillator_bank
+from .resonance_bank import add_resonance, body_resonance_tail, string_resonance_tail, string_noise
+from .timeline import SAMPLE_RATE, INT16_MAX, samples_to_segment, segment_to_samples
+from .mixer import StereoBus, compress, spread_gains
+from .tracing import TRACER
+from .seeding import DEFAULT_SEED, note_rng, ensure_rng
+
+WAVE_TYPES = ('sine', 'square', 'triangle', 'sawtooth')
+
+def generate_instrument_tone(frequency, instrument, duration_ms, volume, seed=DEFAULT_SEED,
+                             sample_rate=SAMPLE_RATE):
     """Generate a tone with enhanced instrument characteristics"""
+    return generate_instrument_tones([frequency], instrument, duration_ms, [volume], seed, sample_rate)[0]
+
+
+def generate_instrument_tones(frequencies, instrument, duration_ms, volumes, seed=DEFAULT_SEED,
+                              sample_rate=SAMPLE_RATE):
+    """
+    Generate tones of one instrument and length (e.g. the notes of a chord).
+    All partials and detune voices of every tone are rendered by a single
+    oscillator_bank call instead of one pydub generator per wave.
+    """
+    rngs = tone_rngs(instrument, frequencies, duration_ms, volumes, seed)
+    tones = _synthesize_tones(frequencies, instrument, duration_ms, volumes, rngs, sample_rate)
+    if _is_percussion(instrument):
+        return tones
+    return [
+        _apply_instrument_effects(audio, instrument, frequency, rng, seed, sample_rate)
+        for audio, frequency, rng in zip(tones, frequencies, rngs)
+    ]
+
+
+def tone_rngs(instrument, frequencies, duration_ms, volumes, seed=DEFAULT_SEED):
+    """One generator per tone, seeded by the tone's content"""
+    patch_key = instrument.patch_key()
+    return [
+        note_rng(seed, patch_key, frequency, duration_ms, volume)
+        for frequency, volume in zip(frequencies, volumes)
+    ]
+
+
+def render_instrument_tones(frequencies, instrument, duration_ms, volumes, rngs=None, seed=DEFAULT_SEED,
+                            sample_rate=SAMPLE_RATE):
+    """
+    Float counterpart of generate_instrument_tones for the renderer. Each tone
+    is returned as a (channels, frames) float32 array at sample_rate. The
+    effects read a tone sample by sample with its channels interleaved, the
+    way they read an AudioSegment, and are added in place into that stream;
+    the array is a view of it, so tone.T.ravel() gives the stream back
+    without a copy. Tones draw their noise from rngs (default: seeded by
+    their content).
+    """
+    if rngs is None:
+        rngs = tone_rngs(instrument, frequencies, duration_ms, volumes, seed)
+    with TRACER.span('tone', instrument=instrument.name, notes=len(frequencies)):
+        tones = _synthesize_tones(frequencies, instrument, duration_ms, volumes, rngs, sample_rate)
+
+    rendered = []
+    for tone, frequency, rng in zip(tones, frequencies, rngs):
+        # Round like the int16 tone would be, then keep the effects in float
+        samples = segment_to_samples(tone, sample_rate) if isinstance(tone, AudioSegment) else np.clip(
+            np.rint(tone), -INT16_MAX - 1, INT16_MAX
+        )
+        interleaved = np.ascontiguousarray(np.atleast_2d(samples).T, dtype=np.float32)
+        if not _is_percussion(instrument):
+            _add_instrument_effects(interleaved.ravel(), instrument, frequency, sample_rate, rng, seed)
+        rendered.append(interleaved.T)
+    return rendered
+
+
+def _synthesize_tones(frequencies, instrument, duration_ms, volumes, rngs, sample_rate=SAMPLE_RATE):
+    """Raw tones before effects, as (channels, frames) int16-unit arrays or AudioSegments"""
     # if the instrument is none, return a silent audio segment with the duration
     if instrument.name == 'none':
-        return AudioSegment.silent(duration=duration_ms)
+        return [AudioSegment.silent(duration=duration_ms) for _ in frequencies]
 
     base_volume = -12
-    volume_adjustment = -20 * (1.0 - volume)
-    volume_db = base_volume + volume_adjustment
-
-    def create_generator(wave_type, freq):
-        if wave_type == 'sine':
-            return Sine(freq)
-        elif wave_type == 'square':
-            return Square(freq)
-        elif wave_type == 'triangle':
-            return Triangle(freq)
-        elif wave_type == 'sawtooth':
-            return Sawtooth(freq)
-        elif wave_type == 'noise':
-            return None
-        else:
-            return Sine(freq)
+    volumes_db = [base_volume + -20 * (1.0 - volume) for volume in volumes]
 
     # Handle percussion instruments
-    if hasattr(instrument, 'wave_type') and (
-        (isinstance(instrument.wave_type, list) and 'noise' in instrument.wave_type) or
-        instrument.wave_type == 'noise'
-    ):
-        return generate_enhanced_percussion(instrument, duration_ms, volume_db)
+    if _is_percussion(instrument):
+        return [
+            generate_enhanced_percussion(instrument, duration_ms, volume_db, rng, sample_rate)
+            for volume_db, rng in zip(volumes_db, rngs)
+        ]
 
     # Handle piano's complex tone
     if hasattr(instrument, 'wave_type') and instrument.wave_type == 'complex':
-        return generate_piano_tone(frequency, duration_ms, volume_db, instrument)
-
-    # Handle multi-waveform instruments
-    if hasattr(instrument, 'wave_type') and isinstance(instrument.wave_type, list):
-        segments = []
-        for i, wave in enumerate(instrument.wave_type):
-            generator = create_generator(wave, frequency)
-            if generator is None:
-                continue
+        tones = [
+            generate_piano_tone(frequency, duration_ms, volume_db, instrument, volume, rng, sample_rate)
+            for frequency, volume_db, volume, rng in zip(frequencies, volumes_db, volumes, rngs)
+        ]
+    else:
+        # Stack every tone's voices block-diagonally so one kernel call renders them all
+        voices = [
+            _tone_voices(frequency, instrument, volume_db)
+            for frequency, volume_db in zip(frequencies, volumes_db)
+        ]
+        n_outputs = sum(gains.shape[0] for _, _, gains, _ in voices)
+        n_voices = sum(gains.shape[1] for _, _, gains, _ in voices)
+        all_frequencies, all_wave_types = [], []
+        all_gains = np.zeros((n_outputs, n_voices))
+        output_row = voice_row = 0
+        for tone_frequencies, wave_types, gains, _ in voices:
+            all_frequencies.extend(tone_frequencies)
+            all_wave_types.extend(wave_types)
+            all_gains[output_row:output_row + gains.shape[0],
+                      voice_row:voice_row + gains.shape[1]] = gains
+            output_row += gains.shape[0]
+            voice_row += gains.shape[1]
+
+        n_samples = int(sample_rate * (duration_ms / 1000.0))
+        rendered = oscillator_bank(all_frequencies, all_gains, n_samples, sample_rate, all_wave_types)
+
+        tones = []
+        output_row = 0
+        for _, _, gains, needs_compress in voices:
+            samples = rendered[output_row:output_row + gains.shape[0]]
+            output_row += gains.shape[0]
+            if needs_compress:
+                samples = compress_samples(samples)
+            tones.append(samples)
+
+    return tones
+
+
+def _is_percussion(instrument):
+    return hasattr(instrument, 'wave_type') and (
+        (isinstance(instrument.wave_type, list) and 'noise' in instrument.wave_type) or
+        instrument.wave_type == 'noise'
+    )
 
-            mix_volume = volume_db
-            if hasattr(instrument, 'wave_mix') and len(instrument.wave_mix) > i:
-                mix_volume += (20 * np.log10(instrument.wave_mix[i]))
 
-            segment = generator.to_audio_segment(duration=duration_ms).apply_gain(mix_volume)
+def is_pitched(instrument):
+    """Whether an instrument's tones follow their frequency (percussion and 'none' do not)"""
+    return instrument.name != 'none' and not _is_percussion(instrument)
+
+
+def _tone_voices(frequency, instrument, volume_db):
+    """
+    Oscillator voices for one tone as (frequencies, wave types, output gains,
+    compress). Wave mixes have stereo outputs and are compressed like mix_audio.
+    """
+    wave_type = getattr(instrument, 'wave_type', 'sine')
+    if not isinstance(wave_type, list):
+        wave_type = wave_type if wave_type in WAVE_TYPES else 'sine'
+        return [frequency], [wave_type], np.array([[db_to_float(volume_db)]]), False
+
+    # Handle multi-waveform instruments: each wave (plus its detuned copy) is one mix segment
+    frequencies, wave_types, segments, levels = [], [], [], []
+    segment = -1
+    for i, wave_name in enumerate(instrument.wave_type):
+        if wave_name == 'noise':
+            continue
+
+        mix_volume = volume_db
+        if hasattr(instrument, 'wave_mix') and len(instrument.wave_mix) > i:
+            mix_volume += (20 * np.log10(instrument.wave_mix[i]))
+
+        segment += 1
+        frequencies.append(frequency)
+        wave_types.append(wave_name if wave_name in WAVE_TYPES else 'sine')
+        segments.append(segment)
+        levels.append(db_to_float(mix_volume))
+
+        if hasattr(instrument, 'detune_cents') and i > 0:
+            detune_factor = 2 ** (instrument.detune_cents / 1200)
+            frequencies.append(frequency * detune_factor)
+            wave_types.append('sine')
+            segments.append(segment)
+            levels.append(db_to_float(mix_volume - 3))
 
-            if hasattr(instrument, 'detune_cents') and i > 0:
-                detune_factor = 2 ** (instrument.detune_cents / 1200)
-                detuned_freq = frequency * detune_factor
-                detuned = Sine(detuned_freq).to_audio_segment(duration=duration_ms).apply_gain(mix_volume - 3)
-                segment = segment.overlay(detuned)
+    if not frequencies:
+        return [frequency], ['sine'], np.array([[db_to_float(volume_db)]]), False
 
-            segments.append(segment)
+    n_segments = segment + 1
+    weights = spread_gains(n_segments)
+    return frequencies, wave_types, weights[:, segments] * np.array(levels), n_segments > 1
+
+
+# Rough synthesis cost of a tone in milliseconds of CPU: a fixed cost per
+# note, plus per second of audio a base cost (envelope, conversions), one
+# unit per oscillator and a surcharge per resonance layer. String tails are
+# cached per pitch, so they cost most of their render on every new note.
+TONE_COST_FIXED_MS = 0.5
+TONE_COST_BASE_MS = 0.5
+TONE_COST_VOICE_MS = 1.0
+TONE_COST_BODY_MS = 6.0
+TONE_COST_STRING_MS = 10.0
+TONE_COST_STRING_FIXED_MS = 2.0
 
-        if segments:
-            audio = mix_audio(*segments)
+
+def tone_cost(instrument, duration_ms, frequency=440.0, sample_rate=SAMPLE_RATE):
+    """Estimated milliseconds to synthesize and envelope one tone, for scheduling"""
+    fixed = TONE_COST_FIXED_MS
+    if instrument.name == 'none':
+        voices = 0
+    elif _is_percussion(instrument):
+        if instrument.name == 'claves':
+            # Three modes, the click and the wood resonance, at most 80 ms long
+            duration_ms, voices = min(duration_ms, 80), 5
         else:
-            generator = Sine(frequency)
-            audio = generator.to_audio_segment(duration=duration_ms).apply_gain(volume_db)
+            # A fundamental and three overtones per membrane mode, plus the noise
+            voices = 4 * len(getattr(instrument, 'resonance_freq', [])) + 1
+    elif hasattr(instrument, 'wave_type') and instrument.wave_type == 'complex':
+        voices = len(instrument.harmonics) + (3 if frequency > 500 else 0)
     else:
-        wave_type = getattr(instrument, 'wave_type', 'sine')
-        if isinstance(wave_type, list):
-            wave_type = wave_type[0]
-
-        generator = create_generator(wave_type, frequency)
-        audio = generator.to_audio_segment(duration=duration_ms).apply_gain(volume_db)
-
-    # Apply instrument-specific effects
-    if hasattr(instrument, 'body_resonance') and instrument.body_resonance:
-        audio = apply_body_resonance(audio)
-    if hasattr(instrument, 'string_resonance') and instrument.string_resonance:
-        audio = apply_string_resonance(audio, frequency)
+        voices = len(_tone_voices(frequency, instrument, 0.0)[0])
+
+    per_second = TONE_COST_BASE_MS + voices * TONE_COST_VOICE_MS
+    if not _is_percussion(instrument):
+        if getattr(instrument, 'body_resonance', False):
+            per_second += TONE_COST_BODY_MS
+        if getattr(instrument, 'string_resonance', False):
+            per_second += TONE_COST_STRING_MS
+            fixed += TONE_COST_STRING_FIXED_MS
+    return fixed + per_second * (sample_rate / SAMPLE_RATE) * duration_ms / 1000
+
+
+def _apply_instrument_effects(audio, instrument, frequency, rng=None, seed=DEFAULT_SEED,
+                              sample_rate=SAMPLE_RATE):
+    """Apply instrument-specific effects"""
+    if not isinstance(audio, AudioSegment):
+        audio = samples_to_segment(audio, sample_rate)
+    if not any(
+        getattr(instrument, effect, False)
+        for effect in ('body_resonance', 'string_resonance', 'bright_attack')
+    ):
+        return audio
+
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    _add_instrument_effects(samples, instrument, frequency, audio.frame_rate, rng, seed)
+    return samples_to_segment(samples, audio.frame_rate)
+
+
+def _add_instrument_effects(samples, instrument, frequency, sample_rate, rng=None, seed=DEFAULT_SEED):
+    """Add instrument-specific effects to a float stream in place"""
+    # Body and string resonance come from one cached, fused tail
+    with TRACER.span('resonance', instrument=instrument.name):
+        add_resonance(samples, instrument, frequency, sample_rate, rng, seed)
     if hasattr(instrument, 'bright_attack') and instrument.bright_attack:
-        audio = apply_bright_attack(audio)
+        with TRACER.span('bright_attack', instrument=instrument.name):
+            add_bright_attack(samples, sample_rate, rng)
 
-    return audio
+    return samples
 
 
-def generate_enhanced_percussion(instrument, duration_ms, volume_db):
+def generate_enhanced_percussion(instrument, duration_ms, volume_db, rng=None, sample_rate=SAMPLE_RATE):
     """Generate enhanced percussion with more realistic characteristics"""
+    rng = ensure_rng(rng, 'percussion', instrument.name, duration_ms, volume_db)
     if instrument.name == 'bongos':
         # Create multiband resonance for more realistic bongo sound
         noise = AudioSegment.silent(duration=duration_ms)
-        sample_rate = 44100
         t = np.linspace(0, duration_ms/1000, int(sample_rate * duration_ms/1000))
         
         # Main membrane resonance
@@ -107,14 +274,14 @@ def generate_enhanced_percussion(instrument, duration_ms, volume_db):
             
             # Add initial strike transient
             strike_duration = int(0.005 * sample_rate)
-            strike = np.random.normal(0, 1, strike_duration) * np.exp(-100 * np.linspace(0, 1, strike_duration))
+            strike = rng.normal(0, 1, strike_duration) * np.exp(-100 * np.linspace(0, 1, strike_duration))
             wave[:strike_duration] += strike * 0.5
             
             # Add subtle noise throughout
-            noise_factor = np.random.rand(len(wave)) * decay * 0.2
+            noise_factor = rng.random(len(wave)) * decay * 0.2
             wave += noise_factor
             
-            samples = np.int16(wave * 32767)
+            samples = np.int16(np.clip(wave, -1.0, 1.0) * 32767)
             partial = AudioSegment(
                 samples.tobytes(),
                 frame_rate=sample_rate,
@@ -126,7 +293,6 @@ def generate_enhanced_percussion(instrument, duration_ms, volume_db):
         return noise.apply_gain(volume_db)
 
     elif instrument.name == 'claves':
-        sample_rate = 44100
         duration = min(duration_ms, 80)  # Slightly longer for more resonance
         t = np.linspace(0, duration/1000, int(sample_rate * duration/1000))
         
@@ -141,7 +307,7 @@ def generate_enhanced_percussion(instrument, duration_ms, volume_db):
         
         # Add realistic wood impact
         click_duration = int(0.002 * sample_rate)  # Shorter, sharper click
-        click = np.random.rand(click_duration)
+        click = rng.random(click_duration)
         click_env = np.exp(-200 * np.linspace(0, 1, click_duration))
         wave[:click_duration] += click * click_env * 2.0
         
@@ -150,7 +316,7 @@ def generate_enhanced_percussion(instrument, duration_ms, volume_db):
         wood_resonance = np.sin(2 * np.pi * wood_freq * t) * np.exp(-30 * t) * 0.1
         wave += wood_resonance
         
-        samples = np.int16(wave * 32767)
+        samples = np.int16(np.clip(wave, -1.0, 1.0) * 32767)
         return AudioSegment(
             samples.tobytes(),
             frame_rate=sample_rate,
@@ -159,280 +325,133 @@ def generate_enhanced_percussion(instrument, duration_ms, volume_db):
         ).apply_gain(volume_db)
 
 
-def generate_piano_tone(frequency, duration_ms, volume_db, instrument):
+def generate_piano_tone(frequency, duration_ms, volume_db, instrument, volume=0.7, rng=None,
+                        sample_rate=SAMPLE_RATE):
     """Generate enhanced piano tone with realistic harmonics and string resonance"""
-    harmonics = []
+    rng = ensure_rng(rng, 'piano', frequency, duration_ms, volume_db)
+    frequencies = []
+    levels = []
     
     # Main harmonics with more natural decay
     for i, strength in enumerate(instrument.harmonics):
-        harmonic_freq = frequency * (i + 1)
         # Higher harmonics decay faster
         decay_factor = np.exp(-0.5 * i)  
-        volume_adjustment = 20 * np.log10(strength * decay_factor)
+        level_db = volume_db + 20 * np.log10(strength * decay_factor)
         
         # Add slight detuning for more natural sound
-        detune = 1.0 + (np.random.uniform(-0.0001, 0.0001) * (i + 1))
-        harmonic_freq *= detune
-        
-        harmonic = Sine(harmonic_freq).to_audio_segment(duration=duration_ms)
-        harmonic = harmonic.apply_gain(volume_db + volume_adjustment)
+        detune = 1.0 + (rng.uniform(-0.0001, 0.0001) * (i + 1))
         
         # Add dynamic filtering based on velocity
         if volume > 0.7:  # Harder strikes have more high harmonics
-            high_freq_boost = 3 * (volume - 0.7)
-            harmonic = harmonic.apply_gain(high_freq_boost)
+            level_db += 3 * (volume - 0.7)
         
-        harmonics.append(harmonic)
+        frequencies.append(frequency * (i + 1) * detune)
+        levels.append(db_to_float(level_db))
 
     # Add sympathetic resonance for higher notes
     if frequency > 500:
         # Multiple inharmonic frequencies for rich high notes
-        inharmonic_freqs = [
-            frequency * 2.002,  # Slight sharp
-            frequency * 1.998,  # Slight flat
-            frequency * 2.015   # Higher partial
-        ]
-        for inharm_freq in inharmonic_freqs:
-            inharmonic = Sine(inharm_freq).to_audio_segment(duration=duration_ms)
-            inharmonic = inharmonic.apply_gain(volume_db - 15)
-            harmonics.append(inharmonic)
-
-    mixed = mix_audio(*harmonics)
+        for ratio in (2.002, 1.998, 2.015):  # Slight sharp, slight flat, higher partial
+            frequencies.append(frequency * ratio)
+            levels.append(db_to_float(volume_db - 15))
+
+    # Each partial is one mix segment, panned and gain staged as mix_audio would
+    gains = spread_gains(len(frequencies)) * np.array(levels)
+    n_samples = int(sample_rate * (duration_ms / 1000.0))
+    mixed = oscillator_bank(frequencies, gains, n_samples, sample_rate)
+    if len(frequencies) > 1:
+        mixed = compress_samples(mixed)
     
     # Add initial attack transient for more realism
-    attack_duration = min(int(0.02 * 44100), len(mixed.get_array_of_samples()))
-    attack_noise = np.random.normal(0, 0.1, attack_duration)
+    attack_duration = min(int(0.02 * sample_rate), mixed.size)
+    attack_noise = rng.normal(0, 0.1, attack_duration)
     attack_env = np.exp(-20 * np.linspace(0, 1, attack_duration))
     attack_samples = (attack_noise * attack_env * 32767).astype(np.int16)
+    mixed[:, :attack_duration] += attack_samples[:mixed.shape[1]] * db_to_float(volume_db)
     
-    attack_segment = AudioSegment(
-        attack_samples.tobytes(),
-        frame_rate=44100,
-        sample_width=2,
-        channels=1
-    ).apply_gain(volume_db)
-    
-    return mixed.overlay(attack_segment)
+    return samples_to_segment(mixed, sample_rate)
+
+
+def compress_samples(samples, threshold=0.7, ratio=2.0):
+    """Gentle compression of samples above a threshold relative to full scale"""
+    return compress(np.array(samples, dtype=np.float64), threshold, ratio)
 
 
 def mix_audio(*audio_segments):
-    """Enhanced audio mixing with better dynamics and stereo field"""
+    """
+    Mix segments on a float32 stereo bus: each is spread across the stereo
+    field as it is inserted, the mix is gain staged once and compressed once.
+    """
     if not audio_segments:
         return AudioSegment.silent(duration=0)
 
-    # Normalize lengths
-    max_length = max(len(segment) for segment in audio_segments)
-    normalized_segments = []
-
-    for segment in audio_segments:
-        if len(segment) < max_length:
-            # Crossfade silence for smoother transitions
-            fade_duration = min(100, len(segment))  # 100ms fade or shorter
-            silence = AudioSegment.silent(duration=max_length - len(segment))
-            if fade_duration > 0:
-                segment = segment.fade_out(fade_duration)
-                silence = silence.fade_in(fade_duration)
-            normalized_segments.append(segment + silence)
+    frame_rate = audio_segments[0].frame_rate
+    sources = [segment_to_samples(segment, frame_rate) for segment in audio_segments]
+    bus = StereoBus(frames=max(samples.shape[1] for samples in sources), sample_rate=frame_rate)
+    gains = spread_gains(len(sources))
+    for idx, samples in enumerate(sources):
+        if samples.shape[0] == 1:
+            bus.insert(samples, 0, gains[:, idx:idx + 1])
         else:
-            normalized_segments.append(segment)
-
-    # Apply subtle stereo enhancement
-    stereo_width = 0.3  # Adjust stereo width
-    for i, segment in enumerate(normalized_segments):
-        # Create subtle stereo positioning
-        pan_position = ((i % 3) - 1) * stereo_width
-        normalized_segments[i] = segment.pan(pan_position)
-
-    # Mix with dynamic gain staging
-    mixed = normalized_segments[0]
-    if len(normalized_segments) > 1:
-        # Calculate gain reduction based on number of tracks
-        gain_reduction = -2 * np.log2(len(normalized_segments))
-        
-        for segment in normalized_segments[1:]:
-            mixed = mixed.overlay(segment)
-            mixed = mixed.apply_gain(gain_reduction)
-
-        # Apply gentle compression for better cohesion
-        samples = np.array(mixed.get_array_of_samples())
-        peak = np.max(np.abs(samples))
-        if peak > 0:
-            ratio = 2.0  # Compression ratio
-            threshold = 0.7  # Threshold relative to peak
-            threshold_val = threshold * 32767
-            
-            # Avoid divide by zero by masking zero samples
-            nonzero_mask = np.abs(samples) > 0
-            gain_reduction = np.ones_like(samples, dtype=float)
-            
-            # Only process non-zero samples
-            above_threshold = np.abs(samples) > threshold_val
-            gain_reduction[above_threshold & nonzero_mask] = (
-                (threshold_val + (np.abs(samples[above_threshold & nonzero_mask]) - threshold_val) / ratio) /
-                np.abs(samples[above_threshold & nonzero_mask])
-            )
-            
-            samples = (samples * gain_reduction).astype(np.int16)
-            
-            mixed = AudioSegment(
-                samples.tobytes(),
-                frame_rate=mixed.frame_rate,
-                sample_width=mixed.sample_width,
-                channels=mixed.channels
-            )
+            # Stereo sources are balanced by the same gains, channel by channel
+            bus.insert(samples, 0, np.diag(gains[:, idx]))
 
-    return mixed
+    if len(sources) > 1:
+        bus.compress()
+    return bus.to_audio_segment()
 
 def apply_body_resonance(audio):
     """Simulate acoustic instrument body resonance with more realistic characteristics"""
-    # Define body resonance frequencies for different materials
-    wood_resonances = [
-        (100, 0.15, 3),   # Low wood resonance
-        (200, 0.12, 4),   # Mid wood resonance
-        (400, 0.08, 5),   # High wood resonance
-        (800, 0.04, 6)    # Upper wood resonance
-    ]
-    
-    # Air cavity resonances
-    cavity_resonances = [
-        (150, 0.1, 2),    # Main cavity mode
-        (300, 0.05, 3)    # Secondary cavity mode
-    ]
-    
-    samples = np.array(audio.get_array_of_samples())
-    sample_rate = audio.frame_rate
-    duration_s = len(samples) / sample_rate
-    t = np.linspace(0, duration_s, len(samples))
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    tail = body_resonance_tail(len(samples), audio.frame_rate)
+    samples[:len(tail)] += tail
+    return samples_to_segment(samples, audio.frame_rate)
 
-    # Combined resonance
-    resonance = np.zeros_like(samples, dtype=float)
-    
-    # Add wood resonances
-    for freq, amp, decay_rate in wood_resonances:
-        decay = np.exp(-decay_rate * t)
-        # Add slight frequency modulation for more natural sound
-        mod = 1 + 0.001 * np.sin(2 * np.pi * 3 * t)
-        resonance += amp * np.sin(2 * np.pi * freq * t * mod) * decay
-
-    # Add cavity resonances
-    for freq, amp, decay_rate in cavity_resonances:
-        decay = np.exp(-decay_rate * t)
-        resonance += amp * np.sin(2 * np.pi * freq * t) * decay
-
-    # Add some non-linear response
-    resonance += 0.1 * resonance * resonance * np.sign(resonance)
-    
-    # Normalize and mix
-    resonance = resonance / np.max(np.abs(resonance))
-    enhanced_samples = samples + (resonance * 32767 * 0.2).astype(np.int16)
-    
-    return AudioSegment(
-        enhanced_samples.tobytes(),
-        frame_rate=sample_rate,
-        sample_width=2,
-        channels=1
-    )
-
-def apply_string_resonance(audio, frequency):
+def apply_string_resonance(audio, frequency, rng=None):
     """Enhanced string resonance simulation with sympathetic vibrations"""
-    samples = np.array(audio.get_array_of_samples())
-    sample_rate = audio.frame_rate
-    duration_s = len(samples) / sample_rate
-    t = np.linspace(0, duration_s, len(samples))
-
-    # More complex harmonic structure
-    harmonics = [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
-    resonance = np.zeros_like(samples, dtype=float)
-
-    # Add main harmonics with natural variations
-    for i, harmonic in enumerate(harmonics):
-        harmonic_freq = frequency * harmonic
-        # Progressive decay rates
-        decay_rate = 3 + (harmonic * 2)
-        # Decreasing amplitude for higher harmonics
-        amplitude = 1.0 / (harmonic ** 1.5)
-        
-        # Add slight detuning for more natural sound
-        detune_factor = 1.0 + (np.random.uniform(-0.0002, 0.0002) * harmonic)
-        
-        # Add slight pitch variation over time
-        pitch_mod = 1 + 0.0001 * np.sin(2 * np.pi * 0.5 * t)
-        
-        decay = np.exp(-decay_rate * t)
-        resonance += amplitude * np.sin(
-            2 * np.pi * harmonic_freq * detune_factor * pitch_mod * t
-        ) * decay
-
-    # Add longitudinal modes for high frequencies
-    if frequency > 200:
-        long_modes = [1.5, 2.5, 3.5]  # Non-integer modes
-        for mode in long_modes:
-            mode_freq = frequency * mode
-            decay = np.exp(-8 * t)
-            amplitude = 0.05 / mode
-            resonance += amplitude * np.sin(2 * np.pi * mode_freq * t) * decay
-
-    # Normalize and add subtle compression
-    resonance = resonance / np.max(np.abs(resonance))
-    resonance = np.tanh(resonance * 1.5) * 0.15  # Soft clipping for warmth
-    enhanced_samples = samples + (resonance * 32767).astype(np.int16)
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    tail = string_resonance_tail(frequency, len(samples), audio.frame_rate)
+    samples[:len(tail)] += tail
 
     # Add subtle noise component for high frequencies
-    if frequency > 200:
-        noise = np.random.normal(0, 0.005, len(samples))
-        noise_decay = np.exp(-15 * t)
-        high_freq = noise * noise_decay * 32767 * 0.02
-        enhanced_samples = enhanced_samples + high_freq.astype(np.int16)
-
-    return AudioSegment(
-        enhanced_samples.tobytes(),
-        frame_rate=sample_rate,
-        sample_width=2,
-        channels=1
-    )
+    noise = string_noise(frequency, len(samples), audio.frame_rate, rng)
+    samples[:len(noise)] += noise
+    return samples_to_segment(samples, audio.frame_rate)
 
 
-def apply_bright_attack(audio):
-    """Optimized attack brightness for xylophone"""
-    samples = np.array(audio.get_array_of_samples())
-    sample_rate = audio.frame_rate
-    
+def add_bright_attack(samples, sample_rate, rng=None):
+    """Add the xylophone attack transient to a float stream in place"""
+    rng = ensure_rng(rng, 'bright_attack', len(samples), sample_rate)
     # Reduce attack duration for faster processing
     attack_duration = min(int(0.03 * sample_rate), len(samples))
     t_attack = np.linspace(0, 1, attack_duration)
-    bright_attack = np.zeros(attack_duration, dtype=float)
 
     # Use fewer frequencies and combine them more efficiently
-    phase = np.random.uniform(0, 2 * np.pi)
-    bright_attack += np.sin(2 * np.pi * 7000 * t_attack + phase)
+    phase = rng.uniform(0, 2 * np.pi)
+    bright_attack = np.sin(2 * np.pi * 7000 * t_attack + phase)
     
     # Simplified envelope
-    attack_env = np.exp(-12 * t_attack)
-    bright_attack *= attack_env
+    bright_attack *= np.exp(-12 * t_attack)
 
     # Normalize and scale in one step
-    max_val = np.max(np.abs(bright_attack))
+    max_val = np.max(np.abs(bright_attack)) if attack_duration else 0
     if max_val > 0:
         bright_attack *= (0.3 / max_val)
 
     # Add shorter noise burst
-    noise_duration = int(0.01 * sample_rate)  # 10ms noise burst
-    noise = np.random.normal(0, 0.2, noise_duration)
+    noise_duration = min(int(0.01 * sample_rate), len(samples))  # 10ms noise burst
+    noise = rng.normal(0, 0.2, noise_duration)
     noise *= np.exp(-25 * np.linspace(0, 1, noise_duration))
     
-    # Combine with original audio more efficiently
-    result_samples = samples.copy()
-    result_samples[:attack_duration] += (bright_attack * 32767).astype(np.int16)
-    if noise_duration > 0:
-        result_samples[:noise_duration] += (noise * 32767).astype(np.int16)
-
-    return AudioSegment(
-        result_samples.tobytes(),
-        frame_rate=sample_rate,
-        sample_width=2,
-        channels=1
-    )
+    samples[:attack_duration] += bright_attack * 32767
+    samples[:noise_duration] += noise * 32767
+    return samples
 
+def apply_bright_attack(audio, rng=None):
+    """Optimized attack brightness for xylophone"""
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    add_bright_attack(samples, audio.frame_rate, rng)
+    return samples_to_segment(samples, audio.frame_rate)
 
 def play_with_loop(melody, stop_event=None, skip_event=None):
     """Play audio with looping using simpleaudio"""
@@ -474,6 +493,45 @@ def play_with_loop(melody, stop_event=None, skip_event=None):
             play_obj.stop()
         raise
 
+def read_wav_blocks(wav_file, block_frames=4096):
+    """Yield the frames of a 16-bit WAV file as raw PCM chunks of block_frames"""
+    with wave.open(wav_file, 'rb') as wav:
+        while True:
+            chunk = wav.readframes(block_frames)
+            if not chunk:
+                return
+            yield chunk, wav.getnchannels(), wav.getframerate()
+
+def play_wav_blocks(wav_file, stop_event=None, skip_event=None, block_frames=SAMPLE_RATE):
+    """
+    Play a WAV file with looping like play_with_loop, but only ever hold
+    one block of it in memory. Each block is queued as the previous one ends.
+    """
+    play_obj = None
+    try:
+        while not (stop_event and stop_event.is_set()):
+            for chunk, channels, sample_rate in read_wav_blocks(wav_file, block_frames):
+                play_obj = sa.play_buffer(
+                    chunk,
+                    num_channels=channels,
+                    bytes_per_sample=2,
+                    sample_rate=sample_rate
+                )
+                while play_obj.is_playing():
+                    if (stop_event and stop_event.is_set()) or (skip_event and skip_event.is_set()):
+                        play_obj.stop()
+                        break
+                    time.sleep(0.01)
+                if (stop_event and stop_event.is_set()) or (skip_event and skip_event.is_set()):
+                    break
+            if skip_event:
+                skip_event.clear()
+
+    except KeyboardInterrupt:
+        if play_obj and play_obj.is_playing():
+            play_obj.stop()
+        raise
+
 def convert_wav_to_mp3(wav_file, mp3_file):
     """Convert WAV file to MP3 using pydub"""
     audio = AudioSegment.from_wav(wav_file)
@@ -0,0 +1,204 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class NoteCache:
+    """Thread-safe LRU cache of rendered note buffers bounded by a byte budget"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached buffer for key (marking it recently used), or None"""
+        with self._lock:
+            buffer = self._entries.get(key)
+            if buffer is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return buffer
+
+    def put(self, key, buffer):
+        """Store a buffer, evicting least recently used entries to stay within budget"""
+        buffer = np.asarray(buffer)
+        # Cached buffers are shared between callers, so they must never change
+        buffer.setflags(write=False)
+        if buffer.nbytes > self.max_bytes:
+            return buffer
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous.nbytes
+            self._entries[key] = buffer
+            self.current_bytes += buffer.nbytes
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+        return buffer
+
+    def get_or_render(self, key, render):
+        """Return the cached buffer for key, calling render() to create it on a miss"""
+        buffer = self.get(key)
+        if buffer is None:
+            buffer = self.put(key, render())
+        return buffer
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current memory use"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+# Shared by every track renderer in the process
+NOTE_CACHE = NoteCache()
+
+# Root of the on-disk caches (compiled scores, stems), overridable per machine
+CACHE_DIR = os.environ.get(
+    'MUSIC_SYNTH_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'music-synthesizer')
+)
+
+
+class StemCache:
+    """
+    On-disk store of rendered stems, one .npy file per key. Hits are memory
+    mapped and touched, so file modification times give the LRU order that
+    cleanup evicts in once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=2 * 1024 * 1024 * 1024):
+        self.directory = directory or os.path.join(CACHE_DIR, 'stems')
+        self.max_bytes = max_bytes
+        self._reset()
+
+    def _reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Worker processes get their own counters and lock
+        return {'directory': self.directory, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def get(self, key):
+        """Return the stored stem for key as a read-only memory map, or None"""
+        path = self._path(key)
+        try:
+            samples = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return samples
+
+    def put(self, key, samples):
+        """Store a stem, then evict the least recently used ones to stay within budget"""
+        samples = np.asarray(samples)
+        if samples.size == 0 or samples.nbytes > self.max_bytes:
+            return samples
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write under a temporary name so readers never see a partial file
+            partial_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(partial_path, 'wb') as f:
+                np.save(f, samples)
+            os.replace(partial_path, self._path(key))
+        except OSError:
+            # A stem that cannot be stored is just rendered again next time
+            return samples
+        self.cleanup()
+        return samples
+
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith('.npy'):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def size_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def cleanup(self):
+        """Delete least recently used stems until the cache fits in max_bytes"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another renderer evicted it first
+                pass
+            total -= size
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+        return evicted
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Return hit/miss/eviction counters of this process"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
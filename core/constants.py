@@ -47,4 +47,7 @@ NOTE_FREQUENCIES = {
 
     # Special notes
     "REST": 0
-}
\ No newline at end of file
+}
+
+# Bump whenever compiled scores or rendered audio change, so on-disk caches are rebuilt
+ENGINE_VERSION = 4
@@ -0,0 +1,141 @@
+"""
+Single-pass audio export.
+
+Rendered float blocks are converted to 16-bit PCM once and fanned out to
+every requested output: WAV is written directly with the wave module and
+the compressed formats are piped as raw PCM into one ffmpeg process each,
+so there is no temporary WAV, no decode and no second encode.
+"""
+import os
+import subprocess
+import wave
+
+from pydub import AudioSegment
+
+from .timeline import SAMPLE_RATE, samples_to_pcm
+from .tracing import TRACER
+
+FORMATS = ('wav', 'mp3', 'flac', 'ogg')
+
+# ffmpeg codec settings for the formats that need an encoder
+ENCODER_ARGS = {
+    'mp3': ['-codec:a', 'libmp3lame', '-b:a', '192k'],
+    'flac': ['-codec:a', 'flac'],
+    'ogg': ['-codec:a', 'libvorbis', '-q:a', '6'],
+}
+
+class WavWriter:
+    """Write 16-bit PCM straight into a WAV file"""
+
+    def __init__(self, path, sample_rate=SAMPLE_RATE, channels=2):
+        self.path = path
+        self._wav = wave.open(path, 'wb')
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(sample_rate)
+
+    def write(self, pcm):
+        self._wav.writeframesraw(pcm)
+
+    def close(self):
+        # Patches the header with the final frame count
+        self._wav.close()
+
+    def abort(self):
+        self._wav.close()
+        os.remove(self.path)
+
+
+class EncoderWriter:
+    """Pipe 16-bit PCM into an ffmpeg process that encodes it to path"""
+
+    def __init__(self, path, fmt, sample_rate=SAMPLE_RATE, channels=2):
+        self.path = path
+        command = [
+            AudioSegment.converter, '-y', '-loglevel', 'error',
+            '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels), '-i', 'pipe:0',
+            *ENCODER_ARGS[fmt], '-f', fmt, path
+        ]
+        try:
+            self._process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise RuntimeError(
+                f"Exporting {fmt} needs ffmpeg, which was not found ({AudioSegment.converter})"
+            )
+
+    def write(self, pcm):
+        try:
+            self._process.stdin.write(pcm)
+        except BrokenPipeError:
+            self.close()
+
+    def close(self):
+        if not self._process.stdin.closed:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+        errors = self._process.stderr.read()
+        self._process.stderr.close()
+        if self._process.wait() != 0:
+            raise RuntimeError(f"Encoding {self.path} failed: {errors.decode(errors='replace').strip()}")
+
+    def abort(self):
+        self._process.kill()
+        self._process.wait()
+        self._process.stdin.close()
+        self._process.stderr.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def open_writer(path, fmt, sample_rate=SAMPLE_RATE, channels=2):
+    """Open the writer for one output format"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == 'wav':
+        return WavWriter(path, sample_rate, channels)
+    return EncoderWriter(path, fmt, sample_rate, channels)
+
+
+def output_paths(output, formats):
+    """(path, format) for each format, sharing the stem of the output path"""
+    stem = os.path.splitext(output)[0]
+    return [(f"{stem}.{fmt}", fmt) for fmt in dict.fromkeys(formats)]
+
+
+def export_pcm(chunks, outputs, sample_rate=SAMPLE_RATE, channels=2):
+    """
+    Write an iterable of interleaved 16-bit PCM chunks to every (path, format)
+    output in one pass. Outputs that were started are removed on failure.
+    """
+    writers = []
+    try:
+        for path, fmt in outputs:
+            writers.append(open_writer(path, fmt, sample_rate, channels))
+        for pcm in chunks:
+            with TRACER.span('export', bytes=len(pcm)):
+                for writer in writers:
+                    writer.write(pcm)
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+
+    # Encoders finish their work once their input is closed
+    with TRACER.span('export', formats=[fmt for _, fmt in outputs]):
+        for writer in writers:
+            writer.close()
+    return [path for path, _ in outputs]
+
+
+def export_blocks(blocks, outputs, sample_rate=SAMPLE_RATE, channels=2):
+    """Export float (channels, frames) blocks, converting each block to PCM only once"""
+    def pcm_blocks():
+        for block in blocks:
+            with TRACER.span('to_pcm'):
+                pcm = samples_to_pcm(block)
+            yield pcm
+    return export_pcm(pcm_blocks(), outputs, sample_rate, channels)
@@ -1,3 +1,7 @@
+import copy
+
+from .quality import INSTRUMENT_EFFECTS
+
 # Updated instrument parameters for better sound quality
 INSTRUMENTS_PARAMS = {
     'electric_bass': {
@@ -128,6 +132,40 @@ class Instrument:
             for key, value in params.items():
                 setattr(self, key, value)
 
+    def patch_key(self):
+        """Hashable snapshot of every parameter that affects the rendered sound"""
+        return tuple(sorted(
+            (key, tuple(value) if isinstance(value, list) else value)
+            for key, value in vars(self).items()
+            if key != 'params'
+        ))
+
+    def at_quality(self, tier):
+        """
+        Copy of the instrument simplified for a quality tier (see core.quality):
+        at most tier.max_partials wave layers (membrane modes for drums) and
+        harmonics, and only the effects the tier renders. Returns the
+        instrument itself when the tier changes nothing.
+        """
+        changes = {}
+        if tier.max_partials is not None:
+            percussion = isinstance(self.wave_type, list) and 'noise' in self.wave_type
+            layers = ('resonance_freq',) if percussion else ('wave_type', 'wave_mix')
+            for key in layers + ('harmonics',):
+                value = getattr(self, key)
+                if isinstance(value, list) and len(value) > tier.max_partials:
+                    changes[key] = value[:tier.max_partials]
+        for effect in INSTRUMENT_EFFECTS:
+            if getattr(self, effect) and effect not in tier.effects:
+                changes[effect] = False
+        if not changes:
+            return self
+
+        instrument = copy.copy(self)
+        for key, value in changes.items():
+            setattr(instrument, key, value)
+        return instrument
+
 # Define available instruments
 AVAILABLE_INSTRUMENTS = {
     'bass': Instrument('electric_bass'),
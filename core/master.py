@@ -0,0 +1,389 @@
+"""
+Master bus: gain, a look-ahead peak limiter and an integrated-loudness meter.
+
+Everything works block by block on float (2, frames) buffers in int16 units
+and keeps only a fixed amount of state between blocks, so a master stage
+streams over hour-long renders in constant memory.
+
+Limiter: the gain every frame needs to stay under the ceiling is smoothed so
+it ramps down over the look-ahead window before a peak and recovers at a
+fixed rate in dB after it. Output is delayed internally by the look-ahead,
+but process()/flush() hand back exactly the frames put in, in order.
+
+Meter: loudness in the style of ITU-R BS.1770. Every 100 ms hop is
+K-weighted in the frequency domain (the power spectrum is scaled by the
+|H|^2 of the two K-weighting biquads) rather than with a running IIR, 400 ms
+blocks overlap by 75%, and blocks are gated at -70 LUFS and then 10 LU below
+the ungated loudness. Block loudness is kept in a fixed histogram, so the
+meter's memory does not grow with the length of the render.
+"""
+import copy
+import os
+import tempfile
+from collections import deque
+
+import numpy as np
+from pydub.utils import db_to_float
+
+from .timeline import SAMPLE_RATE, INT16_MAX, ms_to_frames
+from .tracing import TRACER
+
+# Frames a whole buffer is mastered in per pass
+MASTER_BLOCK_FRAMES = 1 << 16
+
+DEFAULT_CEILING_DB = -1.0
+
+# Gating of BS.1770 integrated loudness
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+
+# Histogram of block loudness from the absolute gate up to this, per bin
+HISTOGRAM_MAX_LUFS = 10.0
+HISTOGRAM_STEP_LU = 0.01
+
+
+def _biquad_power(b, a, frequencies, sample_rate):
+    """|H|^2 of a biquad at the given frequencies"""
+    z = np.exp(-1j * 2 * np.pi * frequencies / sample_rate)
+    numerator = b[0] + b[1] * z + b[2] * z * z
+    denominator = a[0] + a[1] * z + a[2] * z * z
+    return np.abs(numerator / denominator) ** 2
+
+
+def k_weighting_power(frequencies, sample_rate=SAMPLE_RATE):
+    """
+    Power response of the BS.1770 K-weighting (a +4 dB high shelf and a 38 Hz
+    high-pass), designed for any sample rate from the filters' analog
+    parameters.
+    """
+    # Stage 1: high shelf
+    gain_db, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    k = np.tan(np.pi * fc / sample_rate)
+    high = 10 ** (gain_db / 20)
+    band = high ** 0.4996667741545416
+    shelf_b = (high + band * k / q + k * k, 2 * (k * k - high), high - band * k / q + k * k)
+    shelf_a = (1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k)
+
+    # Stage 2: high-pass
+    q, fc = 0.5003270373238773, 38.13547087602444
+    k = np.tan(np.pi * fc / sample_rate)
+    pass_a = (1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k)
+    # BS.1770 keeps the numerator at (1, -2, 1) against the normalized denominator
+    pass_b = (pass_a[0], -2 * pass_a[0], pass_a[0])
+
+    return (_biquad_power(shelf_b, shelf_a, frequencies, sample_rate)
+            * _biquad_power(pass_b, pass_a, frequencies, sample_rate))
+
+
+def _sliding_min(values, window):
+    """
+    Minimum of every run of window consecutive values (van Herk/Gil-Werman:
+    prefix and suffix minima over fixed chunks, three passes regardless of
+    the window length). Returns len(values) - window + 1 minima.
+    """
+    count = len(values) - window + 1
+    if count <= 0:
+        return values[:0]
+    chunks = -(-len(values) // window)
+    padded = np.full(chunks * window, np.inf)
+    padded[:len(values)] = values
+    padded = padded.reshape(chunks, window)
+    prefix = np.minimum.accumulate(padded, axis=1).reshape(-1)
+    suffix = np.minimum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].reshape(-1)
+    return np.minimum(suffix[:count], prefix[window - 1:window - 1 + count])
+
+
+class PeakLimiter:
+    """
+    Streaming look-ahead peak limiter, linked across channels.
+
+    ceiling_db    highest output peak, relative to full scale
+    lookahead_ms  how far ahead of a peak the gain starts to come down
+    release_ms    time the gain takes to recover by 6 dB after a peak
+    """
+
+    def __init__(self, ceiling_db=DEFAULT_CEILING_DB, lookahead_ms=5.0, release_ms=60.0,
+                 sample_rate=SAMPLE_RATE, channels=2):
+        # The float32 ceiling at or just under the exact one
+        ceiling = INT16_MAX * db_to_float(ceiling_db)
+        self.ceiling = np.float32(ceiling)
+        if self.ceiling > ceiling:
+            self.ceiling = np.nextafter(self.ceiling, np.float32(0))
+        self.lookahead = max(1, ms_to_frames(lookahead_ms, sample_rate))
+        self.release_db = 6.0 / max(1, ms_to_frames(release_ms, sample_rate))
+        self.channels = channels
+        self.max_reduction_db = 0.0
+        # The delay starts with a look-ahead of silence, so the ramp before a
+        # peak in the first frames begins in that silence; it is never output
+        self._delay = np.zeros((channels, self.lookahead), dtype=np.float32)
+        self._targets = np.zeros(self.lookahead)
+        self._skip = self.lookahead
+        # Smoothed minima of the last lookahead frames, and the last gain applied
+        self._history = np.zeros(self.lookahead)
+        self._gain_db = 0.0
+
+    def process(self, block):
+        """
+        Limit a (channels, frames) block. Returns the limited frames that are
+        ready, which trail the input by up to the look-ahead.
+        """
+        block = np.asarray(block, dtype=np.float32)
+        peak = np.abs(block).max(axis=0) if block.shape[1] else np.zeros(0, dtype=np.float32)
+        with np.errstate(divide='ignore'):
+            targets = np.minimum(0.0, 20 * np.log10(self.ceiling / peak.astype(np.float64)))
+        audio = np.concatenate((self._delay, block), axis=1)
+        targets = np.concatenate((self._targets, targets))
+
+        lookahead = self.lookahead
+        ready = len(targets) - lookahead
+        if ready <= 0:
+            self._delay, self._targets = audio, targets
+            return audio[:, :0]
+
+        # Every frame in a look-ahead window must get at most that window's
+        # lowest gain; averaging the window minima over the lookahead frames
+        # before turns that into a ramp that never overshoots
+        minima = np.concatenate((self._history, _sliding_min(targets, lookahead + 1)[:ready]))
+        sums = np.concatenate(([0.0], np.cumsum(minima)))
+        attack = (sums[lookahead + 1:] - sums[:-lookahead - 1]) / (lookahead + 1)
+
+        # Release: gain[i] = min(attack[i], gain[i - 1] + release), closed form
+        ramp = np.arange(ready) * self.release_db
+        gain_db = np.minimum.accumulate(attack - ramp)
+        gain_db = np.minimum(gain_db, self._gain_db + self.release_db) + ramp
+        np.minimum(gain_db, 0.0, out=gain_db)
+
+        self.max_reduction_db = max(self.max_reduction_db, -float(gain_db.min()))
+        self._gain_db = float(gain_db[-1])
+        self._history = minima[-lookahead:]
+        self._delay, self._targets = audio[:, ready:], targets[ready:]
+        skip = min(self._skip, ready)
+        self._skip -= skip
+        out = audio[:, skip:ready] * (10 ** (gain_db[skip:] / 20)).astype(np.float32)
+        # Applying the gain in float32 can round a frame a step over the ceiling
+        return np.clip(out, -self.ceiling, self.ceiling, out=out)
+
+    def flush(self):
+        """Frames still held back by the look-ahead"""
+        held = self._delay.shape[1] - self._skip
+        return self.process(np.zeros((self.channels, self.lookahead), dtype=np.float32))[:, :held]
+
+
+class LoudnessMeter:
+    """Integrated loudness (LUFS) and sample peak of blocks fed to it in order"""
+
+    HOP_MS = 100
+    BLOCK_HOPS = 4
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=2):
+        self.hop = ms_to_frames(self.HOP_MS, sample_rate)
+        self.channels = channels
+        frequencies = np.fft.rfftfreq(self.hop, 1.0 / sample_rate)
+        # Parseval over the one-sided spectrum, scaled to mean square of full scale
+        weights = k_weighting_power(frequencies, sample_rate)
+        weights[1:(self.hop + 1) // 2] *= 2
+        self._weights = weights / (self.hop * self.hop * float(INT16_MAX + 1) ** 2)
+        self._pending = np.zeros((channels, 0), dtype=np.float32)
+        self._recent = deque(maxlen=self.BLOCK_HOPS - 1)
+        bins = int(round((HISTOGRAM_MAX_LUFS - ABSOLUTE_GATE_LUFS) / HISTOGRAM_STEP_LU)) + 1
+        self._energy = np.zeros(bins)
+        self._counts = np.zeros(bins, dtype=np.int64)
+        self.peak = 0.0
+
+    def add(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if block.shape[1]:
+            self.peak = max(self.peak, float(np.abs(block).max()))
+        audio = np.concatenate((self._pending, block), axis=1)
+        hops = audio.shape[1] // self.hop
+        self._pending = audio[:, hops * self.hop:]
+        if not hops:
+            return
+
+        spectra = np.fft.rfft(audio[:, :hops * self.hop].reshape(self.channels, hops, self.hop), axis=-1)
+        # Mean square per hop, summed over channels (every channel weighted 1)
+        hop_energy = ((spectra.real ** 2 + spectra.imag ** 2) @ self._weights).sum(axis=0)
+
+        energies = np.concatenate((np.array(self._recent), hop_energy))
+        self._recent.extend(hop_energy[-(self.BLOCK_HOPS - 1):])
+        if len(energies) < self.BLOCK_HOPS:
+            return
+        sums = np.concatenate(([0.0], np.cumsum(energies)))
+        blocks = (sums[self.BLOCK_HOPS:] - sums[:-self.BLOCK_HOPS]) / self.BLOCK_HOPS
+        self._add_blocks(blocks)
+
+    def _add_blocks(self, energies):
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10 * np.log10(np.maximum(energies, 0.0))
+        gated = loudness >= ABSOLUTE_GATE_LUFS
+        bins = np.minimum(
+            ((loudness[gated] - ABSOLUTE_GATE_LUFS) / HISTOGRAM_STEP_LU).astype(np.int64),
+            len(self._counts) - 1
+        )
+        np.add.at(self._energy, bins, energies[gated])
+        np.add.at(self._counts, bins, 1)
+
+    def integrated(self):
+        """Gated integrated loudness in LUFS, or None for silence"""
+        counts = self._counts
+        if not counts.any():
+            return None
+        ungated = self._energy.sum() / counts.sum()
+        threshold = -0.691 + 10 * np.log10(ungated) + RELATIVE_GATE_LU
+        first = max(0, int(np.ceil((threshold - ABSOLUTE_GATE_LUFS) / HISTOGRAM_STEP_LU)))
+        if not counts[first:].any():
+            return None
+        return float(-0.691 + 10 * np.log10(self._energy[first:].sum() / counts[first:].sum()))
+
+    def peak_db(self):
+        """Sample peak relative to full scale"""
+        return 20 * np.log10(self.peak / INT16_MAX) if self.peak else None
+
+
+class MasterBus:
+    """
+    Settings of the master stage. Every call to process()/stream() starts
+    from fresh limiter and meter state, so one MasterBus can master any
+    number of renders, concurrently.
+
+    target_lufs  normalize to this integrated loudness (None keeps the mix level)
+    ceiling_db   limiter ceiling, relative to full scale
+    limit        run the peak limiter
+    """
+
+    def __init__(self, target_lufs=None, ceiling_db=DEFAULT_CEILING_DB, limit=True,
+                 lookahead_ms=5.0, release_ms=60.0, sample_rate=SAMPLE_RATE,
+                 block_frames=MASTER_BLOCK_FRAMES):
+        self.target_lufs = target_lufs
+        self.ceiling_db = ceiling_db
+        self.limit = limit
+        self.lookahead_ms = lookahead_ms
+        self.release_ms = release_ms
+        self.sample_rate = sample_rate
+        self.block_frames = block_frames
+
+    def at_sample_rate(self, sample_rate):
+        """The same settings for audio at another sample rate (the bus itself if it already matches)"""
+        if sample_rate == self.sample_rate:
+            return self
+        bus = copy.copy(self)
+        bus.sample_rate = sample_rate
+        return bus
+
+    def _limiter(self, channels):
+        if not self.limit:
+            return None
+        return PeakLimiter(self.ceiling_db, self.lookahead_ms, self.release_ms,
+                           self.sample_rate, channels)
+
+    def _gain(self, loudness):
+        if self.target_lufs is None or loudness is None:
+            return 1.0
+        return db_to_float(self.target_lufs - loudness)
+
+    def _stats(self, input_loudness, gain, limiter, meter):
+        return {
+            'input_lufs': input_loudness,
+            'gain_db': float(20 * np.log10(gain)),
+            'limiter_reduction_db': limiter.max_reduction_db if limiter is not None else 0.0,
+            'integrated_lufs': meter.integrated(),
+            'peak_db': meter.peak_db(),
+        }
+
+    def measure(self, samples):
+        """Integrated loudness of a whole (channels, frames) buffer"""
+        meter = LoudnessMeter(self.sample_rate, samples.shape[0])
+        for start in range(0, samples.shape[1], self.block_frames):
+            meter.add(samples[:, start:start + self.block_frames])
+        return meter.integrated()
+
+    def process(self, samples):
+        """
+        Master a float (channels, frames) buffer in place, one block at a time,
+        and return the loudness statistics.
+        """
+        channels, frames = samples.shape
+        with TRACER.span('loudness'):
+            input_loudness = self.measure(samples) if self.target_lufs is not None else None
+        gain = self._gain(input_loudness)
+        limiter = self._limiter(channels)
+        meter = LoudnessMeter(self.sample_rate, channels)
+
+        # Limited output trails the input by the look-ahead, so writes never
+        # overtake the frames still to be read
+        written = 0
+        with TRACER.span('limit'):
+            for start in range(0, frames, self.block_frames):
+                block = samples[:, start:start + self.block_frames]
+                block = block * np.float32(gain) if gain != 1.0 else block.copy()
+                out = limiter.process(block) if limiter is not None else block
+                samples[:, written:written + out.shape[1]] = out
+                meter.add(out)
+                written += out.shape[1]
+            if limiter is not None:
+                out = limiter.flush()
+                samples[:, written:written + out.shape[1]] = out
+                meter.add(out)
+        return self._stats(input_loudness, gain, limiter, meter)
+
+    def stream(self, blocks, stats=None, channels=2):
+        """
+        Master a stream of (channels, frames) blocks, yielding mastered blocks
+        (block boundaries shift by the limiter's look-ahead). With a loudness
+        target the stream is first spooled to a float32 scratch file while it
+        is measured, then read back block by block, so memory stays constant
+        at the cost of scratch disk the size of the render. stats, if given,
+        is filled in once the stream is exhausted.
+        """
+        limiter = self._limiter(channels)
+        meter = LoudnessMeter(self.sample_rate, channels)
+        input_loudness, gain = None, 1.0
+        spool = None
+        try:
+            if self.target_lufs is not None:
+                blocks, input_loudness, spool = self._spool(blocks, channels)
+                gain = self._gain(input_loudness)
+
+            for block in blocks:
+                if gain != 1.0:
+                    block = block * np.float32(gain)
+                out = limiter.process(block) if limiter is not None else block
+                meter.add(out)
+                if out.shape[1]:
+                    yield out
+            if limiter is not None:
+                out = limiter.flush()
+                meter.add(out)
+                if out.shape[1]:
+                    yield out
+        finally:
+            if spool is not None:
+                spool.close()
+                os.remove(spool.name)
+        if stats is not None:
+            stats.update(self._stats(input_loudness, gain, limiter, meter))
+
+    def _spool(self, blocks, channels):
+        """Write blocks to a scratch file while metering them; returns a reader over it"""
+        meter = LoudnessMeter(self.sample_rate, channels)
+        spool = tempfile.NamedTemporaryFile(prefix='master-', suffix='.f32', delete=False)
+        try:
+            for block in blocks:
+                block = np.asarray(block, dtype=np.float32)
+                meter.add(block)
+                np.ascontiguousarray(block.T).tofile(spool)
+            spool.flush()
+        except BaseException:
+            spool.close()
+            os.remove(spool.name)
+            raise
+
+        def read_back():
+            spool.seek(0)
+            while True:
+                frames = np.fromfile(spool, dtype=np.float32, count=self.block_frames * channels)
+                if not frames.size:
+                    return
+                yield frames.reshape(-1, channels).T
+
+        return read_back(), meter.integrated(), spool
@@ -0,0 +1,108 @@
+"""
+Float32 stereo bus mixing.
+
+Sources are summed into a (2, frames) float32 bus in int16 units. Panning
+is a gain matrix computed once per source and applied as the source is
+inserted, so mono notes are never converted to stereo segments first.
+Gain staging is applied once per group of sources, and compression runs
+once over the finished bus in a vectorized pass.
+
+Pan law: constant power, normalized so a centred source keeps unity gain
+in both channels (pan -1 is hard left at +3 dB, 0 is centre, 1 is hard right).
+"""
+import numpy as np
+from pydub.utils import db_to_float
+
+from .timeline import SAMPLE_RATE, INT16_MAX, Timeline
+
+# Spread of the sources in a group (chord notes, tone partials) across the stereo field
+STEREO_WIDTH = 0.3
+
+# Frames compressed per pass, bounding the temporaries on long buses
+COMPRESS_BLOCK_FRAMES = 1 << 18
+
+
+def constant_power_gains(pan):
+    """(left, right) constant-power gains for a pan position in [-1, 1]"""
+    angle = (np.clip(pan, -1.0, 1.0) + 1.0) * (np.pi / 4)
+    return np.sqrt(2.0) * np.cos(angle), np.sqrt(2.0) * np.sin(angle)
+
+
+def pan_matrix(pan, channels=1):
+    """
+    (2, channels) float32 gain matrix that places a source on the bus. Mono
+    sources are panned, stereo sources are balanced channel by channel.
+    """
+    left, right = constant_power_gains(pan)
+    if channels == 1:
+        return np.array([[left], [right]], dtype=np.float32)
+    return np.array([[left, 0.0], [0.0, right]], dtype=np.float32)
+
+
+def group_gain(count):
+    """Gain staging of a group: 2 dB down per doubling of the number of sources"""
+    return db_to_float(-2 * np.log2(count)) if count > 1 else 1.0
+
+
+def spread_gains(count, pan=0.0):
+    """
+    (2, count) gains for a group of mono sources: each is spread left, centre
+    or right by STEREO_WIDTH, the group is balanced by pan, and gain staging
+    is applied once to all of them.
+    """
+    spread = np.array([constant_power_gains(((i % 3) - 1) * STEREO_WIDTH) for i in range(count)]).T
+    balance = np.array(constant_power_gains(pan))[:, np.newaxis]
+    return spread * balance * group_gain(count)
+
+
+def compress(samples, threshold=0.7, ratio=2.0):
+    """
+    Compress samples above threshold (relative to full scale) by ratio, in
+    place for float arrays. Memoryless, so blocks can be compressed alone.
+    """
+    samples = np.asarray(samples)
+    if not np.issubdtype(samples.dtype, np.floating):
+        samples = samples.astype(np.float64)
+    limit = threshold * INT16_MAX
+    flat = samples.reshape(-1) if samples.flags.c_contiguous else None
+    if flat is None:
+        _compress_block(samples, limit, ratio)
+        return samples
+    for start in range(0, flat.size, COMPRESS_BLOCK_FRAMES * 2):
+        _compress_block(flat[start:start + COMPRESS_BLOCK_FRAMES * 2], limit, ratio)
+    return samples
+
+
+def _compress_block(block, limit, ratio):
+    magnitude = np.abs(block)
+    above = magnitude > limit
+    if above.any():
+        magnitude = magnitude[above]
+        block[above] *= (limit + (magnitude - limit) / ratio) / magnitude
+
+
+class StereoBus(Timeline):
+    """Float32 stereo timeline that sources are inserted into through pan gain matrices"""
+
+    def __init__(self, duration_ms=0, sample_rate=SAMPLE_RATE, frames=None, buffer=None):
+        super().__init__(duration_ms, sample_rate, 2, frames, buffer)
+
+    def insert(self, samples, start, gains):
+        """
+        Add mono (frames,) or (channels, frames) samples at a frame offset,
+        scaled by a (2, channels) gain matrix, truncating at the end.
+        """
+        if start >= self.frames:
+            return
+        samples = np.atleast_2d(samples)
+        end = min(start + samples.shape[1], self.frames)
+        samples = samples[:, :end - start]
+        if samples.shape[0] == 1:
+            self.samples[:, start:end] += gains[:, :1] * samples
+        else:
+            self.samples[:, start:end] += gains @ samples
+
+    def compress(self, threshold=0.7, ratio=2.0):
+        """Compress the whole bus once, in place"""
+        compress(self.samples, threshold, ratio)
+        return self
@@ -8,4 +8,11 @@ class Note:
 
 class Chord:
     def __init__(self, notes):
-        self.notes = notes
\ No newline at end of file
+        self.notes = notes
+
+class Section:
+    def __init__(self, tracks, repeat_count=1, name=None):
+        self.tracks = tracks
+        self.repeat_count = repeat_count
+        self.name = name
+
@@ -0,0 +1,36 @@
+import numpy as np
+
+from .timeline import SAMPLE_RATE, INT16_MAX
+from .wavetables import read_wavetable
+
+# Samples rendered per pass, so long notes with many voices stay small in memory
+BLOCK_SIZE = 65536
+
+
+def oscillator_bank(frequencies, gains, n_samples, sample_rate=SAMPLE_RATE, wave_types='sine'):
+    """
+    Render every voice as one row of a (voices, samples) matrix and sum the rows.
+    Waves are read from the band-limited tables in wavetables.py.
+
+    gains is either (voices,), giving one summed (samples,) buffer, or
+    (outputs, voices), giving (outputs, samples) so stereo pairs and chord
+    notes come out of a single matrix product. Output is in int16 units.
+    """
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    gains = np.asarray(gains, dtype=np.float64)
+    if isinstance(wave_types, str):
+        wave_types = [wave_types] * len(frequencies)
+
+    rows_by_type = {}
+    for row, wave_type in enumerate(wave_types):
+        rows_by_type.setdefault(wave_type, []).append(row)
+
+    output = np.zeros(gains.shape[:-1] + (n_samples,), dtype=np.float64)
+    for start in range(0, n_samples, BLOCK_SIZE):
+        n = np.arange(start, min(start + BLOCK_SIZE, n_samples), dtype=np.float64)
+        waves = np.empty((len(frequencies), len(n)))
+        for wave_type, rows in rows_by_type.items():
+            waves[rows] = read_wavetable(wave_type, frequencies[rows], n, sample_rate)
+        output[..., start:start + len(n)] = gains @ waves
+
+    return output * INT16_MAX
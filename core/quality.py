@@ -0,0 +1,49 @@
+"""
+Render quality tiers.
+
+A tier trades fidelity for render time. It sets the sample rate the whole
+engine runs at, caps the partials of every tone (the layers of a wave mix
+or the membrane modes of a drum) and picks which instrument effects are
+rendered. 'final' changes nothing, so it renders exactly what the engine
+always has. 'normal' keeps the full rate but drops the upper partials and
+the string resonance, the most expensive effect. 'draft' renders at half
+the rate with two partials and no effects, for previews while composing.
+"""
+from .timeline import SAMPLE_RATE
+
+INSTRUMENT_EFFECTS = ('body_resonance', 'string_resonance', 'bright_attack')
+
+
+class QualityTier:
+    """
+    name          'draft', 'normal' or 'final'
+    sample_rate   rate of every note, stem, the master bus and the export
+    max_partials  wave layers, harmonics or drum modes kept per tone (None keeps all)
+    effects       instrument effects still rendered
+    """
+
+    def __init__(self, name, sample_rate=SAMPLE_RATE, max_partials=None, effects=INSTRUMENT_EFFECTS):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.max_partials = max_partials
+        self.effects = tuple(effects)
+
+    def __repr__(self):
+        return (f"QualityTier({self.name!r}, sample_rate={self.sample_rate}, "
+                f"max_partials={self.max_partials}, effects={self.effects})")
+
+
+QUALITY_TIERS = {
+    'draft': QualityTier('draft', SAMPLE_RATE // 2, max_partials=2, effects=()),
+    'normal': QualityTier('normal', SAMPLE_RATE, max_partials=4, effects=('body_resonance', 'bright_attack')),
+    'final': QualityTier('final'),
+}
+DEFAULT_QUALITY = 'final'
+
+
+def quality_tier(name):
+    """Look up a tier by name"""
+    try:
+        return QUALITY_TIERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown quality: {name} (choose from {', '.join(QUALITY_TIERS)})") from None
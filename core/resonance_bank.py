@@ -0,0 +1,190 @@
+"""
+Precomputed resonance tails.
+
+Body and string resonance add decaying sinusoids whose shape depends only on
+the note length (and, for strings, the frequency), never on the input audio.
+The tails are rendered once per (kind, frequency, n_samples), cut off where
+their exponential decay drops below AUDIBILITY_FLOOR and cached, so a note
+only pays for a single add of the combined tail. The random detune of the
+string harmonics is seeded by the render seed and the frequency, so cached
+tails are the same in every process.
+"""
+import numpy as np
+
+from .cache import NoteCache
+from .seeding import DEFAULT_SEED, stream_rng, ensure_rng
+
+RESONANCE_CACHE = NoteCache(max_bytes=128 * 1024 * 1024)
+
+# Tails are dropped once they can no longer move an int16 sample
+AUDIBILITY_FLOOR = 0.5
+# Samples rendered before estimating where a tail becomes inaudible
+PEAK_WINDOW = 4096
+
+# (frequency, amplitude, decay rate) of the wood and air cavity modes
+WOOD_RESONANCES = [
+    (100, 0.15, 3),   # Low wood resonance
+    (200, 0.12, 4),   # Mid wood resonance
+    (400, 0.08, 5),   # High wood resonance
+    (800, 0.04, 6)    # Upper wood resonance
+]
+CAVITY_RESONANCES = [
+    (150, 0.1, 2),    # Main cavity mode
+    (300, 0.05, 3)    # Secondary cavity mode
+]
+STRING_HARMONICS = [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+LONGITUDINAL_MODES = [1.5, 2.5, 3.5]  # Non-integer modes
+
+
+def _time_axis(n_samples, sample_rate, length):
+    """First `length` points of np.linspace(0, n_samples / sample_rate, n_samples)"""
+    step = (n_samples / sample_rate) / (n_samples - 1) if n_samples > 1 else 0.0
+    return np.arange(length) * step, step
+
+
+def _audible_length(n_samples, step, amplitudes, decay_rates, scale):
+    """Samples until the sum of decaying amplitudes, times scale, falls below the floor"""
+    grid = np.arange(0, n_samples, 64)
+    bound = np.exp(-np.outer(grid * step, decay_rates)) @ np.asarray(amplitudes)
+    audible = np.nonzero(scale(bound) >= AUDIBILITY_FLOOR)[0]
+    if len(audible) == 0:
+        return min(n_samples, 1)
+    return min(n_samples, (audible[-1] + 1) * 64 + 1)
+
+
+def _render_truncated(n_samples, sample_rate, render, amplitudes, decay_rates, scale):
+    """Render a normalized tail only as far as it stays audible"""
+    length = min(n_samples, PEAK_WINDOW)
+    t, step = _time_axis(n_samples, sample_rate, length)
+    peak = np.max(np.abs(render(t)), initial=0.0)
+    if peak == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    # The early window under-estimates the true peak, so this cut-off is conservative
+    length = max(length, _audible_length(
+        n_samples, step, amplitudes, decay_rates, lambda bound: scale(bound / peak)
+    ))
+    t, _ = _time_axis(n_samples, sample_rate, length)
+    resonance = render(t)
+    return resonance / np.max(np.abs(resonance))
+
+
+def body_resonance_tail(n_samples, sample_rate):
+    """Wood and air cavity resonance in int16 units, as added by apply_body_resonance"""
+    def render(t):
+        resonance = np.zeros_like(t)
+        # Add wood resonances with slight frequency modulation for more natural sound
+        mod = 1 + 0.001 * np.sin(2 * np.pi * 3 * t)
+        for freq, amp, decay_rate in WOOD_RESONANCES:
+            resonance += amp * np.sin(2 * np.pi * freq * t * mod) * np.exp(-decay_rate * t)
+        # Add cavity resonances
+        for freq, amp, decay_rate in CAVITY_RESONANCES:
+            resonance += amp * np.sin(2 * np.pi * freq * t) * np.exp(-decay_rate * t)
+        # Add some non-linear response
+        return resonance + 0.1 * resonance * resonance * np.sign(resonance)
+
+    def build():
+        modes = WOOD_RESONANCES + CAVITY_RESONANCES
+        amplitudes = [amp for _, amp, _ in modes]
+        scale = 32767 * 0.2
+        resonance = _render_truncated(
+            n_samples, sample_rate, render,
+            amplitudes + [0.1 * a * b for a in amplitudes for _, b, _ in modes],
+            [rate for _, _, rate in modes] + [ra + rb for _, _, ra in modes for _, _, rb in modes],
+            lambda bound: bound * scale
+        )
+        return (resonance * scale).astype(np.float32)
+
+    return RESONANCE_CACHE.get_or_render(('body', None, n_samples, sample_rate), build)
+
+
+def string_resonance_tail(frequency, n_samples, sample_rate, seed=DEFAULT_SEED):
+    """
+    Sympathetic string resonance in int16 units, as added by apply_string_resonance.
+    The random detune of each harmonic is drawn from the seed and frequency.
+    """
+    rng = stream_rng(seed, 'string', float(frequency))
+    detune_factors = [
+        1.0 + (rng.uniform(-0.0002, 0.0002) * harmonic)
+        for harmonic in STRING_HARMONICS
+    ]
+
+    def render(t):
+        resonance = np.zeros_like(t)
+        # Add slight pitch variation over time
+        pitch_mod = 1 + 0.0001 * np.sin(2 * np.pi * 0.5 * t)
+        for harmonic, detune_factor in zip(STRING_HARMONICS, detune_factors):
+            # Progressive decay rates and decreasing amplitude for higher harmonics
+            decay_rate = 3 + (harmonic * 2)
+            amplitude = 1.0 / (harmonic ** 1.5)
+            resonance += amplitude * np.sin(
+                2 * np.pi * frequency * harmonic * detune_factor * pitch_mod * t
+            ) * np.exp(-decay_rate * t)
+
+        # Add longitudinal modes for high frequencies
+        if frequency > 200:
+            for mode in LONGITUDINAL_MODES:
+                resonance += (0.05 / mode) * np.sin(2 * np.pi * frequency * mode * t) * np.exp(-8 * t)
+        return resonance
+
+    def build():
+        amplitudes = [1.0 / (harmonic ** 1.5) for harmonic in STRING_HARMONICS]
+        decay_rates = [3 + (harmonic * 2) for harmonic in STRING_HARMONICS]
+        if frequency > 200:
+            amplitudes += [0.05 / mode for mode in LONGITUDINAL_MODES]
+            decay_rates += [8] * len(LONGITUDINAL_MODES)
+        scale = 32767 * 0.15
+        resonance = _render_truncated(
+            n_samples, sample_rate, render, amplitudes, decay_rates,
+            lambda bound: np.tanh(bound * 1.5) * scale
+        )
+        # Soft clipping for warmth
+        return (np.tanh(resonance * 1.5) * scale).astype(np.float32)
+
+    return RESONANCE_CACHE.get_or_render(('string', frequency, n_samples, sample_rate, seed), build)
+
+
+def string_noise(frequency, n_samples, sample_rate, rng=None):
+    """Decaying noise burst, drawn from the note's rng, that apply_string_resonance adds to higher notes"""
+    if frequency <= 200:
+        return np.zeros(0, dtype=np.float32)
+
+    # exp(-15 t) takes the noise below the floor long before long notes end
+    length = min(n_samples, int(sample_rate * np.log(32767 * 0.02 * 0.005 * 5 / AUDIBILITY_FLOOR) / 15) + 1)
+    t, _ = _time_axis(n_samples, sample_rate, length)
+    noise = ensure_rng(rng, 'string_noise', frequency, n_samples, sample_rate).normal(0, 0.005, length)
+    return (noise * np.exp(-15 * t) * 32767 * 0.02).astype(np.float32)
+
+
+def resonance_tail(instrument, frequency, n_samples, sample_rate, seed=DEFAULT_SEED):
+    """Every input-independent resonance layer of an instrument combined into one cached tail"""
+    kinds = tuple(
+        kind for kind in ('body', 'string')
+        if getattr(instrument, f'{kind}_resonance', False)
+    )
+
+    def build():
+        layers = []
+        if 'body' in kinds:
+            layers.append(body_resonance_tail(n_samples, sample_rate))
+        if 'string' in kinds:
+            layers.append(string_resonance_tail(frequency, n_samples, sample_rate, seed))
+        tail = np.zeros(max((len(layer) for layer in layers), default=0), dtype=np.float32)
+        for layer in layers:
+            tail[:len(layer)] += layer
+        return tail
+
+    if len(kinds) == 1:
+        # A single layer is already cached on its own
+        return build()
+    return RESONANCE_CACHE.get_or_render((kinds, frequency, n_samples, sample_rate, seed), build)
+
+
+def add_resonance(samples, instrument, frequency, sample_rate, rng=None, seed=DEFAULT_SEED):
+    """Add an instrument's resonance layers to a float buffer in place with one fused add"""
+    tail = resonance_tail(instrument, frequency, len(samples), sample_rate, seed)
+    samples[:len(tail)] += tail
+    if getattr(instrument, 'string_resonance', False):
+        noise = string_noise(frequency, len(samples), sample_rate, rng)
+        samples[:len(noise)] += noise
+    return samples
@@ -0,0 +1,203 @@
+"""
+Prebaked sample bank.
+
+`main.py bake` renders every instrument at every pitch, at a few reference
+lengths and volumes and with a fixed seed, into one file. The renderer maps
+that file with numpy.memmap and hands out note buffers as zero-copy views,
+so only notes the bank cannot serve are synthesized. Opening a bank reads
+its footer and index only; sample pages are faulted in by the OS as notes
+are used and shared through the page cache by every process that maps it.
+
+Layout: the magic, float32 mono note buffers back to back, the index
+(a 16 byte key digest, start and length per buffer), a JSON header and the
+header's length followed by the magic again. A bank baked by another engine
+version or for another sample rate is ignored.
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+from .cache import CACHE_DIR
+from .constants import ENGINE_VERSION
+from .timeline import SAMPLE_RATE
+
+BANK_MAGIC = b'MSYNBANK'
+BANK_FORMAT = 1
+# Buffers start after the magic, padded to a cache line
+BANK_DATA_OFFSET = 64
+BANK_INDEX_DTYPE = np.dtype([('key', 'V16'), ('start', '<i8'), ('length', '<i8')])
+_FOOTER = struct.Struct('<Q8s')
+
+SAMPLE_BANK_PATH = os.environ.get(
+    'MUSIC_SYNTH_SAMPLE_BANK', os.path.join(CACHE_DIR, 'sample_bank.bin')
+)
+
+
+def bank_key(patch_key, frequency, duration_ms, volume, seed):
+    """Digest of everything a note buffer without variation depends on"""
+    return hashlib.blake2b(repr((
+        patch_key, float(frequency), float(duration_ms), float(volume), seed
+    )).encode(), digest_size=16).digest()
+
+
+def write_sample_bank(path, entries, **metadata):
+    """
+    Write ((patch_key, frequency, duration_ms, volume, seed), samples) pairs
+    into a bank file, streaming each buffer to disk as it arrives. The file
+    is written under a temporary name and swapped in, so renderers never map
+    a partial bank. Returns the header.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    partial_path = f"{path}.{os.getpid()}.tmp"
+    index, seen, frames = [], set(), 0
+    try:
+        with open(partial_path, 'wb') as f:
+            f.write(BANK_MAGIC.ljust(BANK_DATA_OFFSET, b'\0'))
+            for key, samples in entries:
+                digest = bank_key(*key)
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                samples = np.ascontiguousarray(samples, dtype='<f4')
+                f.write(samples.tobytes())
+                index.append((digest, frames, len(samples)))
+                frames += len(samples)
+
+            index_offset = f.tell()
+            f.write(np.array(index, dtype=BANK_INDEX_DTYPE).tobytes())
+            header = dict(
+                metadata, format=BANK_FORMAT, engine=ENGINE_VERSION, sample_rate=SAMPLE_RATE,
+                entries=len(index), frames=frames, index_offset=index_offset
+            )
+            encoded = json.dumps(header).encode()
+            f.write(encoded)
+            f.write(_FOOTER.pack(len(encoded), BANK_MAGIC))
+        os.replace(partial_path, path)
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return header
+
+
+def read_bank_header(path):
+    """The JSON header of a bank file; raises ValueError if it is not one"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < BANK_DATA_OFFSET + _FOOTER.size:
+            raise ValueError(f"{path} is not a sample bank")
+        f.seek(size - _FOOTER.size)
+        length, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != BANK_MAGIC or length > size - _FOOTER.size:
+            raise ValueError(f"{path} is not a sample bank")
+        f.seek(size - _FOOTER.size - length)
+        return json.loads(f.read(length))
+
+
+class SampleBank:
+    """
+    Read-only view of a baked sample bank, opened on the first lookup.
+    A missing bank simply serves nothing; path None disables the bank.
+    """
+
+    def __init__(self, path=SAMPLE_BANK_PATH):
+        self.path = path
+        self._reset()
+
+    def _reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.header = None
+        self._samples = None
+        self._index = None
+        self._opened = False
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Worker processes map the file themselves
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def open(self, path):
+        """Serve from another bank file (or none), dropping the current mapping"""
+        with self._lock:
+            self.path = path
+            self.header = self._samples = self._index = None
+            self._opened = False
+
+    def _load(self):
+        with self._lock:
+            if self._opened:
+                return
+            self._opened = True
+            if self.path is None or not os.path.exists(self.path):
+                return
+            try:
+                header = read_bank_header(self.path)
+                if header.get('format') != BANK_FORMAT or header.get('engine') != ENGINE_VERSION:
+                    print(f"Ignoring sample bank {self.path}: baked by another engine version, "
+                          f"run 'main.py bake' to rebuild it")
+                    return
+                if header.get('sample_rate') != SAMPLE_RATE:
+                    print(f"Ignoring sample bank {self.path}: baked at {header.get('sample_rate')} Hz")
+                    return
+                index = np.fromfile(self.path, dtype=BANK_INDEX_DTYPE, count=header['entries'],
+                                    offset=header['index_offset'])
+                samples = np.memmap(self.path, dtype='<f4', mode='r', offset=BANK_DATA_OFFSET,
+                                    shape=(header['frames'],)) if header['frames'] else np.zeros(0, '<f4')
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring sample bank {self.path}: {e}")
+                return
+            self._index = {
+                bytes(key): (start, length)
+                for key, start, length in zip(index['key'], index['start'].tolist(), index['length'].tolist())
+            }
+            self._samples = samples
+            self.header = header
+
+    @property
+    def available(self):
+        """Whether a valid bank file is mapped"""
+        if not self._opened:
+            self._load()
+        return self._index is not None
+
+    def get(self, patch_key, frequency, duration_ms, volume, seed):
+        """Return the baked buffer of a note as a read-only view into the file, or None"""
+        if not self.available:
+            return None
+        entry = self._index.get(bank_key(patch_key, frequency, duration_ms, volume, seed))
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        start, length = entry
+        return np.asarray(self._samples[start:start + length])
+
+    def stats(self):
+        """Return hit/miss counters of this process and the size of the mapped bank"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._index) if self._index is not None else 0,
+                'bytes': self._samples.nbytes if self._samples is not None else 0,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+# Shared by every renderer in the process
+SAMPLE_BANK = SampleBank()
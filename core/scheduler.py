@@ -0,0 +1,91 @@
+"""
+Work-stealing scheduling of independent, cost-weighted tasks on threads.
+
+Tasks are dealt out largest first, each to the worker with the least
+estimated work so far, into one deque per worker. A worker runs its own
+deque from the front (its largest tasks first). Once that is empty it steals
+from the back of the longest other deque, so the small tasks at the end of
+every queue even out the finish times. Deque pops are atomic in CPython, so
+neither owners nor thieves take a lock.
+"""
+import collections
+import concurrent.futures
+import threading
+
+
+class WorkStealingScheduler:
+    """Run tasks on a fixed number of worker threads, balancing them by stealing"""
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        # Written only by their own worker
+        self.tasks_run = [0] * self.workers
+        self.steals = [0] * self.workers
+
+    def _deal(self, costs):
+        deques = [collections.deque() for _ in range(self.workers)]
+        loads = [0.0] * self.workers
+        for idx in sorted(range(len(costs)), key=lambda idx: -costs[idx]):
+            worker = min(range(self.workers), key=loads.__getitem__)
+            deques[worker].append(idx)
+            loads[worker] += costs[idx]
+        return deques
+
+    def _steal(self, deques, thief):
+        victims = sorted(
+            (worker for worker in range(self.workers) if worker != thief),
+            key=lambda worker: -len(deques[worker])
+        )
+        for victim in victims:
+            try:
+                idx = deques[victim].pop()
+            except IndexError:
+                continue
+            self.steals[thief] += 1
+            return idx
+        return None
+
+    def run(self, tasks, costs, run_task, executor=None, before_task=None):
+        """
+        Call run_task(task) for every task and return the results in task
+        order. before_task(), if given, runs ahead of every task and may raise
+        to stop all workers. With an executor the worker loops run on its
+        threads; otherwise a pool of self.workers threads is started.
+        """
+        results = [None] * len(tasks)
+        deques = self._deal(costs)
+        stop = threading.Event()
+
+        def worker(own):
+            while not stop.is_set():
+                try:
+                    idx = deques[own].popleft()
+                except IndexError:
+                    idx = self._steal(deques, own)
+                    if idx is None:
+                        return
+                if before_task is not None:
+                    before_task()
+                results[idx] = run_task(tasks[idx])
+                self.tasks_run[own] += 1
+
+        pool = executor or concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='render-worker'
+        )
+        try:
+            futures = [pool.submit(worker, own) for own in range(self.workers)]
+            pending = set(futures)
+            while pending:
+                # Short waits keep the calling thread responsive to Ctrl+C
+                done, pending = concurrent.futures.wait(
+                    pending, timeout=0.1, return_when=concurrent.futures.FIRST_EXCEPTION
+                )
+                for future in done:
+                    future.result()
+            return results
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            if executor is None:
+                pool.shutdown(wait=True)
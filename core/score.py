@@ -0,0 +1,319 @@
+"""
+Compiled score representation.
+
+A Score keeps every section once as a NumPy structured array of its
+sounding notes (one row per note, chord notes sharing a group id) and plays
+repeats by reference, so a section looped a hundred times costs no more
+memory than one pass. Pitches are resolved to frequencies and onsets to
+frames when the score is compiled, and timeline analysis (durations, note
+counts, section offsets) runs on whole arrays instead of note objects.
+
+The seed, humanize and multisample settings travel with the score to every
+renderer and worker process, but they are render options and are not saved
+with it. A quality tier is applied with Score.at_quality, which returns a
+copy with simplified instruments and onsets at the tier's sample rate.
+"""
+import json
+
+import numpy as np
+
+from .constants import NOTE_FREQUENCIES, ENGINE_VERSION
+from .notes import Chord, Section
+from .quality import DEFAULT_QUALITY
+from .seeding import DEFAULT_SEED
+from .timeline import SAMPLE_RATE, ms_to_frames
+
+NOTE_DTYPE = np.dtype([
+    ('onset', np.int64),         # Frames from the start of the section
+    ('onset_ms', np.float64),    # Milliseconds from the start of the section
+    ('duration_ms', np.float64),
+    ('frequency', np.float64),
+    ('midi', np.int16),
+    ('volume', np.float64),
+    ('instrument', np.int16),    # Index into Score.instruments
+    ('track', np.int16),
+    ('group', np.int32),         # Chord index within the section, -1 for single notes
+])
+
+
+def frequency_to_midi(frequencies):
+    """Nearest MIDI note number for each frequency"""
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    return np.rint(69 + 12 * np.log2(frequencies / 440.0)).astype(np.int16)
+
+
+class ScoreSection:
+    """One section's notes, sorted by track and onset, plus each track's length"""
+    __slots__ = ('notes', 'track_lengths_ms', 'repeat_count', 'name', '_track_bounds')
+
+    def __init__(self, notes, track_lengths_ms, repeat_count=1, name=None):
+        order = np.lexsort((notes['onset'], notes['track']))
+        self.notes = notes[order]
+        self.track_lengths_ms = np.asarray(track_lengths_ms, dtype=np.float64)
+        self.repeat_count = repeat_count
+        self.name = name
+        self._track_bounds = np.searchsorted(
+            self.notes['track'], np.arange(len(self.track_lengths_ms) + 1)
+        )
+
+    @property
+    def track_count(self):
+        return len(self.track_lengths_ms)
+
+    def track_notes(self, track_idx):
+        """View of one track's notes, without copying"""
+        if track_idx >= self.track_count:
+            return self.notes[:0]
+        return self.notes[self._track_bounds[track_idx]:self._track_bounds[track_idx + 1]]
+
+    def track_events(self, track_idx):
+        """Split a track's notes into events: a single note or all notes of one chord"""
+        notes = self.track_notes(track_idx)
+        if len(notes) == 0:
+            return []
+        # A new event starts wherever the chord group changes or a single note begins
+        starts = np.flatnonzero(
+            (notes['group'] < 0) |
+            np.concatenate(([True], notes['group'][1:] != notes['group'][:-1]))
+        )
+        return np.split(notes, starts[1:])
+
+    def at_sample_rate(self, sample_rate):
+        """Copy of the section with its onsets in frames of another sample rate"""
+        notes = self.notes.copy()
+        notes['onset'] = (notes['onset_ms'] * (sample_rate / 1000.0)).astype(np.int64)
+        return ScoreSection(notes, self.track_lengths_ms, self.repeat_count, self.name)
+
+
+class Score:
+    """Compiled sheet music: instruments, sections and the order they repeat in"""
+    __slots__ = ('instruments', 'sections', 'track_instruments', 'sample_rate', 'seed', 'humanize',
+                 'multisample', 'quality')
+
+    def __init__(self, instruments, sections, track_instruments, sample_rate=SAMPLE_RATE,
+                 seed=DEFAULT_SEED, humanize=False, multisample=None, quality=DEFAULT_QUALITY):
+        self.instruments = instruments
+        self.sections = sections
+        self.track_instruments = track_instruments
+        self.sample_rate = sample_rate
+        self.seed = seed
+        self.humanize = humanize
+        # Instrument name ('*' for every pitched instrument) -> (anchor spacing, resample quality)
+        self.multisample = multisample or {}
+        # Name of the quality tier the instruments and sample rate were set up for
+        self.quality = quality
+
+    @classmethod
+    def from_sections(cls, sections, sample_rate=SAMPLE_RATE):
+        """Compile Sections of Note/Chord tracks, sharing one instrument table"""
+        instruments, instrument_ids, track_instruments = [], {}, []
+
+        def instrument_id(instrument):
+            if id(instrument) not in instrument_ids:
+                instrument_ids[id(instrument)] = len(instruments)
+                instruments.append(instrument)
+            return instrument_ids[id(instrument)]
+
+        compiled = []
+        for section in sections:
+            rows, lengths, group = [], [], 0
+            for track_idx, track in enumerate(section.tracks):
+                durations = np.array([
+                    max(note.duration_ms for note in item.notes) if isinstance(item, Chord)
+                    else item.duration_ms
+                    for item in track
+                ], dtype=np.float64)
+                onsets_ms = np.concatenate(([0.0], np.cumsum(durations)[:-1]))
+                lengths.append(durations.sum())
+
+                for item, onset_ms in zip(track, onsets_ms):
+                    notes = item.notes if isinstance(item, Chord) else [item]
+                    item_group = group if isinstance(item, Chord) else -1
+                    group += isinstance(item, Chord)
+                    for note in notes:
+                        rows.append((
+                            onset_ms, note.duration_ms,
+                            NOTE_FREQUENCIES.get(note.pitch, 0),
+                            note.volume, instrument_id(note.instrument), track_idx, item_group
+                        ))
+
+                if track_idx >= len(track_instruments):
+                    first = next((
+                        item.notes[0] if isinstance(item, Chord) else item
+                        for item in track if not isinstance(item, Chord) or item.notes
+                    ), None)
+                    track_instruments.append(
+                        instrument_id(first.instrument) if first is not None else -1
+                    )
+
+            compiled.append(ScoreSection(
+                cls._compile_rows(rows, sample_rate), lengths, section.repeat_count, section.name
+            ))
+
+        return cls(instruments, compiled, track_instruments, sample_rate)
+
+    def at_quality(self, tier):
+        """
+        Copy of the score to render at a quality tier (see core.quality): each
+        instrument simplified by the tier and every onset at the tier's sample
+        rate. Render options carry over, and sections are shared when the
+        sample rate does not change. Simplified instruments are copies, which
+        save cannot name, so only the original score is saved.
+        """
+        sections = self.sections
+        if tier.sample_rate != self.sample_rate:
+            sections = [section.at_sample_rate(tier.sample_rate) for section in self.sections]
+        return Score(
+            [instrument.at_quality(tier) for instrument in self.instruments], sections,
+            self.track_instruments, tier.sample_rate, self.seed, self.humanize, self.multisample, tier.name
+        )
+
+    @classmethod
+    def from_tracks(cls, tracks, sample_rate=SAMPLE_RATE):
+        """Compile plain lists of notes and chords as one section played once"""
+        return cls.from_sections([Section(list(tracks))], sample_rate)
+
+    @staticmethod
+    def _compile_rows(rows, sample_rate):
+        columns = list(zip(*rows)) if rows else [[]] * 7
+        onset_ms, duration_ms, frequency, volume, instrument, track, group = (
+            np.asarray(column, dtype=np.float64) for column in columns
+        )
+
+        # Rests and unknown pitches only take up time, which the onsets already hold
+        sounding = frequency > 0
+        notes = np.zeros(np.count_nonzero(sounding), dtype=NOTE_DTYPE)
+        notes['onset_ms'] = onset_ms[sounding]
+        notes['onset'] = (onset_ms[sounding] * (sample_rate / 1000.0)).astype(np.int64)
+        notes['duration_ms'] = duration_ms[sounding]
+        notes['frequency'] = frequency[sounding]
+        notes['midi'] = frequency_to_midi(frequency[sounding])
+        notes['volume'] = volume[sounding]
+        notes['instrument'] = instrument[sounding]
+        notes['track'] = track[sounding]
+        notes['group'] = group[sounding]
+        return notes
+
+    @property
+    def track_count(self):
+        return max((section.track_count for section in self.sections), default=0)
+
+    def __len__(self):
+        return self.track_count
+
+    def track_instrument(self, track_idx):
+        """The instrument a track starts with, or None for a track with no notes"""
+        instrument = self.track_instruments[track_idx] if track_idx < len(self.track_instruments) else -1
+        return self.instruments[instrument] if instrument >= 0 else None
+
+    def _lengths_matrix(self):
+        """(sections, tracks) section lengths in ms, zero where a section lacks a track"""
+        lengths = np.zeros((len(self.sections), self.track_count))
+        for row, section in enumerate(self.sections):
+            lengths[row, :section.track_count] = section.track_lengths_ms
+        return lengths
+
+    def _repeat_counts(self):
+        return np.array([section.repeat_count for section in self.sections], dtype=np.int64)
+
+    def track_durations_ms(self):
+        """Length of every track with all repeats played"""
+        return self._repeat_counts() @ self._lengths_matrix()
+
+    @property
+    def duration_ms(self):
+        return float(self.track_durations_ms().max(initial=0))
+
+    @property
+    def frames(self):
+        return ms_to_frames(self.duration_ms, self.sample_rate)
+
+    def note_counts(self):
+        """Sounding notes per track with all repeats played"""
+        counts = np.zeros((len(self.sections), self.track_count), dtype=np.int64)
+        for row, section in enumerate(self.sections):
+            counts[row] = np.bincount(section.notes['track'], minlength=self.track_count)
+        return self._repeat_counts() @ counts
+
+    def section_starts_ms(self, track_idx):
+        """Start of every section on a track, before repeats are played"""
+        lengths = self._lengths_matrix()[:, track_idx] * self._repeat_counts()
+        return np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+
+    def iter_track(self, track_idx):
+        """
+        Yield (start_ms, section) for every played section on a track, expanding
+        repeats lazily. Tracks keep their own running position, like the loader did.
+        """
+        for start_ms, section in zip(self.section_starts_ms(track_idx), self.sections):
+            if track_idx >= section.track_count:
+                continue
+            length = section.track_lengths_ms[track_idx]
+            for repeat in range(section.repeat_count):
+                yield start_ms + repeat * length, section
+
+    def expand(self):
+        """Materialize every played note with absolute onsets, for analysis or export"""
+        parts = []
+        for track_idx in range(self.track_count):
+            for start_ms, section in self.iter_track(track_idx):
+                notes = section.track_notes(track_idx).copy()
+                notes['onset'] += ms_to_frames(start_ms, self.sample_rate)
+                notes['onset_ms'] += start_ms
+                parts.append(notes)
+        if not parts:
+            return np.zeros(0, dtype=NOTE_DTYPE)
+        notes = np.concatenate(parts)
+        return notes[np.argsort(notes['onset'], kind='stable')]
+
+    def save(self, path, instrument_names):
+        """
+        Write the compiled score to an uncompressed .npz file, all sections'
+        notes in one array. Instruments are stored by name, looked up in
+        instrument_names (a name to Instrument map).
+        """
+        names = {id(instrument): name for name, instrument in instrument_names.items()}
+        header = {
+            'engine_version': ENGINE_VERSION,
+            'sample_rate': self.sample_rate,
+            'instruments': [names[id(instrument)] for instrument in self.instruments],
+            'track_instruments': list(self.track_instruments),
+            'sections': [
+                {'repeat_count': section.repeat_count, 'name': section.name,
+                 'tracks': section.track_count}
+                for section in self.sections
+            ],
+        }
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+                notes=np.concatenate(
+                    [section.notes for section in self.sections] or [np.zeros(0, NOTE_DTYPE)]
+                ),
+                note_counts=np.array([len(section.notes) for section in self.sections], dtype=np.int64),
+                lengths=self._lengths_matrix()
+            )
+
+    @classmethod
+    def load(cls, path, instrument_names):
+        """Read a score written by save, resolving instrument names again"""
+        with np.load(path) as data:
+            header = json.loads(data['header'].tobytes().decode())
+            if header['engine_version'] != ENGINE_VERSION:
+                raise ValueError(f"Compiled score {path} is from another engine version")
+            notes = data['notes']
+            bounds = np.concatenate(([0], np.cumsum(data['note_counts'])))
+            lengths = data['lengths']
+
+        sections = [
+            ScoreSection(
+                notes[bounds[idx]:bounds[idx + 1]], lengths[idx, :section['tracks']],
+                section['repeat_count'], section['name']
+            )
+            for idx, section in enumerate(header['sections'])
+        ]
+        return cls(
+            [instrument_names[name] for name in header['instruments']],
+            sections, header['track_instruments'], header['sample_rate']
+        )
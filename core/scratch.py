@@ -0,0 +1,154 @@
+"""
+Scratch storage for the buffers of one render.
+
+The note-batch partials, section stems and master mix of a long render can
+outgrow RAM. A ScratchStore hands buffers out from memory until the render
+holds spill_bytes of them, then from float32 numpy.memmap files in a private
+scratch directory, so the rest of the render pages through disk instead.
+Partials, which are read back once, are appended to a single spill file
+rather than mapped one by one.
+
+Files are unlinked as soon as they are open where the OS allows it (POSIX),
+so their space is returned even if the process is killed; elsewhere they go
+when the store is closed. The directory is removed on close, or when the
+store is garbage collected.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+import numpy as np
+
+# Bytes of buffers a render keeps in RAM before spilling the rest to disk
+DEFAULT_SPILL_BYTES = 1024 * 1024 * 1024
+
+
+class SpilledBuffer:
+    """A float32 buffer parked in a store's spill file; np.asarray reads it back"""
+
+    def __init__(self, store, offset, shape):
+        self.store = store
+        self.offset = offset
+        self.shape = shape
+
+    def __array__(self, dtype=None, copy=None):
+        samples = self.store._read(self.offset, self.shape)
+        return samples if dtype is None else samples.astype(dtype, copy=False)
+
+
+class ScratchStore:
+    """
+    Memory, then disk, for the float32 buffers of one render.
+
+    directory    where the store's scratch directory is made (default: the system temp directory)
+    spill_bytes  bytes of buffers held in RAM before new ones go to disk (0 spills everything)
+    """
+
+    def __init__(self, directory=None, spill_bytes=DEFAULT_SPILL_BYTES):
+        self.directory = directory
+        self.spill_bytes = spill_bytes
+        self.ram_bytes = 0
+        self.disk_bytes = 0
+        self.path = None
+        self._spill_file = None
+        self._spill_end = 0
+        self._leftover = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _scratch_path(self):
+        # Created on the first spill, so renders that fit in RAM never touch disk
+        if self.path is None:
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+            self.path = tempfile.mkdtemp(prefix='render-', dir=self.directory)
+            self._cleanup = weakref.finalize(self, shutil.rmtree, self.path, True)
+        return self.path
+
+    def _unlink(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Open files cannot be removed on Windows
+            self._leftover.append(path)
+
+    def _reserve(self, nbytes):
+        with self._lock:
+            if self.ram_bytes + nbytes > self.spill_bytes:
+                self.disk_bytes += nbytes
+                return False
+            self.ram_bytes += nbytes
+            return True
+
+    def zeros(self, shape):
+        """Zeroed float32 buffer: in RAM while the store is under budget, else memory mapped"""
+        nbytes = int(np.prod(shape)) * np.dtype(np.float32).itemsize
+        if nbytes == 0 or self._reserve(nbytes):
+            return np.zeros(shape, dtype=np.float32)
+        with self._lock:
+            fd, path = tempfile.mkstemp(suffix='.f32', dir=self._scratch_path())
+        os.close(fd)
+        # Sparse on most file systems, so untouched frames cost no disk
+        samples = np.memmap(path, dtype=np.float32, mode='w+', shape=shape)
+        self._unlink(path)
+        return samples
+
+    def keep(self, samples):
+        """
+        Hold a finished buffer until the render reads it back: as it is while
+        the store is under budget, else appended to the spill file.
+        """
+        samples = np.ascontiguousarray(samples, dtype=np.float32)
+        if self._reserve(samples.nbytes):
+            return samples
+        with self._lock:
+            if self._spill_file is None:
+                fd, path = tempfile.mkstemp(suffix='.spill', dir=self._scratch_path())
+                self._spill_file = os.fdopen(fd, 'w+b')
+                self._unlink(path)
+            offset = self._spill_end
+            self._spill_file.seek(offset)
+            self._spill_file.write(memoryview(samples).cast('B'))
+            self._spill_end += samples.nbytes
+        return SpilledBuffer(self, offset, samples.shape)
+
+    def _read(self, offset, shape):
+        samples = np.empty(shape, dtype=np.float32)
+        with self._lock:
+            self._spill_file.seek(offset)
+            self._spill_file.readinto(memoryview(samples).cast('B'))
+        return samples
+
+    def release(self, samples):
+        """Return the budget of a buffer from this store that is no longer used"""
+        if isinstance(samples, np.ndarray) and not isinstance(samples, np.memmap):
+            with self._lock:
+                self.ram_bytes = max(0, self.ram_bytes - samples.nbytes)
+
+    def stats(self):
+        """Bytes held in RAM and spilled to disk so far"""
+        with self._lock:
+            return {'ram_bytes': self.ram_bytes, 'disk_bytes': self.disk_bytes}
+
+    def close(self):
+        """Delete the scratch files; mapped buffers stay readable until they are dropped"""
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+            for path in self._leftover:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._leftover = []
+        if self.path is not None:
+            self._cleanup()
+            self.path = None
@@ -0,0 +1,43 @@
+"""
+Seeded random streams for synthesis.
+
+Every note draws its detune, phases and noise from its own
+numpy.random.Generator instead of the global np.random. The generator is
+seeded from the render seed and a hash of the note's content (instrument
+patch, frequency, length and volume), so identical notes render identical
+samples in any thread, worker process or order, and a note buffer is
+addressed by its content alone. With humanize, the note's place in the
+score is hashed in as well: repeated notes then vary, but the same way on
+every render with the same seed.
+"""
+import hashlib
+
+import numpy as np
+
+DEFAULT_SEED = 0
+
+
+def stream_seed(seed, *parts):
+    """SeedSequence for a seed and any reprable identity (stable across processes)"""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=16).digest()
+    return np.random.SeedSequence([seed, *np.frombuffer(digest, dtype=np.uint32).tolist()])
+
+
+def stream_rng(seed, *parts):
+    """Generator for a seed and identity, see stream_seed"""
+    return np.random.default_rng(stream_seed(seed, *parts))
+
+
+def note_rng(seed, patch_key, frequency, duration_ms, volume, variation=None):
+    """
+    Generator of one note. Notes with the same content share a stream unless
+    a variation (the note's place in the score, for humanize) is given.
+    """
+    return stream_rng(
+        seed, 'note', patch_key, float(frequency), float(duration_ms), float(volume), variation
+    )
+
+
+def ensure_rng(rng, *parts):
+    """rng itself, or a default-seeded stream for effects called without one"""
+    return rng if rng is not None else stream_rng(DEFAULT_SEED, *parts)
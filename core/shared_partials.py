@@ -0,0 +1,99 @@
+"""
+Shared memory for the note-batch partials of the process backend.
+
+A worker renders its batch straight into a new shared memory segment that
+the parent named, closes it and hands it over, so only the partial's shape
+travels back through the pool instead of its samples. The parent maps the
+segment and reads the partial in place until it is reduced into its stem.
+Segments are unlinked as soon as the parent maps them, so their memory is
+returned once the last view is gone. Segments of tasks whose results are
+never read (a cancelled render) are unlinked when those tasks finish.
+
+Windows destroys a segment with its last handle, so a segment cannot
+outlive the worker that made it; there partials are pickled back instead.
+"""
+import os
+import secrets
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+SUPPORTED = os.name != 'nt'
+
+
+def create_segment(name, shape):
+    """Worker side: a new zeroed float32 segment and an array over it"""
+    nbytes = int(np.prod(shape)) * np.dtype(np.float32).itemsize
+    segment = shared_memory.SharedMemory(name=name, create=True, size=max(nbytes, 1))
+    return segment, np.ndarray(shape, dtype=np.float32, buffer=segment.buf)
+
+
+def hand_over(segment):
+    """Worker side: close a finished segment and leave unlinking it to the parent"""
+    segment.close()
+    # Otherwise the worker's resource tracker unlinks it when the worker exits
+    resource_tracker.unregister(segment._name, 'shared_memory')
+
+
+class SharedPartials:
+    """The segments of one render, named after the tasks rendered into them"""
+
+    def __init__(self):
+        self.prefix = f"msr{os.getpid()}_{secrets.token_hex(3)}_"
+        self._segments = {}
+        self._claimed = set()
+        self._held = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def name(self, task_idx):
+        """Segment name a task renders into, or None to pickle its partial back"""
+        return f"{self.prefix}{task_idx}" if SUPPORTED else None
+
+    def attach(self, task_idx, shape):
+        """Map the partial a task rendered; it stays valid until release"""
+        with self._lock:
+            self._claimed.add(task_idx)
+        segment = shared_memory.SharedMemory(name=self.name(task_idx))
+        # The mapping outlives the name
+        segment.unlink()
+        self._segments[task_idx] = segment
+        return np.ndarray(shape, dtype=np.float32, buffer=segment.buf)
+
+    def discard(self, task_idx, future):
+        """Done callback of a task: unlink its segment if its result was never read"""
+        if not SUPPORTED or future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            if task_idx in self._claimed:
+                return
+            self._claimed.add(task_idx)
+        try:
+            segment = shared_memory.SharedMemory(name=self.name(task_idx))
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+    def release(self, *task_indices):
+        """Unmap the segments of tasks whose partials are no longer viewed"""
+        for task_idx in task_indices:
+            segment = self._segments.pop(task_idx, None)
+            if segment is None:
+                continue
+            try:
+                segment.close()
+            except BufferError:
+                # Still viewed while an error unwinds the render; unmapped
+                # once the views are collected
+                self._held.append(segment)
+
+    def close(self):
+        """Unmap every segment still attached"""
+        self.release(*list(self._segments))
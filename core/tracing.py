@@ -0,0 +1,316 @@
+"""
+Render instrumentation: timed spans, a progress event bus and run metrics.
+
+Spans are recorded only while TRACER is enabled; otherwise span() hands
+back a shared no-op context, so instrumented code costs one attribute check
+per call. Recorded spans can be written as Chrome/Perfetto trace events
+(chrome://tracing, ui.perfetto.dev) and summarized as self time per stage.
+
+Progress goes through PROGRESS, which rate-limits updates per key and
+passes them to its subscribers (by default a console printer).
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer._record(self.name, 'X', self.start, end - self.start, self.args)
+        return False
+
+
+class _Tags:
+    __slots__ = ('local', 'tags', 'previous')
+
+    def __init__(self, local, tags):
+        self.local = local
+        self.tags = tags
+
+    def __enter__(self):
+        self.previous = getattr(self.local, 'tags', {})
+        self.local.tags = {**self.previous, **self.tags}
+        return self
+
+    def __exit__(self, *exc):
+        self.local.tags = self.previous
+        return False
+
+
+class Tracer:
+    """Collects timed spans, instants and counters from every thread of a process"""
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.events = []
+
+    def span(self, name, **args):
+        """Time a block: with TRACER.span('envelope', notes=3): ..."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def tags(self, **tags):
+        """Attach tags such as track or instrument to every span opened in this thread inside the block"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Tags(self._local, tags)
+
+    def instant(self, name, **args):
+        if self.enabled:
+            self._record(name, 'i', time.perf_counter_ns(), 0, args)
+
+    def counter(self, name, **values):
+        if self.enabled:
+            self._record(name, 'C', time.perf_counter_ns(), 0, values)
+
+    def _record(self, name, phase, start, duration, args):
+        tags = getattr(self._local, 'tags', None)
+        if tags and phase == 'X':
+            args = {**tags, **args}
+        # list.append is atomic, so threads can record without a lock
+        self.events.append(
+            (name, phase, start, duration, os.getpid(), threading.get_ident(), args)
+        )
+
+    def extend(self, events):
+        """Merge events recorded in another process"""
+        self.events.extend(events)
+
+    def stage_times(self):
+        """
+        {name: (count, total seconds, self seconds)} over all recorded spans,
+        where self time excludes spans nested inside on the same thread.
+        """
+        by_thread = {}
+        for event in self.events:
+            if event[1] == 'X':
+                by_thread.setdefault((event[4], event[5]), []).append(event)
+
+        stages = {}
+
+        def close(entry):
+            # Self time is added when a span closes: its duration minus its children
+            end, name, children, duration = entry
+            count, total, own = stages[name]
+            stages[name] = (count, total, own + duration - children)
+
+        for events in by_thread.values():
+            events.sort(key=lambda event: (event[2], -event[3]))
+            stack = []  # [end, name, child time, duration] of the open spans
+            for name, _, start, duration, _, _, _ in events:
+                while stack and stack[-1][0] <= start:
+                    close(stack.pop())
+                if stack:
+                    stack[-1][2] += duration
+                count, total, own = stages.get(name, (0, 0, 0))
+                stages[name] = (count + 1, total + duration, own)
+                stack.append([start + duration, name, 0, duration])
+            while stack:
+                close(stack.pop())
+
+        return {
+            name: (count, total / 1e9, own / 1e9)
+            for name, (count, total, own) in stages.items()
+        }
+
+    def write_chrome_trace(self, path):
+        """Write the recorded events in the Chrome trace event format"""
+        origin = min((event[2] for event in self.events), default=0)
+        trace_events = []
+        threads = set()
+        for name, phase, start, duration, pid, tid, args in self.events:
+            event = {
+                'name': name, 'ph': phase, 'pid': pid, 'tid': tid,
+                'ts': (start - origin) / 1000, 'args': args
+            }
+            if phase == 'X':
+                event['dur'] = duration / 1000
+                event['cat'] = name.split('.')[0]
+            elif phase == 'i':
+                event['s'] = 't'
+            trace_events.append(event)
+            threads.add((pid, tid))
+
+        for pid in {pid for pid, _ in threads}:
+            trace_events.append({
+                'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                'args': {'name': 'renderer' if pid == os.getpid() else f'worker {pid}'}
+            })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+class ProgressBus:
+    """Rate-limited progress and run events, fanned out to subscribers"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._subscribers = []
+        self._last_update = {}
+
+    def subscribe(self, callback):
+        """callback(kind, fields) is called for every event that passes the rate limit"""
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def emit(self, kind, **fields):
+        for callback in list(self._subscribers):
+            callback(kind, fields)
+
+    def progress(self, key, done, total, **fields):
+        """Report done of total for key; at most one update per interval, plus the last"""
+        now = time.monotonic()
+        if done < total and now - self._last_update.get(key, float('-inf')) < self.interval:
+            return
+        self._last_update[key] = now
+        TRACER.counter(f'progress {key}', done=done)
+        self.emit('progress', key=key, done=done, total=total, **fields)
+
+
+def format_loudness(loudness):
+    """One line of master bus statistics"""
+    integrated, peak = loudness['integrated_lufs'], loudness['peak_db']
+    line = f"Loudness: {integrated:.1f} LUFS" if integrated is not None else "Loudness: silent"
+    if peak is not None:
+        line += f", peak {peak:.1f} dBFS"
+    if loudness['gain_db']:
+        line += f", normalized by {loudness['gain_db']:+.1f} dB"
+    if loudness['limiter_reduction_db'] > 0.05:
+        line += f", limited by up to {loudness['limiter_reduction_db']:.1f} dB"
+    return line
+
+
+def print_progress(kind, fields):
+    """Default subscriber: print track progress and render stages like the renderer always has"""
+    if kind == 'progress':
+        if 'score' in fields:
+            print(f"[{fields['key']}] {fields['done']}/{fields['total']} {fields['score']}: "
+                  f"{', '.join(fields['outputs'])} ({fields['render_seconds']:.2f}s render)")
+        elif fields['total']:
+            print(f"[{fields['key']}] Progress: {fields['done'] / fields['total'] * 100:.1f}%")
+    elif kind == 'analyze':
+        print("Analyzing sheet music structure...")
+        print(f"Total duration: {fields['duration_ms'] / 1000:.1f} seconds")
+        print(f"Total notes: {fields['notes']}\n")
+    elif kind == 'dispatch':
+        if fields['shared']:
+            print(f"Rendering {fields['batches']} note batches in the shared {fields['backend']} pool...")
+        else:
+            units = 'processes' if fields['backend'] == 'process' else 'threads'
+            print(f"Rendering {fields['batches']} note batches using {fields['workers']} {units}...")
+    elif kind == 'interrupted':
+        print("\nCtrl+C detected. Cancelling...")
+    elif kind == 'mix':
+        print("\nAll tracks processed!")
+        print("Performing final mix...")
+    elif kind == 'cache':
+        print(f"Note cache: {fields['hits']} hits, {fields['misses']} misses, "
+              f"{fields['evictions']} evictions")
+        if fields.get('stem_cache'):
+            stems = fields['stem_hits'] + fields['stem_misses']
+            print(f"Stem cache: {fields['stem_hits']} of {stems} stems reused, "
+                  f"{fields['stem_misses']} rendered, {fields['stem_evictions']} evicted")
+        if fields['bank_hits'] + fields['bank_misses']:
+            print(f"Sample bank: {fields['bank_hits']} notes served, "
+                  f"{fields['bank_misses']} not baked")
+    elif kind == 'scratch':
+        if fields['disk_bytes']:
+            print(f"Scratch: {fields['disk_bytes'] / (1024 * 1024):.1f} MB spilled to disk")
+    elif kind == 'master':
+        print(format_loudness(fields))
+    elif kind == 'done':
+        print("Audio generation complete!")
+
+
+def peak_rss_mb(include_children=True):
+    """Peak resident set size in MB, of this process and its largest worker, or None where unsupported"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def print_run_summary(wall_seconds, notes, audio_seconds, cache_stats, tracer=None, out=sys.stdout,
+                      loudness=None):
+    """
+    End-of-run metrics: time per stage (when spans were recorded), notes/sec,
+    realtime factor, cache hit rates, master loudness and peak memory.
+    """
+    print("\nRun summary", file=out)
+    stages = tracer.stage_times() if tracer is not None else {}
+    if stages:
+        print(f"  {'stage':<20} {'calls':>8} {'self s':>9} {'total s':>9} {'share':>7}", file=out)
+        busy = sum(own for _, _, own in stages.values()) or 1
+        for name, (count, total, own) in sorted(stages.items(), key=lambda item: -item[1][2]):
+            print(f"  {name:<20} {count:>8} {own:>9.3f} {total:>9.3f} {own / busy:>6.1%}", file=out)
+        print(file=out)
+
+    print(f"  Wall time:       {wall_seconds:.2f} s", file=out)
+    if wall_seconds > 0:
+        print(f"  Notes/sec:       {notes / wall_seconds:.1f}", file=out)
+        print(f"  Realtime factor: {audio_seconds / wall_seconds:.1f}x", file=out)
+    for name, stats in cache_stats.items():
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        if lookups:
+            print(f"  {name + ' cache:':<17}{stats['hits'] / lookups:.1%} hit rate "
+                  f"({stats['hits']}/{lookups})", file=out)
+    if loudness and loudness.get('integrated_lufs') is not None:
+        print(f"  Loudness:        {loudness['integrated_lufs']:.1f} LUFS", file=out)
+    peak = peak_rss_mb()
+    if peak is not None:
+        print(f"  Peak memory:     {peak:.1f} MB", file=out)
+
+
+# Shared by everything rendered in this process
+TRACER = Tracer()
+PROGRESS = ProgressBus()
+PROGRESS.subscribe(print_progress)
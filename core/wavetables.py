@@ -0,0 +1,92 @@
+"""
+Band-limited wavetables for the oscillator bank.
+
+Each waveform gets one table per octave band, holding only the harmonics
+that stay below Nyquist for the highest frequency in that band. Tables are
+built lazily on first use per (waveform, sample rate) and read with a
+vectorized phase accumulator and linear interpolation. Sines are evaluated
+directly since they have a single harmonic.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from .timeline import SAMPLE_RATE
+
+TABLE_SIZE = 4096
+# Lowest frequency of the first octave band; anything below shares that table
+BASE_FREQUENCY = 20.0
+
+
+def _harmonic_series(wave_type, harmonics):
+    """Sine and cosine amplitudes of harmonics 1..N, phase-aligned with pydub's generators"""
+    k = np.arange(1, harmonics + 1, dtype=np.float64)
+    odd = k % 2 == 1
+    sine = np.zeros_like(k)
+    cosine = np.zeros_like(k)
+
+    if wave_type == 'sawtooth':
+        # Rises from -1 to +1 over each cycle
+        sine = -2 / (np.pi * k)
+    elif wave_type == 'square':
+        sine[odd] = 4 / (np.pi * k[odd])
+    elif wave_type == 'triangle':
+        # Starts at -1 and peaks half way through the cycle
+        cosine[odd] = -8 / (np.pi ** 2 * k[odd] ** 2)
+    else:
+        sine[0] = 1.0
+    return sine, cosine
+
+
+def band_count(sample_rate=SAMPLE_RATE):
+    return max(1, int(np.ceil(np.log2(sample_rate / 2 / BASE_FREQUENCY))))
+
+
+@lru_cache(maxsize=None)
+def get_wavetables(wave_type, sample_rate=SAMPLE_RATE):
+    """Return a read-only (bands, TABLE_SIZE + 1) array of tables, the last column wrapping to the first"""
+    nyquist = sample_rate / 2
+    phase = np.arange(TABLE_SIZE + 1) / TABLE_SIZE
+    tables = np.empty((band_count(sample_rate), TABLE_SIZE + 1))
+
+    for band in range(len(tables)):
+        top_frequency = BASE_FREQUENCY * 2 ** (band + 1)
+        harmonics = max(1, min(int(nyquist // top_frequency), TABLE_SIZE // 2 - 1))
+        sine, cosine = _harmonic_series(wave_type, harmonics)
+        angles = 2 * np.pi * np.outer(np.arange(1, harmonics + 1), phase)
+        tables[band] = sine @ np.sin(angles) + cosine @ np.cos(angles)
+
+    tables.setflags(write=False)
+    return tables
+
+
+def band_for_frequencies(frequencies, sample_rate=SAMPLE_RATE):
+    """Index of the octave band table that each frequency should read from"""
+    octaves = np.log2(np.maximum(np.asarray(frequencies, dtype=np.float64), 1e-9) / BASE_FREQUENCY)
+    return np.clip(np.floor(octaves), 0, band_count(sample_rate) - 1).astype(np.intp)
+
+
+def read_wavetable(wave_type, frequencies, n, sample_rate=SAMPLE_RATE):
+    """Evaluate a (voices, len(n)) block of unit-amplitude waves at sample indices n"""
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    if wave_type not in ('square', 'sawtooth', 'triangle'):
+        # A sine is already band-limited and np.sin beats a table lookup
+        return np.sin(np.outer(frequencies * (2 * np.pi / sample_rate), n))
+
+    tables = get_wavetables(wave_type, sample_rate)
+    offsets = band_for_frequencies(frequencies, sample_rate)[:, np.newaxis] * tables.shape[1]
+
+    # Phase accumulator in table positions, split into index and fraction in place
+    position = np.outer(frequencies * (TABLE_SIZE / sample_rate), n)
+    np.mod(position, TABLE_SIZE, out=position)
+    index = position.astype(np.intp)
+    position -= index
+    index += offsets
+
+    flat_tables = tables.ravel()
+    lower = flat_tables.take(index)
+    upper = flat_tables.take(index + 1)
+    upper -= lower
+    upper *= position
+    upper += lower
+    return upper
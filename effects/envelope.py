@@ -1,17 +1,20 @@
 import numpy as np
 from pydub import AudioSegment
 
-def apply_enhanced_envelope(audio_segment, instrument):
-    """Apply more sophisticated ADSR envelope with curves"""
-    samples = np.array(audio_segment.get_array_of_samples())
-    sample_rate = audio_segment.frame_rate
+from core.cache import NoteCache
+from core.timeline import INT16_MAX
+
+# Finished curves depend only on the ADSR parameters and the note length
+ENVELOPE_CACHE = NoteCache(max_bytes=64 * 1024 * 1024)
+SMOOTHING_WINDOW = 32
 
+def _build_envelope(instrument, total_samples, sample_rate):
+    """Build the raw attack/decay/sustain/release curve before smoothing"""
     # Convert times to samples
     attack_samples = int(instrument.attack_ms * sample_rate / 1000)
     decay_samples = int(instrument.decay_ms * sample_rate / 1000)
     release_samples = int(instrument.release_ms * sample_rate / 1000)
 
-    total_samples = len(samples)
     sustain_samples = total_samples - attack_samples - decay_samples - release_samples
 
     # Ensure minimal envelope phases
@@ -30,8 +33,8 @@ def apply_enhanced_envelope(audio_segment, instrument):
         envelope[:attack_samples] = attack_curve
 
     # Decay phase (exponential curve)
+    decay_end = attack_samples + decay_samples
     if decay_samples > 0:
-        decay_end = attack_samples + decay_samples
         decay_curve = np.power(
             np.linspace(1, instrument.sustain_level, decay_samples), 0.5
         )
@@ -48,18 +51,52 @@ def apply_enhanced_envelope(audio_segment, instrument):
 
     # Release phase (exponential curve)
     if release_samples > 0:
+        release_start = sustain_curve[-1] if sustain_samples > 0 else instrument.sustain_level
         release_curve = np.power(
-            np.linspace(sustain_curve[-1], 0, release_samples), 0.3
+            np.linspace(release_start, 0, release_samples), 0.3
         )
         envelope[sustain_end:] = release_curve
 
-    # Apply envelope with smoothing
-    smoothed_envelope = np.convolve(envelope, np.ones(32)/32, mode='same')
-    samples = samples * smoothed_envelope
+    return envelope
+
+def moving_average(values, window=SMOOTHING_WINDOW):
+    """
+    O(n) running-sum moving average, aligned like
+    np.convolve(values, np.ones(window) / window, mode='same')
+    """
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    positions = np.arange(len(values))
+    before = window // 2
+    upper = np.minimum(positions + (window - before), len(values))
+    lower = np.maximum(positions - before, 0)
+    return (sums[upper] - sums[lower]) / window
+
+def envelope_curve(instrument, total_samples, sample_rate):
+    """Return the smoothed envelope for a note length, building it only on a cache miss"""
+    key = (
+        instrument.attack_ms, instrument.decay_ms, instrument.sustain_level,
+        instrument.release_ms, total_samples, sample_rate
+    )
+    return ENVELOPE_CACHE.get_or_render(
+        key,
+        lambda: moving_average(
+            _build_envelope(instrument, total_samples, sample_rate)
+        ).astype(np.float32)
+    )
+
+def apply_envelope(samples, instrument, sample_rate):
+    """Multiply a float sample buffer by the instrument's envelope in place"""
+    samples *= envelope_curve(instrument, len(samples), sample_rate)
+    return samples
+
+def apply_enhanced_envelope(audio_segment, instrument):
+    """Apply more sophisticated ADSR envelope with curves"""
+    samples = np.array(audio_segment.get_array_of_samples(), dtype=np.float32)
+    apply_envelope(samples, instrument, audio_segment.frame_rate)
 
     return AudioSegment(
-        samples.astype(np.int16).tobytes(),
-        frame_rate=sample_rate,
+        np.clip(samples, -INT16_MAX - 1, INT16_MAX).astype(np.int16).tobytes(),
+        frame_rate=audio_segment.frame_rate,
         sample_width=2,
         channels=1
-    )
\ No newline at end of file
+    )
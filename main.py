@@ -5,12 +5,24 @@
 import sys
 sys.path.append("..")
 
-from parsers.sheet_music import load_sheet_music_from_json, parse_sheet_music
+from parsers.sheet_music import load_sheet_music_from_json, parse_sheet_music, stream_sheet_music, STREAM_BLOCK_FRAMES
+from parsers.sheet_music import bake_sample_bank, BANK_DURATIONS_MS, BANK_VOLUMES
 
 
 from core.notes import Note, Chord
-from core.audio_utils import generate_instrument_tone, mix_audio, play_with_loop, convert_wav_to_mp3
+from core.audio_utils import generate_instrument_tone, mix_audio, play_with_loop, play_wav_blocks
 from effects.envelope import apply_enhanced_envelope
+from core.export import FORMATS, output_paths, export_blocks
+from core.cache import StemCache, NOTE_CACHE
+from core.master import MasterBus, DEFAULT_CEILING_DB
+from core.seeding import DEFAULT_SEED
+from core.resonance_bank import RESONANCE_CACHE
+from core.sample_bank import SAMPLE_BANK, SAMPLE_BANK_PATH
+from core.resample import RESAMPLE_QUALITIES, DEFAULT_RESAMPLE_QUALITY
+from core.quality import QUALITY_TIERS, DEFAULT_QUALITY
+from core.scratch import DEFAULT_SPILL_BYTES
+from core.tracing import TRACER, PROGRESS, format_loudness, print_progress, print_run_summary
+from effects.envelope import ENVELOPE_CACHE
 from core.constants import NOTE_FREQUENCIES
 from core.instruments import Instrument, AVAILABLE_INSTRUMENTS
 
@@ -18,18 +30,258 @@ import argparse
 import threading
 import keyboard
 import os
+import time
+
+def add_master_arguments(parser):
+    """Master bus options shared by every command that renders"""
+    parser.add_argument('--normalize', type=float, metavar='LUFS',
+                       help='Normalize the integrated loudness to this target, e.g. -14')
+    parser.add_argument('--ceiling', type=float, default=DEFAULT_CEILING_DB, metavar='DB',
+                       help=f'Peak limiter ceiling in dBFS (default: {DEFAULT_CEILING_DB})')
+    parser.add_argument('--no-limiter', action='store_true',
+                       help='Do not limit peaks on the master bus (they are clipped on export)')
+
+def add_seed_arguments(parser):
+    """Random seed options shared by every command that renders"""
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                       help=f'Seed of the random detune, phases and noise in every note (default: {DEFAULT_SEED})')
+    parser.add_argument('--humanize', action='store_true',
+                       help='Vary repeated notes instead of rendering identical notes identically')
+
+def add_quality_arguments(parser):
+    """Quality tier option shared by every command that renders"""
+    parser.add_argument('--quality', choices=list(QUALITY_TIERS), default=DEFAULT_QUALITY,
+                       help='draft renders at half the sample rate without effects, normal drops the upper '
+                            f'partials and string resonance, final renders everything (default: {DEFAULT_QUALITY})')
+
+def add_scratch_arguments(parser):
+    """Scratch file options shared by every command that renders whole scores"""
+    parser.add_argument('--scratch-dir', metavar='DIR',
+                       help='Where buffers that outgrow --spill-mb are memory mapped (default: the system temp directory)')
+    parser.add_argument('--spill-mb', type=int, default=DEFAULT_SPILL_BYTES // (1024 * 1024), metavar='MB',
+                       help='Buffers a render keeps in RAM before spilling to scratch files '
+                            f'(default: {DEFAULT_SPILL_BYTES // (1024 * 1024)})')
+
+def multisample_spec(spec):
+    """argparse type of one --multisample spec: [INSTRUMENT=]SPACING[:QUALITY]"""
+    name, _, value = spec.rpartition('=')
+    spacing, _, quality = value.partition(':')
+    quality = quality or DEFAULT_RESAMPLE_QUALITY
+    if name and name not in AVAILABLE_INSTRUMENTS:
+        raise argparse.ArgumentTypeError(f"unknown instrument: {name}")
+    if not spacing.isdigit() or int(spacing) < 1:
+        raise argparse.ArgumentTypeError(f"anchor spacing must be a positive number of semitones: {spec}")
+    if quality not in RESAMPLE_QUALITIES:
+        raise argparse.ArgumentTypeError(
+            f"resample quality must be one of {', '.join(RESAMPLE_QUALITIES)}: {spec}"
+        )
+    return AVAILABLE_INSTRUMENTS[name].name if name else '*', (int(spacing), quality)
+
+def add_multisample_arguments(parser):
+    """Multisample options shared by every command that renders"""
+    parser.add_argument('--multisample', nargs='+', type=multisample_spec, default=[],
+                       metavar='[INSTRUMENT=]SPACING[:QUALITY]',
+                       help='Synthesize one anchor note every SPACING semitones and derive the pitches '
+                            'between by resampling, for every instrument or the named one; QUALITY is '
+                            f"{', '.join(RESAMPLE_QUALITIES)} (default: {DEFAULT_RESAMPLE_QUALITY})")
+
+def master_bus(args):
+    return MasterBus(target_lufs=args.normalize, ceiling_db=args.ceiling, limit=not args.no_limiter)
+
+def serve_command(argv):
+    """main.py serve: keep a render server running with warm caches"""
+    from service import RenderService, serve
+
+    parser = argparse.ArgumentParser(prog='main.py serve',
+                                     description='Render sheet music over localhost HTTP with warm caches')
+    parser.add_argument('--host', default='127.0.0.1',
+                       help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765,
+                       help='Port to listen on (default: 8765)')
+    parser.add_argument('--jobs', '-j', type=int, default=2,
+                       help='Scores rendered or streamed at the same time (default: 2)')
+    parser.add_argument('--backend', choices=['thread', 'process'], default='thread',
+                       help='Shared track pool of threads or worker processes (default: thread)')
+    parser.add_argument('--workers', '-w', type=int,
+                       help='Size of the shared track pool (default: 4 threads or one process per CPU)')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Do not reuse stems from the on-disk stem cache')
+    parser.add_argument('--stem-cache-size', type=int, default=2048,
+                       help='Size cap of the on-disk stem cache in MB (default: 2048)')
+    parser.add_argument('--no-warm-up', action='store_true',
+                       help='Skip rendering a note per instrument before accepting jobs')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                       help='Do not log requests or render progress')
+    add_seed_arguments(parser)
+    add_quality_arguments(parser)
+    add_multisample_arguments(parser)
+    add_master_arguments(parser)
+    add_scratch_arguments(parser)
+    args = parser.parse_args(argv)
+
+    stem_cache = None if args.no_cache else StemCache(max_bytes=args.stem_cache_size * 1024 * 1024)
+    service = RenderService(args.jobs, args.backend, args.workers, stem_cache, master=master_bus(args),
+                            seed=args.seed, humanize=args.humanize, multisample=dict(args.multisample),
+                            quality=args.quality, scratch_dir=args.scratch_dir,
+                            spill_bytes=args.spill_mb * 1024 * 1024)
+    if args.quiet:
+        PROGRESS.unsubscribe(print_progress)
+    if not args.no_warm_up:
+        print("Warming up instruments...")
+        service.warm_up()
+    serve(service, args.host, args.port, args.quiet)
+    return 0
+
+def print_batch_progress(kind, fields):
+    if kind == 'progress' and fields['key'] == 'batch':
+        print_progress(kind, fields)
+
+def batch_command(argv):
+    """main.py batch: render every score in a directory or glob in one process"""
+    from service.batch import BatchRenderer, collect_scores, write_manifest
+
+    parser = argparse.ArgumentParser(prog='main.py batch',
+                                     description='Render many JSON scores with one shared worker pool')
+    parser.add_argument('scores', help='Directory of JSON scores or a glob pattern such as "songs/**/*.json"')
+    parser.add_argument('--output-dir', '-o', default='renders',
+                       help='Directory to write the audio to (default: renders)')
+    parser.add_argument('--format', '-f', nargs='+', choices=FORMATS, default=['mp3'],
+                       help='One or more formats to encode each score to (default: mp3)')
+    parser.add_argument('--backend', choices=['thread', 'process'], default='process',
+                       help='Shared track pool of worker processes or threads (default: process)')
+    parser.add_argument('--workers', '-w', type=int,
+                       help='Size of the shared track pool (default: one process per CPU or 4 threads)')
+    parser.add_argument('--renders', type=int, default=2,
+                       help='Scores rendered at the same time (default: 2)')
+    parser.add_argument('--encoders', type=int, default=2,
+                       help='Scores encoded at the same time (default: 2)')
+    parser.add_argument('--manifest', help='Manifest path (default: <output-dir>/manifest.json)')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Compile and render everything from scratch instead of reusing cached scores, stems and the sample bank')
+    parser.add_argument('--stem-cache-size', type=int, default=2048,
+                       help='Size cap of the on-disk stem cache in MB (default: 2048)')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                       help='Do not report scores as they finish')
+    add_seed_arguments(parser)
+    add_quality_arguments(parser)
+    add_multisample_arguments(parser)
+    add_master_arguments(parser)
+    add_scratch_arguments(parser)
+    args = parser.parse_args(argv)
+
+    paths = collect_scores(args.scores)
+    if not paths:
+        print(f"Error: no JSON scores found at {args.scores}", file=sys.stderr)
+        return 1
+
+    # Progress of scores rendering side by side would interleave, so only
+    # finished scores are reported
+    PROGRESS.unsubscribe(print_progress)
+    if not args.quiet:
+        PROGRESS.subscribe(print_batch_progress)
+    if args.no_cache:
+        SAMPLE_BANK.open(None)
+    stem_cache = None if args.no_cache else StemCache(max_bytes=args.stem_cache_size * 1024 * 1024)
+    renderer = BatchRenderer(
+        paths, args.output_dir, args.format, args.backend, args.workers,
+        args.renders, args.encoders, stem_cache, use_cache=not args.no_cache, master=master_bus(args),
+        seed=args.seed, humanize=args.humanize, multisample=dict(args.multisample), quality=args.quality,
+        scratch_dir=args.scratch_dir, spill_bytes=args.spill_mb * 1024 * 1024
+    )
+    print(f"Rendering {len(paths)} scores into {args.output_dir}...")
+    try:
+        manifest = renderer.run()
+    except KeyboardInterrupt:
+        print("\nBatch interrupted by user")
+        return 1
+
+    manifest_path = args.manifest or os.path.join(args.output_dir, 'manifest.json')
+    write_manifest(manifest, manifest_path)
+    summary = manifest['summary']
+    print(f"\nBatch complete: {summary['done']} rendered, {summary['failed']} failed, "
+          f"{summary['cancelled']} cancelled in {manifest['wall_seconds']:.1f}s "
+          f"({manifest['realtime_factor']}x realtime)")
+    for score in manifest['scores']:
+        if score['state'] == 'failed':
+            print(f"  {score['source']}: {score['error']}", file=sys.stderr)
+    print(f"Manifest written to {manifest_path}")
+    return 0 if summary['done'] == len(paths) else 1
+
+def bake_command(argv):
+    """main.py bake: prerender every instrument and pitch into a memory-mapped sample bank"""
+    parser = argparse.ArgumentParser(prog='main.py bake',
+                                     description='Bake every instrument and pitch into a sample bank file')
+    parser.add_argument('--output', '-o', default=SAMPLE_BANK_PATH,
+                       help=f'Sample bank file the renderer reads (default: {SAMPLE_BANK_PATH})')
+    parser.add_argument('--durations', type=float, nargs='+', default=list(BANK_DURATIONS_MS), metavar='MS',
+                       help=f"Note lengths to bake in ms (default: {' '.join(map(str, BANK_DURATIONS_MS))})")
+    parser.add_argument('--volumes', type=float, nargs='+', default=list(BANK_VOLUMES),
+                       help=f"Note volumes to bake (default: {' '.join(map(str, BANK_VOLUMES))})")
+    parser.add_argument('--instruments', nargs='+', choices=sorted(AVAILABLE_INSTRUMENTS),
+                       help='Instruments to bake (default: all)')
+    parser.add_argument('--scores', nargs='+', default=[], metavar='JSON',
+                       help='Also bake every note played in these scores')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                       help=f'Seed the bank serves; renders with another seed synthesize (default: {DEFAULT_SEED})')
+    args = parser.parse_args(argv)
+
+    instruments = AVAILABLE_INSTRUMENTS
+    if args.instruments:
+        instruments = {name: AVAILABLE_INSTRUMENTS[name] for name in args.instruments}
+    scores = [load_sheet_music_from_json(path, AVAILABLE_INSTRUMENTS) for path in args.scores]
+
+    print(f"Baking {len(instruments)} instruments into {args.output}...")
+    start = time.perf_counter()
+    try:
+        header = bake_sample_bank(args.output, instruments, args.durations, args.volumes,
+                                  args.seed, scores)
+    except KeyboardInterrupt:
+        print("\nBake interrupted by user")
+        return 1
+    size_mb = os.path.getsize(args.output) / (1024 * 1024)
+    print(f"\nBaked {header['entries']} notes ({size_mb:.1f} MB) "
+          f"in {time.perf_counter() - start:.1f}s")
+    return 0
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        return serve_command(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        return batch_command(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'bake':
+        return bake_command(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description='Generate music from JSON sheet music')
     parser.add_argument('json_file', help='Path to the JSON sheet music file')
     parser.add_argument('--output', '-o', default='output.wav',
-                       help='Output WAV file path (default: output.wav)')
+                       help='Output file path; its extension is replaced per format (default: output.wav)')
+    parser.add_argument('--format', '-f', nargs='+', choices=FORMATS, default=['mp3'],
+                       help='One or more formats to encode from the same render (default: mp3)')
     parser.add_argument('--play', '-p', action='store_true',
                        help='Play the music after generating')
     parser.add_argument('--loops', '-l', type=int,
                        help='Override number of loops specified in JSON')
     parser.add_argument('--list-instruments', '-i', action='store_true',
                        help='List available instruments and exit')
+    parser.add_argument('--backend', choices=['thread', 'process'], default='thread',
+                       help='Render tracks in threads or worker processes (default: thread)')
+    parser.add_argument('--workers', '-w', type=int,
+                       help='Number of render workers (default: 4 threads or one process per CPU)')
+    parser.add_argument('--stream', action='store_true',
+                       help='Render and export block by block to keep memory bounded on long pieces')
+    parser.add_argument('--block-size', type=int, default=STREAM_BLOCK_FRAMES,
+                       help=f'Frames per block when streaming (default: {STREAM_BLOCK_FRAMES})')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Compile and render everything from scratch instead of reusing cached scores, stems and the sample bank')
+    parser.add_argument('--stem-cache-size', type=int, default=2048,
+                       help='Size cap of the on-disk stem cache in MB (default: 2048)')
+    parser.add_argument('--profile', metavar='TRACE_JSON',
+                       help='Record per-stage spans and write them as a Chrome/Perfetto trace')
+    add_seed_arguments(parser)
+    add_quality_arguments(parser)
+    add_multisample_arguments(parser)
+    add_master_arguments(parser)
+    add_scratch_arguments(parser)
     args = parser.parse_args()
 
     try:
@@ -40,28 +292,79 @@ def main():
                 print(f"  - {name}")
             return 0
 
+        if args.profile:
+            TRACER.enable()
+        if args.no_cache:
+            SAMPLE_BANK.open(None)
+        # The renderer reports its cache counters and loudness on the progress bus
+        run_caches = {}
+        loudness = {}
+        def on_run_event(kind, fields):
+            if kind == 'cache':
+                run_caches.update(fields)
+            elif kind == 'master':
+                loudness.update(fields)
+        PROGRESS.subscribe(on_run_event)
+        run_start = time.perf_counter()
+
+        # Name the terminal window, unless the output is piped somewhere
+        if sys.stdout.isatty():
+            print("\033]0;Sheet Music Parser\007", end="")
+
         # Load and parse sheet music
         print(f"\nLoading sheet music from {args.json_file}...")
-        sheet_music = load_sheet_music_from_json(args.json_file, AVAILABLE_INSTRUMENTS)
+        sheet_music = load_sheet_music_from_json(args.json_file, AVAILABLE_INSTRUMENTS,
+                                                 use_cache=not args.no_cache)
+        sheet_music = sheet_music.at_quality(QUALITY_TIERS[args.quality])
+        sheet_music.seed = args.seed
+        sheet_music.humanize = args.humanize
+        sheet_music.multisample = dict(args.multisample)
 
-        # Generate the audio
-        print("Generating music...")
-        melody = parse_sheet_music(sheet_music)
+        outputs = output_paths(args.output, args.format)
+        # Streamed playback reads the render back from a WAV file
+        play_file = next((path for path, fmt in outputs if fmt == 'wav'), None)
+        if args.stream and args.play and play_file is None:
+            play_file = output_paths(args.output, ['wav'])[0][0]
+            outputs.append((play_file, 'wav'))
 
-        # Export with high-quality settings
-        print(f"Exporting to {args.output}...")
-        melody.export(args.output, format="wav", parameters=["-ar", "44100", "-ab", "192k", "-ac", "2"])
-        print("Successfully exported audio file")
+        if args.stream:
+            # Blocks are encoded as they are rendered, the full piece is never held in memory
+            print(f"Streaming to {', '.join(path for path, _ in outputs)}...")
+            export_blocks(stream_sheet_music(sheet_music, args.block_size, master_bus(args), loudness),
+                          outputs, sheet_music.sample_rate)
+            print(format_loudness(loudness))
+        else:
+            # Generate the audio
+            print("Generating music...")
+            stem_cache = None if args.no_cache else StemCache(max_bytes=args.stem_cache_size * 1024 * 1024)
+            melody = parse_sheet_music(sheet_music, backend=args.backend, workers=args.workers,
+                                       stem_cache=stem_cache, master=master_bus(args),
+                                       scratch_dir=args.scratch_dir, spill_bytes=args.spill_mb * 1024 * 1024)
 
-        # convert the wav to a mp3
-        print(f"Converting to {args.output.replace('.wav', '.mp3')}...")
-        convert_wav_to_mp3(args.output, args.output.replace('.wav', '.mp3'))
-        print("Successfully converted audio file")
+            # Encode every format straight from the rendered samples, a block at a time
+            print(f"Exporting to {', '.join(path for path, _ in outputs)}...")
+            export_blocks(melody.blocks(), outputs, melody.sample_rate, melody.channels)
+        print("Successfully exported audio file")
 
-        # remove the old wav file
-        print(f"Removing {args.output}...")
-        os.remove(args.output)
-        print("Successfully removed audio file")
+        if run_caches:
+            # Counted across worker processes too
+            cache_stats = {
+                'Note': {'hits': run_caches['hits'], 'misses': run_caches['misses']},
+                'Stem': {'hits': run_caches['stem_hits'], 'misses': run_caches['stem_misses']},
+                'Bank': {'hits': run_caches['bank_hits'], 'misses': run_caches['bank_misses']},
+            }
+        else:
+            cache_stats = {'Note': NOTE_CACHE.stats(), 'Bank': SAMPLE_BANK.stats()}
+        cache_stats['Envelope'] = ENVELOPE_CACHE.stats()
+        cache_stats['Resonance'] = RESONANCE_CACHE.stats()
+        print_run_summary(
+            time.perf_counter() - run_start, int(sheet_music.note_counts().sum()),
+            sheet_music.duration_ms / 1000, cache_stats, TRACER if args.profile else None,
+            loudness=loudness
+        )
+        if args.profile:
+            TRACER.write_chrome_trace(args.profile)
+            print(f"Wrote trace to {args.profile}")
 
         if args.play:
             print("\nPlaying music...")
@@ -83,11 +386,16 @@ def main():
             keyboard.on_press(on_press)
 
             try:
-                play_with_loop(melody, stop_playback, skip_to_next)
+                if args.stream:
+                    play_wav_blocks(play_file, stop_playback, skip_to_next)
+                else:
+                    play_with_loop(melody.to_audio_segment(), stop_playback, skip_to_next)
             except KeyboardInterrupt:
                 print("\nPlayback interrupted by user")
             finally:
                 keyboard.unhook_all()
+                if args.stream and 'wav' not in args.format:
+                    os.remove(play_file)
                 print("\nPlayback ended")
 
         return 0
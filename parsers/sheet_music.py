@@ -1,175 +1,852 @@
 import json
-from typing import List, Union, Dict, Tuple
-from pydub import AudioSegment
+from typing import List, Dict, Tuple
 
-from core.notes import Note, Chord
-from core.audio_utils import generate_instrument_tone, mix_audio
-from effects.envelope import apply_enhanced_envelope
-from core.constants import NOTE_FREQUENCIES
+from core.notes import Note, Chord, Section
+from core.score import Score, ScoreSection
+from core.audio_utils import render_instrument_tones, tone_cost, is_pitched
+from core.resample import resample
+from effects.envelope import apply_envelope
 from core.instruments import Instrument
+from core.timeline import SAMPLE_RATE, Timeline, ms_to_frames
+from core.mixer import StereoBus, compress, spread_gains
+from core.master import MasterBus
+from core.cache import NOTE_CACHE, CACHE_DIR, StemCache
+from core.sample_bank import SAMPLE_BANK, write_sample_bank
+from core.constants import ENGINE_VERSION, NOTE_FREQUENCIES
+from core.tracing import TRACER, PROGRESS
+from core.seeding import DEFAULT_SEED, note_rng
+from core.scheduler import WorkStealingScheduler
+from core.scratch import ScratchStore, DEFAULT_SPILL_BYTES
+from core.shared_partials import SharedPartials, create_segment, hand_over
 
 import concurrent.futures
+import functools
+import hashlib
+import heapq
+import itertools
+import os
 import threading
-import time
+import zipfile
 
-def process_track(track_info: Tuple[int, List, int, int, Dict[str, int]]) -> Tuple[int, AudioSegment]:
-    """Process a single track in a separate thread"""
-    track_idx, track, total_duration, track_note_count, note_counts = track_info
-    
-    print(f"[Track {track_idx + 1}] Starting: {track[0].instrument.name}")
-    track_audio = AudioSegment.silent(duration=total_duration)
-    current_position = 0
-    track_progress = 0
-    
-    for item in track:
-        if isinstance(item, Note):
-            if item.pitch == "REST":
-                current_position += item.duration_ms
-                track_progress += 1
-                continue
-            
-            frequency = NOTE_FREQUENCIES.get(item.pitch, 0)
-            if frequency > 0:
-                note_audio = generate_instrument_tone(
-                    frequency,
-                    item.instrument,
-                    item.duration_ms,
-                    item.volume
+import numpy as np
+
+class RenderCancelled(Exception):
+    """Raised inside a render once its cancel event is set"""
+
+def synthesize_notes(instrument: Instrument, frequencies: List[float], duration_ms: float,
+                     volumes: List[float], seed: int, variations: List[tuple] = None,
+                     sample_rate: int = SAMPLE_RATE) -> List[np.ndarray]:
+    """
+    Synthesize and envelope tones that share an instrument and length in one
+    oscillator pass at sample_rate. Each tone draws its noise from a
+    generator seeded by the seed, its content and its variation (see note_rng).
+    """
+    patch_key = instrument.patch_key()
+    if variations is None:
+        variations = [None] * len(frequencies)
+    tones = render_instrument_tones(
+        frequencies, instrument, duration_ms, volumes,
+        [
+            note_rng(seed, patch_key, frequency, duration_ms, volume, variation)
+            for frequency, volume, variation in zip(frequencies, volumes, variations)
+        ],
+        seed, sample_rate
+    )
+    # Like apply_enhanced_envelope, every tone is read as one mono stream
+    tones = [tone.T.ravel() for tone in tones]
+    for samples in tones:
+        with TRACER.span('envelope', instrument=instrument.name):
+            apply_envelope(samples, instrument, sample_rate)
+    return tones
+
+# Multisample anchors sit on MIDI notes MULTISAMPLE_BASE + k * spacing
+MULTISAMPLE_BASE = 60
+
+def multisample_setting(score: Score, instrument: Instrument):
+    """(anchor spacing, resample quality) of an instrument in a score, or None to synthesize every pitch"""
+    if not score.multisample or not is_pitched(instrument):
+        return None
+    setting = score.multisample.get(instrument.name, score.multisample.get('*'))
+    if setting is None or setting[0] <= 1:
+        return None
+    return tuple(setting)
+
+def multisample_anchor(midi: int, spacing: int) -> int:
+    """MIDI note of the anchor nearest to a note, at most half the spacing away"""
+    return MULTISAMPLE_BASE + spacing * ((midi - MULTISAMPLE_BASE + spacing // 2) // spacing)
+
+def midi_frequency(midi: int) -> float:
+    return 440.0 * 2 ** ((midi - 69) / 12)
+
+def render_anchors(score: Score, instrument: Instrument, anchors: List[Tuple[int, float]],
+                   duration_ms: float, spacing: int) -> List[np.ndarray]:
+    """
+    Return (channels, frames) tones, with effects but before the envelope,
+    for (anchor midi, volume) pairs. Anchors are rendered long enough to be
+    read up to half the spacing sharp, cached, and synthesized together on a miss.
+    """
+    patch_key = instrument.patch_key()
+    anchor_ms = duration_ms * 2 ** ((spacing // 2 + 1) / 12)
+    keys = [
+        ('anchor', patch_key, midi, duration_ms, volume, score.seed, spacing, score.sample_rate)
+        for midi, volume in anchors
+    ]
+    tones = [NOTE_CACHE.get(key) for key in keys]
+    missing = [idx for idx, tone in enumerate(tones) if tone is None]
+    if missing:
+        frequencies = [midi_frequency(anchors[idx][0]) for idx in missing]
+        volumes = [anchors[idx][1] for idx in missing]
+        rendered = render_instrument_tones(
+            frequencies, instrument, anchor_ms, volumes,
+            [
+                note_rng(score.seed, patch_key, frequency, anchor_ms, volume)
+                for frequency, volume in zip(frequencies, volumes)
+            ],
+            score.seed, score.sample_rate
+        )
+        for idx, tone in zip(missing, rendered):
+            tones[idx] = NOTE_CACHE.put(keys[idx], tone)
+    return tones
+
+def derive_notes(score: Score, instrument: Instrument, frequencies: List[float], midis: List[int],
+                 duration_ms: float, volumes: List[float], spacing: int, quality: str) -> List[np.ndarray]:
+    """
+    Pitch-shift notes from the nearest anchor of their instrument by
+    resampling it, then envelope them at their own length, so attack and
+    release keep their timing. Timbre drifts by at most half the spacing.
+    """
+    anchors = [multisample_anchor(midi, spacing) for midi in midis]
+    tones = render_anchors(score, instrument, list(zip(anchors, volumes)), duration_ms, spacing)
+    frames = int(score.sample_rate * (duration_ms / 1000.0))
+    buffers = []
+    for frequency, anchor, tone in zip(frequencies, anchors, tones):
+        with TRACER.span('resample', instrument=instrument.name):
+            samples = resample(tone, frequency / midi_frequency(anchor), frames, quality)
+        samples = np.ascontiguousarray(samples.T).ravel()
+        with TRACER.span('envelope', instrument=instrument.name):
+            apply_envelope(samples, instrument, score.sample_rate)
+        buffers.append(samples)
+    return buffers
+
+def render_notes(score: Score, notes: np.ndarray, variation: tuple = None) -> List:
+    """
+    Return the enveloped mono samples for each row of a note array, rendering
+    only cache misses. Notes without a variation are read from the sample
+    bank when it has them and the score renders at the bank's sample rate. Misses that share an instrument and length (e.g.
+    the notes of a chord) are synthesized together in one oscillator pass.
+    Each note draws its noise from a generator seeded by score.seed and its
+    content, so a buffer is addressed by its content alone. A variation (the
+    event's place in the score, for humanize) gives every note its own stream.
+    With multisampling, notes off their instrument's anchors are derived from
+    the nearest anchor instead; the last part of their key records how.
+    """
+    patch_keys = {
+        instrument: score.instruments[instrument].patch_key()
+        for instrument in np.unique(notes['instrument']).tolist()
+    }
+    settings = {
+        instrument: None if variation is not None else multisample_setting(score, score.instruments[instrument])
+        for instrument in patch_keys
+    }
+    rows = notes[['instrument', 'frequency', 'duration_ms', 'volume']].tolist()
+    midis = notes['midi'].tolist()
+    keys = []
+    for idx, (instrument, frequency, duration_ms, volume) in enumerate(rows):
+        variant = None if variation is None else variation + (idx,)
+        setting = settings[instrument]
+        if setting is not None and multisample_anchor(midis[idx], setting[0]) != midis[idx]:
+            variant = ('multisample',) + setting
+        keys.append((patch_keys[instrument], frequency, duration_ms, volume, score.seed, variant,
+                     score.sample_rate))
+    bank = score.sample_rate == SAMPLE_RATE
+    buffers = [
+        SAMPLE_BANK.get(*key[:5]) if bank and key[5] is None else None
+        for key in keys
+    ]
+    buffers = [
+        NOTE_CACHE.get(key) if buffer is None else buffer
+        for key, buffer in zip(keys, buffers)
+    ]
+
+    pending = {}
+    for idx, ((instrument, _, duration_ms, _), buffer) in enumerate(zip(rows, buffers)):
+        if buffer is None:
+            derived = keys[idx][5] is not None and keys[idx][5][0] == 'multisample'
+            pending.setdefault((instrument, duration_ms, derived), []).append(idx)
+
+    for (instrument, duration_ms, derived), indices in pending.items():
+        frequencies = [rows[idx][1] for idx in indices]
+        volumes = [rows[idx][3] for idx in indices]
+        if derived:
+            tones = derive_notes(
+                score, score.instruments[instrument], frequencies, [midis[idx] for idx in indices],
+                duration_ms, volumes, *settings[instrument]
+            )
+        else:
+            tones = synthesize_notes(
+                score.instruments[instrument], frequencies, duration_ms, volumes, score.seed,
+                [keys[idx][5] for idx in indices], score.sample_rate
+            )
+        for idx, samples in zip(indices, tones):
+            buffers[idx] = NOTE_CACHE.put(keys[idx], samples)
+
+    return buffers
+
+# Reference note lengths and volumes baked for every instrument and pitch
+BANK_DURATIONS_MS = (250, 500, 1000)
+BANK_VOLUMES = (0.7,)
+# Tones synthesized per oscillator pass while baking
+BANK_CHUNK = 16
+
+def bake_sample_bank(path: str, instruments: Dict[str, 'Instrument'],
+                     durations_ms=BANK_DURATIONS_MS, volumes=BANK_VOLUMES,
+                     seed: int = DEFAULT_SEED, scores: List[Score] = ()) -> dict:
+    """
+    Render every instrument at every pitch of NOTE_FREQUENCIES, at each
+    reference length and volume, plus every note played in the given scores,
+    into a sample bank file. Buffers are rendered exactly as render_notes
+    would render them with this seed, so a bank hit is bit-identical to
+    synthesizing the note. Returns the bank header.
+    """
+    frequencies = sorted({frequency for frequency in NOTE_FREQUENCIES.values() if frequency > 0})
+    # (patch key, duration) -> instrument and the (frequency, volume) pairs to bake
+    plan = {}
+
+    def add(instrument, duration_ms, frequency, volume):
+        if instrument.name == 'none':
+            return
+        group = plan.setdefault((instrument.patch_key(), float(duration_ms)), (instrument, {}))
+        group[1].setdefault((float(frequency), float(volume)), None)
+
+    for instrument in instruments.values():
+        for duration_ms in durations_ms:
+            for volume in volumes:
+                for frequency in frequencies:
+                    add(instrument, duration_ms, frequency, volume)
+    for score in scores:
+        for section in score.sections:
+            for instrument, frequency, duration_ms, volume in section.notes[
+                    ['instrument', 'frequency', 'duration_ms', 'volume']].tolist():
+                add(score.instruments[instrument], duration_ms, frequency, volume)
+
+    total = sum(len(pairs) for _, pairs in plan.values())
+
+    def entries():
+        done = 0
+        for (patch_key, duration_ms), (instrument, pairs) in plan.items():
+            pairs = list(pairs)
+            for chunk in range(0, len(pairs), BANK_CHUNK):
+                notes = pairs[chunk:chunk + BANK_CHUNK]
+                tones = synthesize_notes(
+                    instrument, [frequency for frequency, _ in notes], duration_ms,
+                    [volume for _, volume in notes], seed
                 )
-                note_audio = apply_enhanced_envelope(note_audio, item.instrument)
-                
-                # Pan different tracks slightly for width
-                if track_idx % 2 == 0:
-                    note_audio = note_audio.pan(0.2)
-                else:
-                    note_audio = note_audio.pan(-0.2)
-                
-                track_audio = track_audio.overlay(note_audio, position=current_position)
-            
-            current_position += item.duration_ms
-            track_progress += 1
-            
-        elif isinstance(item, Chord):
-            chord_notes = []
-            for note in item.notes:
-                frequency = NOTE_FREQUENCIES.get(note.pitch, 0)
-                if frequency > 0:
-                    note_audio = generate_instrument_tone(
-                        frequency,
-                        note.instrument,
-                        note.duration_ms,
-                        note.volume
-                    )
-                    note_audio = apply_enhanced_envelope(note_audio, note.instrument)
-                    chord_notes.append(note_audio)
-                track_progress += 1
-            
-            if chord_notes:
-                chord_audio = mix_audio(*chord_notes)
-                if track_idx % 2 == 0:
-                    chord_audio = chord_audio.pan(0.2)
-                else:
-                    chord_audio = chord_audio.pan(-0.2)
-                track_audio = track_audio.overlay(chord_audio, position=current_position)
-            
-            current_position += max(note.duration_ms for note in item.notes)
-        
-        # Update progress
-        track_percentage = (track_progress / track_note_count) * 100
-        print(f"[Track {track_idx + 1}] Progress: {track_percentage:.1f}%")
+                for (frequency, volume), samples in zip(notes, tones):
+                    yield (patch_key, frequency, duration_ms, volume, seed), samples
+                done += len(notes)
+                PROGRESS.progress("Baking", done, total)
+
+    return write_sample_bank(
+        path, entries(), seed=seed, durations_ms=list(durations_ms), volumes=list(volumes),
+        instruments=sorted(instruments)
+    )
+
+# Tracks alternate slightly left and right for width
+TRACK_PAN = 0.2
+
+def track_pan(track_idx: int) -> float:
+    return TRACK_PAN if track_idx % 2 == 0 else -TRACK_PAN
+
+@functools.lru_cache(maxsize=None)
+def _voice_gains(count: int, pan: float) -> np.ndarray:
+    gains = spread_gains(count, pan).astype(np.float32)
+    gains.flags.writeable = False
+    return gains
+
+def render_voices(score: Score, notes: np.ndarray, track_idx: int,
+                  section_idx: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Render a single note or the notes of one chord as mono voices, each with
+    the (2, 1) gain matrix that pans it onto its track's stereo bus. Chord
+    notes are spread across the stereo field and gain staged together.
+    """
+    variation = None
+    if score.humanize:
+        variation = (track_idx, section_idx, int(notes['onset'][0]))
+    buffers = render_notes(score, notes, variation)
+    gains = _voice_gains(len(buffers), track_pan(track_idx))
+    return [(samples, gains[:, idx:idx + 1]) for idx, samples in enumerate(buffers)]
+
+# Estimated milliseconds of synthesis per note batch. The target is fixed, so
+# batch boundaries, and with them the order every stem is summed in, do not
+# depend on the worker count or backend.
+BATCH_COST_MS = 25.0
+
+def event_cost(score: Score, notes: np.ndarray) -> float:
+    """Estimated milliseconds to render one event, from the cost model of its instruments"""
+    return sum(
+        tone_cost(score.instruments[instrument], duration_ms, frequency, score.sample_rate)
+        for instrument, duration_ms, frequency
+        in notes[['instrument', 'duration_ms', 'frequency']].tolist()
+    )
+
+def event_batches(score: Score, events: List[np.ndarray]) -> List[Tuple[int, int, float]]:
+    """Split events into (start, end, cost) runs of consecutive events of about BATCH_COST_MS each"""
+    batches, start, cost = [], 0, 0.0
+    for idx, notes in enumerate(events):
+        cost += event_cost(score, notes)
+        if cost >= BATCH_COST_MS:
+            batches.append((start, idx + 1, cost))
+            start, cost = idx + 1, 0.0
+    if start < len(events):
+        batches.append((start, len(events), cost))
+    return batches
+
+def render_batch(score: Score, events: List[np.ndarray], track_idx: int,
+                 section_idx: int, allocate=None) -> Tuple[int, np.ndarray]:
+    """
+    Render a batch of events of one section into a private partial stem.
+    Returns the frame of the first onset and the (2, frames) partial starting
+    there. allocate(shape), if given, provides the zeroed partial buffer.
+    """
+    offset = int(events[0]['onset'][0])
+    voices = []
+    for notes in events:
+        onset = int(notes['onset'][0]) - offset
+        voices.extend(
+            (onset, samples, gains) for samples, gains in render_voices(score, notes, track_idx, section_idx)
+        )
     
-    print(f"[Track {track_idx + 1}] Completed")
-    return track_idx, track_audio
+    with TRACER.span('overlay', voices=len(voices)):
+        frames = max(onset + samples.shape[-1] for onset, samples, _ in voices)
+        if allocate is None:
+            partial = StereoBus(frames=frames)
+        else:
+            partial = StereoBus(buffer=allocate((2, frames)))
+        for onset, samples, gains in voices:
+            partial.insert(samples, onset, gains)
+    return offset, partial.samples
+
+def reduce_stem(partials: List[Tuple[int, np.ndarray]], scratch: ScratchStore = None) -> StereoBus:
+    """
+    Sum the partials of a section in batch order into a stem long enough to
+    hold every release tail, allocated from the scratch store if one is given.
+    """
+    frames = max((offset + samples.shape[-1] for offset, samples in partials), default=0)
+    if scratch is None:
+        stem = StereoBus(frames=frames)
+    else:
+        stem = StereoBus(buffer=scratch.zeros((2, frames)))
+    for offset, samples in partials:
+        stem.add_at_frame(samples, offset)
+    return stem
+
+# Frames of the final mix assembled per pass
+MIX_BLOCK_FRAMES = 1 << 18
+
+def mix_stems(score: Score, stem_buffers: Dict[Tuple[int, int], np.ndarray], mix: np.ndarray):
+    """
+    Lay every track out from its section stems, once per repeat, compress it
+    and add it to mix, one block of frames at a time, so no full-length
+    track bus is held. Every sample is summed in the same order as mixing
+    whole tracks would, so the result is identical.
+    """
+    section_ids = {id(section): idx for idx, section in enumerate(score.sections)}
+    tracks = []
+    for track_idx in range(score.track_count):
+        starts, stems = [], []
+        for start_ms, section in score.iter_track(track_idx):
+            stem = stem_buffers.get((track_idx, section_ids[id(section)]))
+            if stem is not None:
+                starts.append(ms_to_frames(start_ms, score.sample_rate))
+                stems.append(stem)
+        starts = np.array(starts, dtype=np.int64)
+        ends = starts + np.array([stem.shape[-1] for stem in stems], dtype=np.int64)
+        tracks.append((starts, ends, stems))
+
+    frames = mix.shape[1]
+    track_block = np.empty((2, min(frames, MIX_BLOCK_FRAMES)), dtype=np.float32)
+    for block_start in range(0, frames, MIX_BLOCK_FRAMES):
+        block_end = min(block_start + MIX_BLOCK_FRAMES, frames)
+        block = track_block[:, :block_end - block_start]
+        for starts, ends, stems in tracks:
+            block.fill(0)
+            for idx in np.flatnonzero((starts < block_end) & (ends > block_start)).tolist():
+                start, stem = int(starts[idx]), stems[idx]
+                begin, end = max(block_start, start), min(block_end, int(ends[idx]))
+                block[:, begin - block_start:end - block_start] += stem[:, begin - start:end - start]
+            compress(block)
+            mix[:, block_start:block_end] += block
+        PROGRESS.progress("Mixing", block_end, frames)
+
+def stem_key(score: Score, section: ScoreSection, track_idx: int) -> str:
+    """
+    Hash of everything a section's stem on one track depends on: its notes,
+    the patches of their instruments and how they are multisampled, the
+    track's pan, the seed, the sample rate and the engine version. Edits
+    elsewhere in the score leave it alone, unless humanize is on, which also
+    ties it to the track and section index.
+    """
+    notes = section.track_notes(track_idx)
+    instruments, instrument_index = np.unique(notes['instrument'], return_inverse=True)
+    group = notes['group']
+    # Chord ids count across the whole section, so only keep where events start
+    event_starts = (group < 0) | np.concatenate(([True], group[1:] != group[:-1]))
+
+    digest = hashlib.sha256()
+    digest.update(repr((
+        ENGINE_VERSION, score.sample_rate, track_idx % 2, score.seed,
+        (track_idx, score.sections.index(section)) if score.humanize else None,
+        [score.instruments[instrument].patch_key() for instrument in instruments.tolist()],
+        [multisample_setting(score, score.instruments[instrument]) for instrument in instruments.tolist()]
+    )).encode())
+    for column in (notes['onset'], notes['duration_ms'], notes['frequency'], notes['volume'],
+                   instrument_index.astype(np.int64), group >= 0, event_starts):
+        digest.update(np.ascontiguousarray(column).tobytes())
+    return digest.hexdigest()
 
-def parse_sheet_music(sheet_music):
-    """Multithreaded sheet music parser with enhanced mixing and effects"""
-    print("Analyzing sheet music structure...")
+def compile_sheet_music(sheet_music) -> Score:
+    """Accept a compiled Score as is, or compile plain lists of notes and chords"""
+    if isinstance(sheet_music, Score):
+        return sheet_music
+    return Score.from_tracks(sheet_music)
+
+BACKENDS = ('thread', 'process')
+
+def _cache_counters(stem_cache: StemCache = None) -> Dict[str, int]:
+    stats = NOTE_CACHE.stats()
+    counters = {key: stats[key] for key in ('hits', 'misses', 'evictions')}
+    stem_stats = stem_cache.stats() if stem_cache is not None else {}
+    for key in ('hits', 'misses', 'evictions'):
+        counters[f'stem_{key}'] = stem_stats.get(key, 0)
+    bank_stats = SAMPLE_BANK.stats()
+    for key in ('hits', 'misses'):
+        counters[f'bank_{key}'] = bank_stats[key]
+    return counters
+
+def _render_batch_task(task_idx: int, score: Score, events: List[np.ndarray], track_idx: int,
+                       section_idx: int, segment_name: str = None,
+                       trace: bool = False) -> Tuple[int, Tuple, Dict[str, int], List]:
+    """
+    Render one batch in a worker process. With segment_name the partial is
+    rendered into a new shared memory segment of that name and left for the
+    parent (see core.shared_partials); otherwise it is pickled back. Returns
+    (offset, shape, samples or None) with the note cache counts of the batch
+    and, with trace, the spans recorded for it.
+    """
+    if trace:
+        TRACER.enable()
+    # Forked workers start with a copy of the parent's events
+    TRACER.clear()
+    before = _cache_counters()
+    segment = None
     
-    # set the terminal title
-    print("\033]0;Sheet Music Parser\007", end="")
+    def allocate(shape):
+        nonlocal segment
+        segment, buffer = create_segment(segment_name, shape)
+        return buffer
+    
+    try:
+        with TRACER.tags(track=track_idx + 1), TRACER.span('batch', events=len(events)):
+            offset, samples = render_batch(score, events, track_idx, section_idx,
+                                           allocate if segment_name else None)
+    except BaseException:
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+        raise
+    partial = offset, samples.shape, None if segment is not None else samples
+    if segment is not None:
+        del samples
+        hand_over(segment)
+    after = _cache_counters()
+    return task_idx, partial, {key: after[key] - before[key] for key in after}, TRACER.events
+
+def _wait_for_tasks(executor, futures, cancel_event=None, shared=False, on_result=None):
+    """
+    Collect task results as they complete, cancelling everything on Ctrl+C.
+    Tasks that have not started are dropped once cancel_event is set; a
+    shared executor is left running for the next render. If on_result is
+    given, what it returns for each result is collected instead.
+    """
+    results, pending = [], set(futures)
+    try:
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, timeout=None if cancel_event is None else 0.1,
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                result = future.result()
+                results.append(on_result(result) if on_result else result)
+            if cancel_event is not None and cancel_event.is_set():
+                raise RenderCancelled("Render cancelled")
+        return results
+    except KeyboardInterrupt:
+        PROGRESS.emit('interrupted')
+        if shared:
+            for future in pending:
+                future.cancel()
+        else:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return None
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        raise
+
+def _plan_batches(score: Score, stem_cache: StemCache = None):
+    """
+    Read every stem the stem cache already has and split the rest into note
+    batches. Returns the cached stems and the cache keys of the missing ones,
+    both by (track_idx, section_idx), plus the batch tasks as (track_idx,
+    section_idx, events) and their estimated costs.
+    """
+    stem_buffers, keys, tasks, costs = {}, {}, [], []
+    for track_idx in range(score.track_count):
+        for section_idx, section in enumerate(score.sections):
+            if (track_idx >= section.track_count or section.repeat_count <= 0
+                    or len(section.track_notes(track_idx)) == 0):
+                continue
+            if stem_cache is not None:
+                key = stem_key(score, section, track_idx)
+                with TRACER.span('stem_cache.read', track=track_idx + 1):
+                    samples = stem_cache.get(key)
+                if samples is not None:
+                    stem_buffers[track_idx, section_idx] = samples
+                    continue
+                keys[track_idx, section_idx] = key
+            events = section.track_events(track_idx)
+            for start, end, cost in event_batches(score, events):
+                tasks.append((track_idx, section_idx, events[start:end]))
+                costs.append(cost)
+    return stem_buffers, keys, tasks, costs
 
-    # Calculate total duration and count notes
-    total_duration = 0
-    note_counts = {}  # Track note counts per track
-    total_notes = 0
+def parse_sheet_music(sheet_music, backend: str = 'thread', workers: int = None,
+                      stem_cache: StemCache = None, executor: concurrent.futures.Executor = None,
+                      cancel_event: threading.Event = None, master: MasterBus = None,
+                      scratch_dir: str = None, spill_bytes: int = DEFAULT_SPILL_BYTES):
+    """
+    Multithreaded sheet music parser with enhanced mixing and effects.
+    Every section of every track is split into batches of consecutive notes,
+    sized by the estimated synthesis cost of their instruments, so one dense
+    track is spread over all workers instead of rendering serially. Threads
+    balance the batches by work stealing; with backend='process' they go to
+    worker processes largest first. Each batch renders into a private partial
+    buffer, and the partials of a section are summed in batch order into its
+    stem, so the output does not depend on the backend or worker count.
+    With a stem_cache only the sections whose notes changed since an earlier
+    render are synthesized; everything else is remixed from disk.
+    A long-lived executor of the backend's kind can be passed in to keep its
+    workers (and their note caches) warm between renders. Setting
+    cancel_event raises RenderCancelled; worker processes finish the batch
+    they are on. A master bus, if given, limits and normalizes the final mix.
+    Partials, stems and the mix stay in RAM up to spill_bytes; past that they
+    go to scratch files in scratch_dir (default: the system temp directory),
+    which are deleted when the render ends. Tracks are mixed block by block
+    from the stems, so no full-length track bus is held either. Worker
+    processes render their partials into shared memory, which the parent
+    reads in place instead of unpickling them.
+    Returns the mixed Timeline, or None if the render was interrupted. A mix
+    that spilled stays mapped from its scratch file until the Timeline is
+    dropped, so export it with Timeline.blocks() rather than converting it whole.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    with ScratchStore(scratch_dir, spill_bytes) as scratch, SharedPartials() as shared:
+        return _render_score(sheet_music, backend, workers, stem_cache, executor, cancel_event,
+                             master, scratch, shared)
+
+def _render_score(sheet_music, backend, workers, stem_cache, executor, cancel_event, master,
+                  scratch: ScratchStore, shared: SharedPartials):
+
+    score = compile_sheet_music(sheet_music)
+    track_count = score.track_count
     
-    for track_idx, track in enumerate(sheet_music):
-        track_duration = 0
-        track_note_count = 0
-        for item in track:
-            if isinstance(item, Note):
-                track_duration += item.duration_ms
-                track_note_count += 1
-            elif isinstance(item, Chord):
-                duration = max(note.duration_ms for note in item.notes)
-                track_duration += duration
-                track_note_count += len(item.notes)
-        total_duration = max(total_duration, track_duration)
-        note_counts[track_idx] = track_note_count
-        total_notes += track_note_count
+    # Durations and note counts come straight from the compiled section arrays
+    total_duration = score.duration_ms
+    total_notes = int(score.note_counts().sum())
     
-    print(f"Total duration: {total_duration/1000:.1f} seconds")
-    print(f"Total notes: {total_notes}\n")
+    PROGRESS.emit('analyze', duration_ms=total_duration, notes=total_notes)
     
-    # Prepare track information for parallel processing
-    track_infos = [
-        (idx, track, total_duration, note_counts[idx], note_counts)
-        for idx, track in enumerate(sheet_music)
-    ]
+    before = _cache_counters(stem_cache)
+    stem_buffers, keys, tasks, costs = _plan_batches(score, stem_cache)
     
-    # Process tracks in parallel
-    processed_tracks = {}
-    max_workers = min(len(sheet_music), 4)  # Limit max threads
+    # Progress is reported per track, in events
+    track_totals = [0] * track_count
+    for track_idx, _, events in tasks:
+        track_totals[track_idx] += len(events)
+    track_done = [0] * track_count
+    progress_lock = threading.Lock()
     
-    print(f"Processing {len(sheet_music)} tracks using {max_workers} threads...")
+    def on_batch(task):
+        track_idx, _, events = task
+        with progress_lock:
+            track_done[track_idx] += len(events)
+            done = track_done[track_idx]
+        PROGRESS.progress(f"Track {track_idx + 1}", done, track_totals[track_idx])
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all track processing tasks
-        future_to_track = {
-            executor.submit(process_track, track_info): track_info[0]
-            for track_info in track_infos
-        }
+    # Render the batches in parallel
+    if backend == 'process':
+        if executor is None:
+            max_workers = max(1, min(len(tasks), workers or os.cpu_count() or 1))
+            PROGRESS.emit('dispatch', batches=len(tasks), workers=max_workers, backend=backend, shared=False)
+            batch_executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            PROGRESS.emit('dispatch', batches=len(tasks), workers=None, backend=backend, shared=True)
+            batch_executor = executor
+        
+        # Workers only need the instruments, not the sections
+        batch_score = Score(score.instruments, [], score.track_instruments, score.sample_rate,
+                            score.seed, score.humanize, score.multisample, score.quality)
+        partials = [None] * len(tasks)
+        
+        def keep_result(result):
+            task_idx, (offset, shape, samples), counts, events = result
+            if samples is None:
+                samples = shared.attach(task_idx, shape)
+            samples = scratch.keep(samples)
+            if not isinstance(samples, np.ndarray):
+                # Spilled to disk, so its segment can go
+                shared.release(task_idx)
+            partials[task_idx] = offset, samples
+            on_batch(tasks[task_idx])
+            return counts, events
+        
+        # The pool's queue hands the largest batches out first
+        order = sorted(range(len(tasks)), key=lambda idx: -costs[idx])
+        futures = []
+        try:
+            for task_idx in order:
+                futures.append(batch_executor.submit(
+                    _render_batch_task, task_idx, batch_score, tasks[task_idx][2], tasks[task_idx][0],
+                    tasks[task_idx][1], shared.name(task_idx), TRACER.enabled
+                ))
+            results = _wait_for_tasks(batch_executor, futures, cancel_event,
+                                      shared=executor is not None, on_result=keep_result)
+        finally:
+            # Segments of batches still running or never read are unlinked when they finish
+            for task_idx, future in zip(order, futures):
+                future.add_done_callback(functools.partial(shared.discard, task_idx))
+            if executor is None:
+                batch_executor.shutdown()
+        if results is None:
+            return None
+        for _, events in results:
+            TRACER.extend(events)
+        # Note cache and sample bank counts come from the workers, stem cache counts from here
+        after = _cache_counters(stem_cache)
+        cache_counts = {key: after[key] - before[key] for key in after}
+        for key in ('hits', 'misses', 'evictions', 'bank_hits', 'bank_misses'):
+            cache_counts[key] = sum(counts[key] for counts, _ in results)
+    else:
+        if executor is None:
+            max_workers = min(len(tasks), workers or 4)  # Limit max threads
+            PROGRESS.emit('dispatch', batches=len(tasks), workers=max(max_workers, 1), backend=backend,
+                          shared=False)
+        else:
+            max_workers = min(len(tasks), executor._max_workers)
+            PROGRESS.emit('dispatch', batches=len(tasks), workers=max_workers, backend=backend, shared=True)
+        scheduler = WorkStealingScheduler(max_workers)
         
-        # Monitor for Ctrl+C
-        while True:
-            try:
-                # Collect results as they complete
-                for future in concurrent.futures.as_completed(future_to_track):
-                    track_idx, track_audio = future.result()
-                    processed_tracks[track_idx] = track_audio
-                break
-            except KeyboardInterrupt:
-                print("\nCtrl+C detected. Cancelling...")
-                executor.shutdown(wait=False, cancel_futures=True)
-                return None
+        def check_cancelled():
+            if cancel_event is not None and cancel_event.is_set():
+                raise RenderCancelled("Render cancelled")
+        
+        def run_batch(task):
+            track_idx, section_idx, events = task
+            with TRACER.tags(track=track_idx + 1), TRACER.span('batch', events=len(events)):
+                offset, samples = render_batch(score, events, track_idx, section_idx)
+            on_batch(task)
+            return offset, scratch.keep(samples)
+        
+        try:
+            partials = scheduler.run(tasks, costs, run_batch, executor, check_cancelled)
+        except KeyboardInterrupt:
+            PROGRESS.emit('interrupted')
+            return None
+        after = _cache_counters(stem_cache)
+        cache_counts = {key: after[key] - before[key] for key in after}
     
-    print("\nAll tracks processed!")
+    # Tasks are in section and batch order, so each stem sums its partials in order
+    stem_tasks = {}
+    for task_idx, (track_idx, section_idx, _) in enumerate(tasks):
+        stem_tasks.setdefault((track_idx, section_idx), []).append(task_idx)
+    for stem_id, task_indices in stem_tasks.items():
+        stem_partials = [partials[idx] for idx in task_indices]
+        with TRACER.span('reduce', track=stem_id[0] + 1, batches=len(stem_partials)):
+            samples = reduce_stem(stem_partials, scratch).samples
+        del stem_partials
+        # Each stem's partials are dropped once it is summed
+        for idx in task_indices:
+            scratch.release(partials[idx][1])
+            partials[idx] = None
+        shared.release(*task_indices)
+        if stem_id in keys:
+            with TRACER.span('stem_cache.write', track=stem_id[0] + 1):
+                samples = stem_cache.put(keys[stem_id], samples)
+        stem_buffers[stem_id] = samples
     
-    # Final mix
-    print("Performing final mix...")
-    final_audio = AudioSegment.silent(duration=total_duration)
+    PROGRESS.emit('mix', tracks=track_count)
     
-    # Mix tracks in order
-    for track_idx in range(len(sheet_music)):
-        print(f"Mixing track {track_idx + 1}/{len(sheet_music)} "
-              f"({((track_idx + 1)/len(sheet_music))*100:.1f}%)")
-        final_audio = final_audio.overlay(processed_tracks[track_idx])
+    # Each track is laid out from its stems, once per repeat, so tails that
+    # cross into the next section are kept, then compressed
+    final_audio = Timeline(buffer=scratch.zeros((2, score.frames)), sample_rate=score.sample_rate)
+    with TRACER.span('mix', tracks=track_count):
+        mix_stems(score, stem_buffers, final_audio.samples)
     
-    print("Audio generation complete!")
+    PROGRESS.emit('cache', stem_cache=stem_cache is not None, **cache_counts)
+    PROGRESS.emit('scratch', **scratch.stats())
+    if master is not None:
+        with TRACER.span('master'):
+            loudness = master.at_sample_rate(score.sample_rate).process(final_audio.samples)
+        PROGRESS.emit('master', **loudness)
+    PROGRESS.emit('done')
     return final_audio
 
 
-def load_sheet_music_from_json(json_path: str, instruments: Dict[str, 'Instrument']) -> List[List[Union['Note', 'Chord']]]:
+STREAM_BLOCK_FRAMES = 4096
+
+def _track_onsets(score: Score, track_idx: int):
+    """Yield (start_frame, track_idx, order, notes, section_idx) for each event of a track in time order"""
+    order = itertools.count()
+    section_ids = {id(section): idx for idx, section in enumerate(score.sections)}
+    events, events_section = None, None
+    for start_ms, section in score.iter_track(track_idx):
+        if section is not events_section:
+            events, events_section = section.track_events(track_idx), section
+        start = ms_to_frames(start_ms, score.sample_rate)
+        for notes in events:
+            yield start + int(notes['onset'][0]), track_idx, next(order), notes, section_ids[id(section)]
+
+def stream_sheet_music(sheet_music, block_frames: int = STREAM_BLOCK_FRAMES,
+                       master: MasterBus = None, loudness: dict = None):
+    """
+    Render sheet music as a generator of float32 (2, block_frames) blocks in
+    int16 units, the last block possibly shorter. Events are pulled from a
+    time-sorted merge of the tracks, with section repeats expanded lazily,
+    and only rendered once the block they start in is reached. A voice is
+    dropped as soon as its last sample has been mixed, so memory stays
+    bounded by the block size plus the notes currently sounding.
+    With a master bus the blocks are mastered as they stream (block sizes
+    then vary by the limiter's look-ahead), and its statistics are written
+    into the loudness dict once the stream ends.
+    """
+    if block_frames <= 0:
+        raise ValueError("block_frames must be positive")
+    score = compile_sheet_music(sheet_music)
+    blocks = _stream_blocks(score, block_frames)
+    if master is not None:
+        blocks = master.at_sample_rate(score.sample_rate).stream(blocks, loudness)
+    return blocks
+
+def _stream_blocks(sheet_music, block_frames: int):
+    score = compile_sheet_music(sheet_music)
+    total_frames = score.frames
+    onsets = heapq.merge(*(
+        _track_onsets(score, track_idx) for track_idx in range(score.track_count)
+    ))
+    upcoming = next(onsets, None)
+    # Each active voice is (start_frame, track_idx, mono samples, gains)
+    active = []
+
+    for block_start in range(0, total_frames, block_frames):
+        block_end = min(block_start + block_frames, total_frames)
+        
+        while upcoming is not None and upcoming[0] < block_end:
+            start_frame, track_idx, _, notes, section_idx = upcoming
+            with TRACER.tags(track=track_idx + 1):
+                active.extend(
+                    (start_frame, track_idx, samples, gains)
+                    for samples, gains in render_voices(score, notes, track_idx, section_idx)
+                )
+            upcoming = next(onsets, None)
+        
+        with TRACER.span('mix', voices=len(active)):
+            # One bus block per track, compressed like the whole track bus would be
+            track_blocks = np.zeros((score.track_count, 2, block_end - block_start), dtype=np.float32)
+            for start_frame, track_idx, samples, gains in active:
+                offset = start_frame - block_start
+                begin = max(0, -offset)
+                end = min(samples.shape[-1], block_end - start_frame)
+                if end > begin:
+                    track_blocks[track_idx, :, offset + begin:offset + end] += gains * samples[begin:end]
+            compress(track_blocks)
+            block = track_blocks.sum(axis=0)
+            active = [
+                voice for voice in active
+                if voice[0] + voice[2].shape[-1] > block_end
+            ]
+        
+        PROGRESS.progress("Streaming", block_end, total_frames)
+        yield block
+
+SCORE_CACHE_DIR = os.path.join(CACHE_DIR, 'scores')
+
+def score_cache_key(source: bytes, instruments: Dict[str, 'Instrument']) -> str:
+    """Content hash of a sheet music file, the instrument table and the engine version"""
+    digest = hashlib.sha256()
+    digest.update(f"engine {ENGINE_VERSION}\n".encode())
+    for name in sorted(instruments):
+        digest.update(f"{name} {instruments[name].patch_key()!r}\n".encode())
+    digest.update(source)
+    return digest.hexdigest()
+
+def load_sheet_music_from_json(json_path: str, instruments: Dict[str, 'Instrument'],
+                               use_cache: bool = True, cache_dir: str = None) -> Score:
     """
-    Load and parse sheet music from a JSON file with metadata and sections support.
-    Now properly handles repeated sections by duplicating the notes.
+    Load sheet music, reusing the compiled score from an earlier run when the
+    file, the instruments and the engine version are all unchanged. Compiled
+    scores live in cache_dir (default SCORE_CACHE_DIR) named by that hash.
     """
     try:
-        with open(json_path, 'r') as f:
-            data = json.load(f)
+        with open(json_path, 'rb') as f:
+            source = f.read()
     except FileNotFoundError:
         raise FileNotFoundError(f"Sheet music file not found: {json_path}")
-    except json.JSONDecodeError:
+    return load_sheet_music_source(source, instruments, use_cache, cache_dir, json_path)
+
+def load_sheet_music_source(source: bytes, instruments: Dict[str, 'Instrument'],
+                            use_cache: bool = True, cache_dir: str = None,
+                            name: str = '<score>') -> Score:
+    """Load sheet music JSON already read into memory, with the same compiled score cache"""
+    with TRACER.span('load', path=os.path.basename(name)):
+        return _load_sheet_music(source, instruments, use_cache, cache_dir, name)
+
+def _load_sheet_music(source, instruments, use_cache, cache_dir, json_path) -> Score:
+    if not use_cache:
+        return compile_sheet_music_json(source, json_path, instruments)
+
+    cache_path = os.path.join(cache_dir or SCORE_CACHE_DIR,
+                              score_cache_key(source, instruments) + '.npz')
+    try:
+        return Score.load(cache_path, instruments)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # Missing, stale or unreadable entries are simply compiled again
+        pass
+
+    with TRACER.span('compile'):
+        score = compile_sheet_music_json(source, json_path, instruments)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        partial_path = f"{cache_path}.{os.getpid()}.tmp"
+        score.save(partial_path, instruments)
+        os.replace(partial_path, cache_path)
+    except (OSError, KeyError):
+        # A score that cannot be cached still renders
+        pass
+    return score
+
+def compile_sheet_music_json(source: bytes, json_path: str, instruments: Dict[str, 'Instrument']) -> Score:
+    """
+    Parse and validate sheet music JSON with metadata and sections support.
+    Each section is compiled once into a Score and repeats refer back to it,
+    so loops are never copied.
+    """
+    try:
+        data = json.loads(source)
+    except (json.JSONDecodeError, UnicodeDecodeError):
         raise ValueError(f"Invalid JSON format in file: {json_path}")
 
     if not isinstance(data, dict):
@@ -181,7 +858,7 @@ def load_sheet_music_from_json(json_path: str, instruments: Dict[str, 'Instrumen
 
     # Handle old format (no sections)
     if 'tracks' in data:
-        sheet_music = []
+        loop_tracks = []
         for track_data in data['tracks']:
             if 'instrument' not in track_data or 'notes' not in track_data:
                 raise ValueError("Each track must specify 'instrument' and 'notes'")
@@ -193,32 +870,29 @@ def load_sheet_music_from_json(json_path: str, instruments: Dict[str, 'Instrumen
             instrument = instruments[instrument_name]
             track = []
 
-            # Duplicate notes for each loop
-            for _ in range(num_loops):
-                for note_data in track_data['notes']:
-                    if isinstance(note_data, dict):
-                        if note_data.get('type') == 'chord':
-                            if 'notes' not in note_data:
-                                raise ValueError("Chord must contain 'notes' array")
-                            chord_notes = []
-                            for chord_note in note_data['notes']:
-                                chord_notes.append(parse_note(chord_note, instrument))
-                            track.append(Chord(chord_notes))
-                        else:
-                            track.append(parse_note(note_data, instrument))
+            for note_data in track_data['notes']:
+                if isinstance(note_data, dict):
+                    if note_data.get('type') == 'chord':
+                        if 'notes' not in note_data:
+                            raise ValueError("Chord must contain 'notes' array")
+                        chord_notes = []
+                        for chord_note in note_data['notes']:
+                            chord_notes.append(parse_note(chord_note, instrument))
+                        track.append(Chord(chord_notes))
                     else:
-                        raise ValueError("Invalid note data format")
+                        track.append(parse_note(note_data, instrument))
+                else:
+                    raise ValueError("Invalid note data format")
 
-            sheet_music.append(track)
+            loop_tracks.append(track)
 
-        return sheet_music
+        # The whole piece is one section played once per loop
+        return Score.from_sections([Section(loop_tracks, num_loops)])
 
     # New format with sections
     if 'sections' not in data:
         raise ValueError("JSON must contain either 'tracks' or 'sections' array")
 
-    sheet_music = []
-
     # First, process each section and create track templates
     section_tracks = []
     for section in data['sections']:
@@ -251,26 +925,16 @@ def load_sheet_music_from_json(json_path: str, instruments: Dict[str, 'Instrumen
             tracks_in_section.append(track)
 
         if tracks_in_section:
-            section_tracks.append({
-                'tracks': tracks_in_section,
-                'repeat': section.get('repeat', False)
-            })
-
-    # Now create the final sheet music with proper repeats
-    final_tracks = [[] for _ in range(len(section_tracks[0]['tracks']))]
-
-    # For each section
-    for section_data in section_tracks:
-        repeat_count = num_loops if section_data['repeat'] else 1
-
-        # For each repeat of the section
-        for _ in range(repeat_count):
-            # For each track in the section
-            for track_idx, track in enumerate(section_data['tracks']):
-                # Add all notes from this track
-                final_tracks[track_idx].extend(track)
-
-    return final_tracks
+            repeat_count = num_loops if section.get('repeat', False) else 1
+            section_tracks.append(
+                Section(tracks_in_section, repeat_count, section.get('name'))
+            )
+
+    if not section_tracks:
+        raise ValueError("Sheet music has no sections with playable tracks")
+
+    # Repeats are played from the compiled sections rather than copied
+    return Score.from_sections(section_tracks)
 
 def parse_note(note_data: dict, instrument: 'Instrument') -> 'Note':
     """Parse a single note from JSON data"""
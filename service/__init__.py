@@ -0,0 +1,3 @@
+from .jobs import Job, RenderService, JOB_STATES
+from .server import RenderServer, serve
+from .batch import BatchRenderer, collect_scores, estimate_cost, write_manifest
@@ -0,0 +1,266 @@
+"""
+Batch rendering of many scores in one process.
+
+An asyncio scheduler drives three overlapping stages:
+1. Every score is loaded through the compiled score cache.
+2. Scores are rendered on one shared track pool, most expensive first, a
+   few at a time, so note batches from different scores keep the workers busy.
+3. Finished renders are encoded while later scores are still rendering.
+
+The track pool outlives every score, so its workers keep their note caches,
+and the on-disk stem cache is shared as well. A JSON manifest records each
+score's outputs, timings and any failure.
+"""
+import asyncio
+import concurrent.futures
+import glob
+import json
+import os
+import platform
+import threading
+import time
+
+from core.export import FORMATS, export_blocks, output_paths
+from core.instruments import AVAILABLE_INSTRUMENTS
+from core.seeding import DEFAULT_SEED
+from core.tracing import PROGRESS
+from core.quality import DEFAULT_QUALITY, quality_tier
+from core.scratch import DEFAULT_SPILL_BYTES
+from parsers.sheet_music import BACKENDS, RenderCancelled, load_sheet_music_from_json, parse_sheet_music
+
+from .jobs import Job
+
+# A millisecond of a track mixed costs about this much of a millisecond synthesized
+MIX_WEIGHT = 0.05
+
+
+def collect_scores(pattern):
+    """Score files from a directory (every *.json in it) or a glob pattern, sorted"""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.json')
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+
+def estimate_cost(score):
+    """
+    Relative render cost of a compiled score: every section's notes are
+    synthesized once, and every track is mixed for its full length.
+    """
+    synthesized = sum(float(section.notes['duration_ms'].sum()) for section in score.sections)
+    return synthesized + MIX_WEIGHT * float(score.track_durations_ms().sum())
+
+
+def _output_stems(paths, output_dir):
+    """Output path stem per score, numbering scores that share a file name"""
+    stems, seen = {}, {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        seen[name] = seen.get(name, 0) + 1
+        suffix = f"-{seen[name]}" if seen[name] > 1 else ''
+        stems[path] = os.path.join(output_dir, name + suffix)
+    return stems
+
+
+class BatchRenderer:
+    """
+    Render a list of score files into output_dir.
+
+    renders   scores rendered at the same time, on the shared track pool
+    encoders  scores encoded at the same time
+    master    MasterBus every score goes through
+    seed      seed of every score's notes; humanize varies repeated notes
+    multisample  anchor spacing and resample quality per instrument, see Score
+    quality   quality tier every score is rendered at
+    scratch_dir  where renders spill buffers past spill_bytes (default: the system temp directory)
+    spill_bytes  bytes of buffers each render keeps in RAM
+    """
+
+    def __init__(self, paths, output_dir, formats=('mp3',), backend='process', workers=None,
+                 renders=2, encoders=2, stem_cache=None, use_cache=True, instruments=None, master=None,
+                 seed=DEFAULT_SEED, humanize=False, multisample=None, quality=DEFAULT_QUALITY,
+                 scratch_dir=None, spill_bytes=DEFAULT_SPILL_BYTES):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        quality_tier(quality)
+        for fmt in formats:
+            if fmt not in FORMATS:
+                raise ValueError(f"Unknown export format: {fmt}")
+        self.paths = list(paths)
+        self.output_dir = output_dir
+        self.formats = list(dict.fromkeys(formats))
+        self.backend = backend
+        self.workers = workers or ((os.cpu_count() or 1) if backend == 'process' else 4)
+        self.renders = renders
+        self.encoders = encoders
+        self.stem_cache = stem_cache
+        self.use_cache = use_cache
+        self.instruments = instruments or AVAILABLE_INSTRUMENTS
+        self.master = master
+        self.seed = seed
+        self.humanize = humanize
+        self.multisample = multisample or {}
+        self.quality = quality
+        self.scratch_dir = scratch_dir
+        self.spill_bytes = spill_bytes
+        self.cancel_event = threading.Event()
+        self.entries = []
+        self._encoded = 0
+        self._encoded_lock = threading.Lock()
+
+    def run(self):
+        """Render every score and return the manifest"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        start = time.perf_counter()
+        started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        asyncio.run(self._run())
+        return self.manifest(started_at, time.perf_counter() - start)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        if self.backend == 'process':
+            self._tracks = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self._tracks = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        # Blocking stages run on their own threads so the event loop only schedules
+        stages = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.renders + self.encoders + 2, thread_name_prefix='batch'
+        )
+        render_slots = asyncio.Semaphore(self.renders)
+        encode_slots = asyncio.Semaphore(self.encoders)
+        stems = _output_stems(self.paths, self.output_dir)
+
+        try:
+            jobs = [Job(None, self.formats, path) for path in self.paths]
+            loaded = await asyncio.gather(*(
+                loop.run_in_executor(stages, self._load, job) for job in jobs
+            ))
+
+            # Longest first, so the last scores to finish are the short ones
+            pending = sorted(
+                (entry for entry in loaded if entry['score'] is not None),
+                key=lambda entry: -entry['estimated_cost']
+            )
+            for position, entry in enumerate(pending):
+                entry['order'] = position
+            self.entries = loaded
+
+            async def render_and_encode(entry):
+                job = entry['job']
+                async with render_slots:
+                    if self.cancel_event.is_set():
+                        job.finish('cancelled')
+                        return
+                    job.stamp('render_started')
+                    audio = await loop.run_in_executor(stages, self._render, job, entry['score'])
+                entry['score'] = None
+                if audio is None:
+                    return
+                async with encode_slots:
+                    job.stamp('encode_started')
+                    await loop.run_in_executor(stages, self._encode, job, entry, audio, stems[job.name])
+
+            # Semaphores hand out slots in the order the tasks ask for them
+            await asyncio.gather(*(render_and_encode(entry) for entry in pending))
+        except BaseException:
+            # Ctrl+C or a scheduler error: stop the renders still running
+            self.cancel_event.set()
+            raise
+        finally:
+            stages.shutdown(wait=True)
+            self._tracks.shutdown(wait=True, cancel_futures=True)
+
+    def _load(self, job):
+        job.stamp('started')
+        entry = {'job': job, 'score': None, 'estimated_cost': None, 'outputs': []}
+        try:
+            score = load_sheet_music_from_json(job.name, self.instruments, use_cache=self.use_cache)
+        except Exception as e:
+            job.finish('failed', f"{type(e).__name__}: {e}")
+            return entry
+        score = score.at_quality(quality_tier(self.quality))
+        job.quality = self.quality
+        score.seed = job.seed = self.seed
+        score.humanize = job.humanize = self.humanize
+        score.multisample = self.multisample
+        job.notes = int(score.note_counts().sum())
+        job.audio_seconds = score.duration_ms / 1000
+        job.stamp('loaded')
+        entry.update(score=score, estimated_cost=round(estimate_cost(score), 1))
+        return entry
+
+    def _render(self, job, score):
+        try:
+            audio = parse_sheet_music(
+                score, backend=self.backend, stem_cache=self.stem_cache,
+                executor=self._tracks, cancel_event=self.cancel_event, master=self.master,
+                scratch_dir=self.scratch_dir, spill_bytes=self.spill_bytes
+            )
+            if audio is None:
+                raise RenderCancelled("Render interrupted")
+        except RenderCancelled:
+            job.finish('cancelled')
+            return None
+        except Exception as e:
+            job.finish('failed', f"{type(e).__name__}: {e}")
+            return None
+        job.stamp('rendered')
+        return audio
+
+    def _encode(self, job, entry, audio, stem):
+        try:
+            entry['outputs'] = export_blocks(audio.blocks(), output_paths(stem, self.formats),
+                                             audio.sample_rate, audio.channels)
+        except Exception as e:
+            job.finish('failed', f"{type(e).__name__}: {e}")
+            return
+        job.stamp('encoded')
+        job.finish('done')
+        with self._encoded_lock:
+            self._encoded += 1
+            encoded = self._encoded
+        PROGRESS.progress('batch', encoded, len(self.paths), score=job.name, outputs=entry['outputs'],
+                          render_seconds=job.timing().get('render_seconds', 0))
+
+    def manifest(self, started_at, wall_seconds):
+        """Outputs, timings and failures of every score, plus batch totals"""
+        scores = []
+        for entry in self.entries:
+            job = entry['job']
+            scores.append({
+                'source': job.name,
+                'state': job.state,
+                'error': job.error,
+                'outputs': entry['outputs'],
+                'order': entry.get('order'),
+                'estimated_cost': entry['estimated_cost'],
+                'notes': job.notes,
+                'audio_seconds': job.audio_seconds,
+                'timing': job.timing(),
+            })
+        audio_seconds = sum(score['audio_seconds'] for score in scores if score['state'] == 'done')
+        return {
+            'started_at': started_at,
+            'wall_seconds': round(wall_seconds, 3),
+            'host': platform.node(),
+            'backend': self.backend,
+            'workers': self.workers,
+            'renders': self.renders,
+            'encoders': self.encoders,
+            'formats': self.formats,
+            'seed': self.seed,
+            'humanize': self.humanize,
+            'multisample': {name: list(setting) for name, setting in self.multisample.items()},
+            'quality': self.quality,
+            'summary': {
+                state: sum(score['state'] == state for score in scores)
+                for state in ('done', 'failed', 'cancelled')
+            },
+            'audio_seconds': round(audio_seconds, 3),
+            'realtime_factor': round(audio_seconds / wall_seconds, 2) if wall_seconds else None,
+            'scores': scores,
+        }
+
+
+def write_manifest(manifest, path):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
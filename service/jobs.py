@@ -0,0 +1,331 @@
+"""
+Render jobs for the long-running render server.
+
+A RenderService lives for the whole server process, so instruments, the
+note/envelope/resonance caches, the stem cache and the track worker pool
+stay warm from one job to the next. Jobs are queued on a fixed number of
+job runners; each one loads its score JSON, renders it and encodes every
+requested format, recording how long each step took.
+"""
+import collections
+import concurrent.futures
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from core.cache import NOTE_CACHE
+from core.export import FORMATS, export_blocks, output_paths
+from core.instruments import AVAILABLE_INSTRUMENTS
+from core.resonance_bank import RESONANCE_CACHE
+from core.sample_bank import SAMPLE_BANK
+from core.quality import DEFAULT_QUALITY, quality_tier
+from core.scratch import DEFAULT_SPILL_BYTES
+from core.seeding import DEFAULT_SEED
+from core.timeline import samples_to_pcm
+from effects.envelope import ENVELOPE_CACHE
+from parsers.sheet_music import (
+    BACKENDS, RenderCancelled, load_sheet_music_source, parse_sheet_music, stream_sheet_music,
+    STREAM_BLOCK_FRAMES
+)
+
+JOB_STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+
+class Job:
+    """One submitted score, its state, timings and encoded outputs"""
+
+    def __init__(self, source, formats, name=None, seed=None, humanize=None, quality=None):
+        for fmt in formats:
+            if fmt not in FORMATS:
+                raise ValueError(f"Unknown export format: {fmt}")
+        if quality is not None:
+            quality_tier(quality)
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.formats = list(dict.fromkeys(formats))
+        self.name = name or self.id
+        # None takes the service's setting
+        self.seed = seed
+        self.humanize = humanize
+        self.quality = quality
+        self.state = 'queued'
+        self.error = None
+        self.outputs = {}
+        self.notes = 0
+        self.audio_seconds = 0.0
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+        self.future = None
+        self._stamps = {'submitted': time.perf_counter()}
+
+    def stamp(self, name):
+        self._stamps[name] = time.perf_counter()
+
+    def timing(self):
+        """
+        Seconds spent queued, loading, rendering, encoding and in total. Jobs
+        that wait for a render or encoder slot also report those waits.
+        """
+        stamps = self._stamps
+        render_start = 'render_started' if 'render_started' in stamps else 'loaded'
+        encode_start = 'encode_started' if 'encode_started' in stamps else 'rendered'
+        steps = (('queue', 'submitted', 'started'), ('load', 'started', 'loaded'),
+                 ('render_wait', 'loaded', 'render_started'), ('render', render_start, 'rendered'),
+                 ('encode_wait', 'rendered', 'encode_started'), ('encode', encode_start, 'encoded'),
+                 ('total', 'submitted', 'finished'))
+        timing = {
+            f"{name}_seconds": round(stamps[end] - stamps[start], 6)
+            for name, start, end in steps if start in stamps and end in stamps
+        }
+        if self.audio_seconds and 'render_seconds' in timing and timing['render_seconds'] > 0:
+            timing['realtime_factor'] = round(self.audio_seconds / timing['render_seconds'], 2)
+        return timing
+
+    def finish(self, state, error=None):
+        self.state = state
+        self.error = error
+        self.source = None
+        self.stamp('finished')
+        self.finished.set()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'state': self.state,
+            'formats': self.formats,
+            'seed': self.seed,
+            'humanize': self.humanize,
+            'quality': self.quality,
+            'error': self.error,
+            'notes': self.notes,
+            'audio_seconds': self.audio_seconds,
+            'timing': self.timing(),
+        }
+
+
+class RenderService:
+    """
+    Queue of render jobs sharing warm caches and one track worker pool.
+
+    concurrency   jobs and streams rendered at the same time
+    backend       'thread' or 'process' for the shared track pool
+    workers       size of the track pool (default: 4 threads or one process per CPU)
+    max_finished  finished jobs, with their audio, kept for clients to collect
+    master        MasterBus every render (and stream) goes through
+    seed          seed of jobs that do not set their own
+    humanize      humanize setting of jobs that do not set their own
+    multisample   anchor spacing and resample quality per instrument, see Score
+    quality       quality tier of jobs that do not set their own
+    scratch_dir   where renders spill buffers past spill_bytes (default: the system temp directory)
+    spill_bytes   bytes of buffers each render keeps in RAM
+    """
+
+    def __init__(self, concurrency=2, backend='thread', workers=None, stem_cache=None,
+                 instruments=None, max_finished=64, master=None, seed=DEFAULT_SEED, humanize=False,
+                 multisample=None, quality=DEFAULT_QUALITY, scratch_dir=None,
+                 spill_bytes=DEFAULT_SPILL_BYTES):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        quality_tier(quality)
+        self.backend = backend
+        self.stem_cache = stem_cache
+        self.instruments = instruments or AVAILABLE_INSTRUMENTS
+        self.max_finished = max_finished
+        self.master = master
+        self.seed = seed
+        self.humanize = humanize
+        self.multisample = multisample or {}
+        self.quality = quality
+        self.scratch_dir = scratch_dir
+        self.spill_bytes = spill_bytes
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Render slots shared by queued jobs and streams
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._runners = concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix='render-job'
+        )
+        if backend == 'process':
+            self._tracks = concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        else:
+            self._tracks = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers or 4, thread_name_prefix='render-track'
+            )
+
+    def warm_up(self):
+        """Render one short note per instrument so oscillators and caches are ready for the first job"""
+        tracks = [
+            {'instrument': name, 'notes': [{'pitch': 'C4', 'duration': 250, 'volume': 0.7}]}
+            for name in sorted(self.instruments)
+        ]
+        source = json.dumps({'tracks': tracks}).encode()
+        score = load_sheet_music_source(source, self.instruments, use_cache=False, name='warm-up')
+        parse_sheet_music(score, backend=self.backend, executor=self._tracks)
+
+    def submit(self, source, formats=('wav',), name=None):
+        """Queue a score (JSON bytes) and return its Job"""
+        return self.submit_job(Job(source, formats, name))
+
+    def submit_job(self, job):
+        self._register(job)
+        job.future = self._runners.submit(self._run, job)
+        return job
+
+    def _register(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job, or None if it is unknown"""
+        job = self.get(job_id)
+        if job is None or job.finished.is_set():
+            return job
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.finish('cancelled')
+        return job
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished.is_set()]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _load(self, job):
+        job.stamp('started')
+        score = load_sheet_music_source(job.source, self.instruments, name=job.name)
+        job.quality = self.quality if job.quality is None else job.quality
+        score = score.at_quality(quality_tier(job.quality))
+        score.seed = self.seed if job.seed is None else job.seed
+        score.humanize = self.humanize if job.humanize is None else job.humanize
+        job.seed, job.humanize = score.seed, score.humanize
+        score.multisample = self.multisample
+        job.notes = int(score.note_counts().sum())
+        job.audio_seconds = score.duration_ms / 1000
+        job.stamp('loaded')
+        return score
+
+    def _acquire_slot(self, job):
+        """Wait for a render slot, giving up once the job is cancelled"""
+        while not self._slots.acquire(timeout=0.1):
+            if job.cancel_event.is_set():
+                raise RenderCancelled("Cancelled before it started")
+
+    def _run(self, job):
+        try:
+            self._acquire_slot(job)
+        except RenderCancelled:
+            job.finish('cancelled')
+            return
+        job.state = 'running'
+        try:
+            if job.cancel_event.is_set():
+                raise RenderCancelled("Cancelled before it started")
+            score = self._load(job)
+            audio = parse_sheet_music(
+                score, backend=self.backend, stem_cache=self.stem_cache,
+                executor=self._tracks, cancel_event=job.cancel_event, master=self.master,
+                scratch_dir=self.scratch_dir, spill_bytes=self.spill_bytes
+            )
+            if audio is None:
+                raise RenderCancelled("Render interrupted")
+            job.stamp('rendered')
+            job.outputs = self._encode(audio, job)
+            job.stamp('encoded')
+            job.finish('done')
+        except RenderCancelled:
+            job.finish('cancelled')
+        except Exception as e:
+            job.finish('failed', str(e))
+        finally:
+            self._slots.release()
+
+    def _encode(self, audio, job):
+        """Encode every format in one pass into a scratch directory and read the files back"""
+        def blocks():
+            for block in audio.blocks():
+                if job.cancel_event.is_set():
+                    raise RenderCancelled("Encoding cancelled")
+                yield block
+
+        with tempfile.TemporaryDirectory(prefix='render-job-') as directory:
+            outputs = output_paths(os.path.join(directory, 'audio'), job.formats)
+            export_blocks(blocks(), outputs, audio.sample_rate, audio.channels)
+            encoded = {}
+            for path, fmt in outputs:
+                with open(path, 'rb') as f:
+                    encoded[fmt] = f.read()
+        return encoded
+
+    def stream(self, job, block_frames=STREAM_BLOCK_FRAMES):
+        """
+        Render a job block by block on the calling thread, yielding 16-bit PCM
+        as it is mixed. The block size is checked and the job loaded first,
+        so errors surface before any audio is sent. Rendering waits for one
+        of the render slots that queued jobs also take.
+        """
+        if block_frames <= 0:
+            raise ValueError("block_size must be a positive number of frames")
+        self._register(job)
+        try:
+            score = self._load(job)
+        except Exception as e:
+            job.finish('failed', str(e))
+            raise
+        return self._stream_blocks(job, score, block_frames)
+
+    def _stream_blocks(self, job, score, block_frames):
+        try:
+            self._acquire_slot(job)
+        except RenderCancelled:
+            job.finish('cancelled')
+            return
+        job.state = 'running'
+        job.stamp('render_started')
+        try:
+            for block in stream_sheet_music(score, block_frames, self.master):
+                if job.cancel_event.is_set():
+                    raise RenderCancelled("Stream cancelled")
+                yield samples_to_pcm(block)
+            job.stamp('rendered')
+            job.finish('done')
+        except (RenderCancelled, GeneratorExit):
+            job.finish('cancelled')
+        except Exception as e:
+            job.finish('failed', str(e))
+            raise
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        """Job counts per state and the warm caches' counters"""
+        states = collections.Counter(job.state for job in self.jobs())
+        return {
+            'backend': self.backend,
+            'jobs': {state: states.get(state, 0) for state in JOB_STATES},
+            'caches': {
+                'note': NOTE_CACHE.stats(),
+                'envelope': ENVELOPE_CACHE.stats(),
+                'resonance': RESONANCE_CACHE.stats(),
+                'sample_bank': SAMPLE_BANK.stats(),
+                'stem': self.stem_cache.stats() if self.stem_cache is not None else None,
+            },
+        }
+
+    def shutdown(self):
+        for job in self.jobs():
+            job.cancel_event.set()
+        self._runners.shutdown(wait=True, cancel_futures=True)
+        self._tracks.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,233 @@
+"""
+Localhost HTTP front end for the RenderService.
+
+Endpoints (score JSON in the request body, in the sheet music schema):
+
+    POST   /render?format=mp3           render and wait; responds with the audio
+    POST   /jobs?format=wav&format=mp3  queue a job; responds 202 with the job
+    GET    /jobs                        every known job
+    GET    /jobs/<id>                   state, error and per-step timing of a job
+    GET    /jobs/<id>/audio?format=wav  encoded audio of a finished job
+    DELETE /jobs/<id>                   cancel a queued or running job
+    POST   /stream?block_size=4096      raw 16-bit PCM, sent block by block as it renders
+    GET    /health                      job counts and warm cache counters
+
+Renders take ?seed=N, ?humanize=1 and ?quality=draft|normal|final to
+override the server's settings.
+
+The job id and timing are also sent as X-Job-Id and X-Render-Timing headers.
+"""
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from core.quality import quality_tier
+from parsers.sheet_music import STREAM_BLOCK_FRAMES
+
+from .jobs import Job
+
+CONTENT_TYPES = {
+    'wav': 'audio/wav',
+    'mp3': 'audio/mpeg',
+    'flac': 'audio/flac',
+    'ogg': 'audio/ogg',
+}
+
+# Scores larger than this are refused
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'MusicSynthesizer/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _route(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        return parts, parse_qs(url.query)
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': message})
+
+    def _job_headers(self, job):
+        return {'X-Job-Id': job.id, 'X-Render-Timing': json.dumps(job.timing())}
+
+    def _send_audio(self, job, fmt):
+        audio = job.outputs[fmt]
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[fmt])
+        self.send_header('Content-Length', str(len(audio)))
+        for name, value in self._job_headers(job).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(audio)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0:
+            raise ValueError("The request body must hold the score JSON")
+        if length > MAX_BODY_BYTES:
+            raise OverflowError(f"Scores are limited to {MAX_BODY_BYTES} bytes")
+        return self.rfile.read(length)
+
+    def _new_job(self, query, default_formats):
+        """Job from the request body, or None after an error response"""
+        try:
+            source = self._read_body()
+            seed = query.get('seed', [None])[0]
+            humanize = query.get('humanize', [None])[0]
+            return Job(
+                source, query.get('format', default_formats), query.get('name', [None])[0],
+                seed=None if seed is None else int(seed),
+                humanize=None if humanize is None else humanize.lower() in ('1', 'true', 'yes'),
+                quality=query.get('quality', [None])[0]
+            )
+        except OverflowError as e:
+            self._send_error(413, str(e))
+        except ValueError as e:
+            self._send_error(400, str(e))
+        return None
+
+    def _finished_response(self, job, fmt):
+        if job.state == 'done':
+            self._send_audio(job, fmt)
+        elif job.state == 'cancelled':
+            self._send_json(409, job.to_dict(), self._job_headers(job))
+        else:
+            status = 400 if job.timing().get('load_seconds') is None else 500
+            self._send_json(status, job.to_dict(), self._job_headers(job))
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['health']:
+            self._send_json(200, dict(self.service.stats(), status='ok'))
+        elif parts == ['jobs']:
+            self._send_json(200, [job.to_dict() for job in self.service.jobs()])
+        elif len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = self.service.get(parts[1])
+            if job is None:
+                self._send_error(404, f"Unknown job: {parts[1]}")
+            elif len(parts) == 2:
+                self._send_json(200, job.to_dict(), self._job_headers(job))
+            elif parts[2] != 'audio':
+                self._send_error(404, f"Unknown path: {self.path}")
+            elif job.state != 'done':
+                self._send_json(409, job.to_dict(), self._job_headers(job))
+            else:
+                fmt = query.get('format', job.formats)[0]
+                if fmt not in job.outputs:
+                    self._send_error(404, f"Job {job.id} was not encoded as {fmt}")
+                else:
+                    self._send_audio(job, fmt)
+        else:
+            self._send_error(404, f"Unknown path: {self.path}")
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != 'jobs':
+            self._send_error(404, f"Unknown path: {self.path}")
+            return
+        job = self.service.cancel(parts[1])
+        if job is None:
+            self._send_error(404, f"Unknown job: {parts[1]}")
+        else:
+            self._send_json(200, job.to_dict(), self._job_headers(job))
+
+    def do_POST(self):
+        parts, query = self._route()
+        if parts == ['jobs']:
+            job = self._new_job(query, ['wav'])
+            if job is not None:
+                self.service.submit_job(job)
+                self._send_json(202, job.to_dict(), self._job_headers(job))
+        elif parts == ['render']:
+            job = self._new_job(query, ['wav'])
+            if job is None:
+                return
+            if len(job.formats) != 1:
+                self._send_error(400, "/render returns one format; queue a job for several")
+                return
+            self.service.submit_job(job)
+            job.finished.wait()
+            self._finished_response(job, job.formats[0])
+        elif parts == ['stream']:
+            self._stream(query)
+        else:
+            self._send_error(404, f"Unknown path: {self.path}")
+
+    def _stream(self, query):
+        job = self._new_job(query, [])
+        if job is None:
+            return
+        # Everything that can fail is checked before the 200 goes out
+        try:
+            block_frames = int(query.get('block_size', [STREAM_BLOCK_FRAMES])[0])
+            pcm = self.service.stream(job, block_frames)
+        except Exception as e:
+            if job.finished.is_set():
+                # The score did not load
+                self._finished_response(job, None)
+            elif isinstance(e, ValueError):
+                self._send_error(400, str(e))
+            else:
+                raise
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('X-Job-Id', job.id)
+        self.send_header('X-Sample-Format', 's16le')
+        # The job is loaded by now, so its quality tier is settled
+        self.send_header('X-Sample-Rate', str(quality_tier(job.quality).sample_rate))
+        self.send_header('X-Channels', '2')
+        self.end_headers()
+        try:
+            for chunk in pcm:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away: stop rendering its stream
+            pcm.close()
+            self.close_connection = True
+
+
+class RenderServer(ThreadingHTTPServer):
+    """HTTP server owning one RenderService for its whole lifetime"""
+    daemon_threads = True
+
+    def __init__(self, address, service, quiet=False):
+        super().__init__(address, RenderRequestHandler)
+        self.service = service
+        self.quiet = quiet
+
+
+def serve(service, host='127.0.0.1', port=8765, quiet=False):
+    """Serve until interrupted, then cancel outstanding jobs and stop the pools"""
+    server = RenderServer((host, port), service, quiet)
+    print(f"Render server listening on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down render server...")
+    finally:
+        server.server_close()
+        service.shutdown()
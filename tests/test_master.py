@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from core.master import MasterBus, PeakLimiter
+
+
+def loud_noise(frames=44100, seed=0):
+    return (np.random.default_rng(seed).standard_normal((2, frames)) * 30000).astype(np.float32)
+
+
+@pytest.mark.parametrize('block_frames', [1, 7, 220, 4096, 44100])
+def test_limiter_holds_the_ceiling_from_the_first_frame(block_frames):
+    samples = loud_noise()
+    limiter = PeakLimiter()
+    out = [limiter.process(samples[:, start:start + block_frames])
+           for start in range(0, samples.shape[1], block_frames)]
+    out = np.concatenate(out + [limiter.flush()], axis=1)
+
+    assert out.shape == samples.shape
+    assert np.abs(out).max() <= limiter.ceiling
+
+
+def test_limiter_returns_short_inputs_whole():
+    samples = loud_noise(frames=10)
+    limiter = PeakLimiter()
+    out = np.concatenate((limiter.process(samples), limiter.flush()), axis=1)
+
+    assert out.shape == samples.shape
+    assert np.abs(out).max() <= limiter.ceiling
+
+
+def test_master_bus_holds_the_ceiling_from_the_first_frame():
+    samples = loud_noise()
+    master = MasterBus()
+    master.process(samples)
+
+    assert np.abs(samples).max() <= PeakLimiter(master.ceiling_db).ceiling
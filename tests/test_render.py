@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+import pytest
+
+from core.cache import NOTE_CACHE, StemCache
+from core.instruments import AVAILABLE_INSTRUMENTS
+from core.quality import quality_tier
+from core.timeline import SAMPLE_RATE
+from core.tracing import PROGRESS
+from parsers.sheet_music import load_sheet_music_source, parse_sheet_music
+
+SCORE = {'sections': [{'name': 'a', 'tracks': [
+    {'instrument': 'ambient', 'notes': [
+        {'pitch': 'G3', 'duration': 300, 'volume': 1},
+        {'pitch': 'REST', 'duration': 100},
+        {'pitch': 'D4', 'duration': 200, 'volume': 0.7},
+    ]},
+    {'instrument': 'bass', 'notes': [
+        {'pitch': 'G2', 'duration': 250, 'volume': 0.5},
+        {'type': 'chord', 'notes': [
+            {'pitch': 'C3', 'duration': 300, 'volume': 0.5},
+            {'pitch': 'E3', 'duration': 300, 'volume': 0.5},
+        ]},
+    ]},
+    {'instrument': 'claves', 'notes': [
+        {'pitch': 'C2', 'duration': 100, 'volume': 0.3},
+        {'pitch': 'C2', 'duration': 100, 'volume': 0.3},
+    ]},
+]}]}
+
+
+def load_score(seed=0, humanize=False, quality=None):
+    score = load_sheet_music_source(json.dumps(SCORE).encode(), AVAILABLE_INSTRUMENTS, use_cache=False)
+    if quality is not None:
+        score = score.at_quality(quality_tier(quality))
+    score.seed = seed
+    score.humanize = humanize
+    return score
+
+
+def render(score, **options):
+    # Every render synthesizes its notes, not just the first
+    NOTE_CACHE.clear()
+    return parse_sheet_music(score, **options).samples
+
+
+def test_process_backend_matches_threads():
+    score = load_score()
+    reference = render(score, backend='thread', workers=1)
+
+    assert np.array_equal(render(score, backend='thread', workers=4), reference)
+    assert np.array_equal(render(score, backend='process', workers=2), reference)
+
+
+def test_spilled_render_matches_render_in_ram(tmp_path):
+    score = load_score()
+    audio = parse_sheet_music(score, scratch_dir=str(tmp_path), spill_bytes=0)
+
+    assert isinstance(audio.samples, np.memmap)
+    assert np.array_equal(audio.samples, render(score))
+
+
+def test_second_render_reuses_every_stem(tmp_path):
+    score = load_score()
+    stem_cache = StemCache(str(tmp_path))
+    counts = {}
+
+    def on_event(kind, fields):
+        if kind == 'cache':
+            counts.update(fields)
+
+    PROGRESS.subscribe(on_event)
+    try:
+        first = render(score, stem_cache=stem_cache)
+        assert (counts['stem_hits'], counts['stem_misses']) == (0, 3)
+        second = render(score, stem_cache=stem_cache)
+        assert (counts['stem_hits'], counts['stem_misses']) == (3, 0)
+    finally:
+        PROGRESS.unsubscribe(on_event)
+
+    assert np.array_equal(second, first)
+
+
+@pytest.mark.parametrize('quality', ['draft', 'normal', 'final'])
+def test_renders_at_the_sample_rate_of_the_tier(quality):
+    score = load_score(quality=quality)
+    audio = parse_sheet_music(score)
+
+    assert audio.sample_rate == quality_tier(quality).sample_rate
+    assert audio.frames == pytest.approx(score.duration_ms / 1000 * audio.sample_rate, abs=1)
+
+
+def test_draft_renders_at_half_rate():
+    assert quality_tier('draft').sample_rate == SAMPLE_RATE // 2 == 22050
+
+
+@pytest.mark.parametrize('humanize', [False, True])
+def test_seed_decides_the_render(humanize):
+    reference = render(load_score(seed=7, humanize=humanize))
+
+    assert np.array_equal(render(load_score(seed=7, humanize=humanize)), reference)
+    assert not np.array_equal(render(load_score(seed=8, humanize=humanize)), reference)